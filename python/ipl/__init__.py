@@ -6,11 +6,21 @@
 #from .synapticle import Synapticle
 #from .synapton import Synapton
 
-from .organism import Organism
-
 #from .reflex_action_statement import ReflexActionStatement
 
-import ipl.games
-import ipl.nnplanner
+from ._lazy import lazy_exports
+
+
+# Nothing gets imported until it's used. In particular, numpy doesn't get loaded
+# until something needs it, which keeps short-lived worker processes quick to start.
+__all__, __getattr__, __dir__ = lazy_exports(__name__, {
+  'organism': ['Organism'],
+  'async_organism': ['AsyncOrganism', 'AsyncOrganismHost'],
+  'organism_batch': ['OrganismBatch'],
+  'recording': ['TrajectoryRecorder', 'TrajectoryReader'],
+  'checkpoint': ['save_checkpoint', 'load_checkpoint'],
+  'games': [],
+  'nnplanner': [],
+})
 
 
@@ -0,0 +1,34 @@
+
+import importlib
+
+
+def lazy_exports(package_name, exports):
+  """Sets a package up to import its submodules only when something from them is
+  first asked for (PEP 562), instead of all of them up front.
+  Arguments:
+    package_name {str} -- The package's __name__.
+    exports {dict} -- Submodule name to the names it exports. Subpackages and
+        submodules that export nothing can be listed with an empty list.
+  Returns:
+    {(list, function, function)} -- The package's __all__, __getattr__ and __dir__.
+        __all__ covers the exported names, plus the submodules that export nothing.
+  """
+  module_of = {name: module for module, names in exports.items() for name in names}
+
+  def __getattr__(name):
+    if name in exports:
+      return importlib.import_module('.' + name, package_name)
+    module = module_of.get(name)
+    if module is None:
+      raise AttributeError('module {!r} has no attribute {!r}'.format(package_name, name))
+    value = getattr(importlib.import_module('.' + module, package_name), name)
+    # Cache it in the package, so we don't come back here for it.
+    setattr(importlib.import_module(package_name), name, value)
+    return value
+
+  def __dir__():
+    package = importlib.import_module(package_name)
+    return sorted(set(vars(package)) | set(module_of) | set(exports))
+
+  __all__ = list(module_of) + [module for module, names in exports.items() if not names]
+  return __all__, __getattr__, __dir__
@@ -0,0 +1,140 @@
+
+import asyncio
+import concurrent.futures
+import threading
+
+import ipl.nnplanner as nnplanner
+
+
+
+class AsyncOrganismHost:
+  """Runs planning for many asynchronous organism sessions on a shared, bounded
+  set of worker threads.
+
+  Every session's planning searches go through the same executor, and at most
+  max_concurrent_plans of them may be in progress at a time. Sessions that want
+  to plan while the host is saturated wait their turn, which keeps a flood of
+  sessions from piling unbounded work onto the process.
+  """
+
+  def __init__(self, max_concurrent_plans=4, executor=None):
+    """
+    Arguments:
+      max_concurrent_plans {int} -- How many planning searches may run at once.
+      executor {concurrent.futures.Executor} -- Where to run them. If not given,
+          we make a thread pool just big enough.
+    """
+    self.max_concurrent_plans = max_concurrent_plans
+    self.executor = executor or concurrent.futures.ThreadPoolExecutor(
+      max_workers=max_concurrent_plans,
+      thread_name_prefix='ipl-planner')
+    self.__owns_executor = executor is None
+    self.__semaphore = None
+
+
+  @property
+  def semaphore(self):
+    # Created lazily, so that it belongs to whichever event loop is running.
+    if self.__semaphore is None:
+      self.__semaphore = asyncio.Semaphore(self.max_concurrent_plans)
+    return self.__semaphore
+
+
+  def session(self, organism):
+    """Wrap an organism for use from async code.
+    Arguments:
+      organism {Organism} -- A configured organism. Nothing else should be driving it.
+    Returns:
+      {AsyncOrganism}
+    """
+    return AsyncOrganism(organism, host=self)
+
+
+  def shutdown(self):
+    if self.__owns_executor:
+      self.executor.shutdown(wait=True)
+
+
+
+class AsyncOrganism:
+  """An asyncio façade over an Organism.
+
+  The organism's blocking calls run on the host's executor, so the event loop stays
+  free while they search. Cancelling a pending choose_action (directly, or through a
+  timeout) interrupts the search at the next level of the planning tree.
+  """
+
+  def __init__(self, organism, host=None):
+    """
+    Arguments:
+      organism {Organism} -- A configured organism.
+      host {AsyncOrganismHost} -- Shared executor and concurrency limit. If not given,
+          the organism gets a private single-threaded one.
+    """
+    self.organism = organism
+    self.host = host or AsyncOrganismHost(max_concurrent_plans=1)
+
+    if self.organism.interrupt is None:
+      self.organism.interrupt = threading.Event()
+    self.organism.cooperative_yield = True
+
+    # An organism is a sequential thing. Only one call at a time.
+    self.__lock = None
+
+
+  @property
+  def lock(self):
+    if self.__lock is None:
+      self.__lock = asyncio.Lock()
+    return self.__lock
+
+
+  async def handle_sensor_input(self, sensors):
+    """See Organism.handle_sensor_input.
+    """
+    async with self.lock:
+      await self.__run(self.organism.handle_sensor_input, sensors)
+
+
+  async def choose_action(self, force_action=None, timeout=None):
+    """See Organism.choose_action.
+    Arguments:
+      timeout {float} -- Give up after this many seconds, raising asyncio.TimeoutError.
+    """
+    async with self.lock:
+      async with self.host.semaphore:
+        if timeout is None:
+          return await self.__run(self.organism.choose_action, force_action)
+        return await asyncio.wait_for(
+          self.__run(self.organism.choose_action, force_action),
+          timeout)
+
+
+  async def step(self, sensors, timeout=None):
+    """Report sensor input and choose an action in response.
+    Returns:
+      {Action} -- The chosen action.
+    """
+    await self.handle_sensor_input(sensors)
+    return await self.choose_action(timeout=timeout)
+
+
+  async def __run(self, fn, *args):
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(self.host.executor, fn, *args)
+    try:
+      return await asyncio.shield(future)
+    except asyncio.CancelledError:
+      # Stop the search, and don't give up our slot until the worker thread
+      # has actually let go of the organism.
+      self.organism.interrupt.set()
+      try:
+        await asyncio.wait([future])
+      finally:
+        self.organism.interrupt.clear()
+      if not future.cancelled():
+        # Normally nnplanner.PlanningCancelled. Retrieve it so that asyncio doesn't
+        # complain about an exception nobody looked at.
+        future.exception()
+      raise
+
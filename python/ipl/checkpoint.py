@@ -0,0 +1,129 @@
+
+import json
+
+import numpy  # pylint: disable=E0401
+
+import ipl.nnplanner as nnplanner
+from ipl.nnplanner.repo_arrays import pack_bitvectors, unpack_bitvectors
+
+
+CHECKPOINT_FORMAT = 'ipl-organism-checkpoint'
+# Bump this whenever the layout changes, and teach load_checkpoint to read the old one.
+CHECKPOINT_VERSION = 1
+
+
+
+def save_checkpoint(organism, path):
+  """Saves everything a configured organism knows to an .npz file of flat arrays: its
+  configuration, experience repo, lookahead cache, registers, last sensors and action,
+  and random number generator state. The outcome proposer's statistics aren't saved;
+  they're refit from the repo the first time they're needed.
+  Arguments:
+    organism {Organism} -- The organism.
+    path {str} -- Where to write the checkpoint.
+  """
+  if organism.config is None:
+    raise ValueError('organism', 'Only configured organisms can be checkpointed.')
+
+  n_sensors = organism.outcome_generator.params.sensor_vector_dimensionality
+  n_actuators = organism.action_generator.params.action_vector_dimensionality
+  arrays = {}
+
+  if organism.experience_repo is not None:
+    arrays.update(organism.experience_repo.to_arrays())
+
+  cache = list(organism.lookahead_cache.cache.values()) if organism.lookahead_cache is not None else []
+  no_actuators = nnplanner.BitVector([0] * n_actuators)
+  arrays['lookahead_sensors'] = pack_bitvectors([lh.sensors for lh in cache], n_sensors)
+  # Some lookaheads just mark a state as seen, without a best action.
+  arrays['lookahead_has_actuators'] = numpy.array([lh.best_actuators is not None for lh in cache], dtype=bool)
+  arrays['lookahead_actuators'] = pack_bitvectors(
+    [lh.best_actuators if lh.best_actuators is not None else no_actuators for lh in cache], n_actuators)
+  arrays['lookahead_utility'] = numpy.array([lh.utility for lh in cache], dtype=float)
+  arrays['lookahead_depth'] = numpy.array([lh.recursion_depth for lh in cache], dtype=numpy.int64)
+
+  meta = {
+    'format': CHECKPOINT_FORMAT,
+    'version': CHECKPOINT_VERSION,
+    'config': organism.config,
+    'num_registers': organism.num_registers,
+    'factor_registers': organism.factor_registers,
+    'num_proposed_outcomes': organism.num_proposed_outcomes,
+    'action_outcome_lookahead': organism.action_outcome_lookahead,
+    'randomtest': organism.randomtest,
+    'num_turns_awake': organism.num_turns_awake,
+    'model_version': organism.model_version,
+    'registers': list(organism.registers),
+    'sensors': list(organism.sensors) if organism.sensors is not None else None,
+    'action': list(organism.action.actuators) if organism.action is not None else None,
+    'action_expected_utility': organism.action.expected_utility if organism.action is not None else None,
+    'has_repo': organism.experience_repo is not None,
+    'rng': organism.rng.bit_generator.state,
+  }
+  arrays['meta'] = numpy.frombuffer(json.dumps(meta).encode('utf-8'), dtype=numpy.uint8)
+
+  # Through a file object, so that numpy doesn't tack .npz onto the path.
+  with open(path, 'wb') as f:
+    numpy.savez(f, **arrays)
+
+
+
+def load_checkpoint(path, lazy=False):
+  """Restores an organism saved by save_checkpoint.
+  Arguments:
+    path {str} -- The checkpoint file.
+    lazy {bool} -- Don't build the experience repo's records until they're looked up.
+        See ExperienceRepo.from_arrays.
+  Returns:
+    {Organism} -- A configured organism, in the state it was saved in.
+  """
+  from ipl.organism import Organism
+
+  with numpy.load(path) as data:
+    if 'meta' not in data.files:
+      raise ValueError('path', 'Not an organism checkpoint: {}'.format(path))
+    meta = json.loads(data['meta'].tobytes().decode('utf-8'))
+    if meta.get('format') != CHECKPOINT_FORMAT:
+      raise ValueError('path', 'Not an organism checkpoint: {}'.format(path))
+    if meta['version'] > CHECKPOINT_VERSION:
+      raise ValueError('path', 'Checkpoint version {} is newer than this code understands ({}).'.format(
+        meta['version'], CHECKPOINT_VERSION))
+    arrays = {name: data[name] for name in data.files}
+
+  organism = Organism()
+  organism.num_registers = meta['num_registers']
+  organism.factor_registers = meta['factor_registers']
+  organism.num_proposed_outcomes = meta['num_proposed_outcomes']
+  organism.randomtest = meta['randomtest']
+  organism.configure(meta['config'])
+  organism.action_outcome_lookahead = meta['action_outcome_lookahead']
+  organism.rng.bit_generator.state = meta['rng']
+
+  n_sensors = organism.outcome_generator.params.sensor_vector_dimensionality
+  n_actuators = organism.action_generator.params.action_vector_dimensionality
+
+  organism.experience_repo = None
+  if meta['has_repo']:
+    repo_class = nnplanner.RegisterFactoredRepo if 'register_info' in arrays else nnplanner.ExperienceRepo
+    organism.experience_repo = repo_class.from_arrays(arrays, lazy=lazy)
+  if organism.experience_repo is not None and organism.canonicalizer is not None:
+    # The arrays are already in canonical form.
+    organism.experience_repo = nnplanner.CanonicalExperienceRepo(organism.experience_repo, organism.canonicalizer)
+
+  for sensors, has_actuators, actuators, utility, depth in zip(
+      unpack_bitvectors(arrays['lookahead_sensors'], n_sensors),
+      arrays['lookahead_has_actuators'].tolist(),
+      unpack_bitvectors(arrays['lookahead_actuators'], n_actuators),
+      arrays['lookahead_utility'].tolist(),
+      arrays['lookahead_depth'].tolist()):
+    organism.lookahead_cache.put(sensors, actuators if has_actuators else None, utility, depth)
+
+  organism.num_turns_awake = meta['num_turns_awake']
+  organism.model_version = meta['model_version']
+  organism.registers = nnplanner.BitVector(meta['registers'])
+  if meta['sensors'] is not None:
+    organism.sensors = nnplanner.BitVector(meta['sensors'])
+  if meta['action'] is not None:
+    organism.action = nnplanner.new_action(organism, meta['action'])
+    organism.action.expected_utility = meta['action_expected_utility']
+  return organism
@@ -1,5 +1,9 @@
 
+from .._lazy import lazy_exports
 
-from .el_maze_game import ElMazeGame
-from .tee_maze_game import TeeMazeGame
-from .revealer_game import RevealerGame
\ No newline at end of file
+
+__all__, __getattr__, __dir__ = lazy_exports(__name__, {
+  'el_maze_game': ['ElMazeGame'],
+  'tee_maze_game': ['TeeMazeGame'],
+  'revealer_game': ['RevealerGame'],
+})
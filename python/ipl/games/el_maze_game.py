@@ -47,18 +47,29 @@ class ElMazeGame:
   Stupid-simple game. The organism must turn left when it comes to 
   a bend in a hallway.
   """
-  def __init__(self, num_steps_before_bend, num_steps_after_bend):
-    self.title = 'El Maze Game {}x{}'.format(num_steps_before_bend, num_steps_after_bend)
+  def __init__(self, num_steps_before_bend, num_steps_after_bend, rng=None, mirrored=False):
+    """
+    Arguments:
+      rng {numpy.random.Generator} -- Picks the starting orientation. If not given,
+          the random module does.
+      mirrored {bool} -- Bend right instead.
+    """
+    self.title = 'El Maze Game {}x{}{}'.format(num_steps_before_bend, num_steps_after_bend, ' (mirrored)' if mirrored else '')
     self.turn = 0
     self.par = 3 + num_steps_before_bend + 1 + num_steps_after_bend 
 
     self.__is_alive = True 
     self.__position = 0
-    self.__orientation = random.choice(CARDINALS)
+    if rng is not None:
+      self.__orientation = CARDINALS[int(rng.integers(len(CARDINALS)))]
+    else:
+      self.__orientation = random.choice(CARDINALS)
     self.__last_cmd = None
 
     self.__victory_position = num_steps_before_bend + num_steps_after_bend
     self.__bend_position = num_steps_before_bend
+    # After the bend, the way forward is this way.
+    self.__forward_after_bend, self.__back_after_bend = ('EAST', 'WEST') if mirrored else ('WEST', 'EAST')
 
 
 
@@ -69,18 +80,49 @@ class ElMazeGame:
     return 'VICTORY' in self.state()
 
 
-  def player_config(self):
+  def player_config(self, symmetries=False):
     """Gets a dictionary of configuration arguments that give a player AI information
     about how to initialize.
+    Arguments:
+      symmetries {bool} -- Tell the player about the game's symmetries, so that it
+          can treat mirror-image situations as one. See symmetries().
     Returns:
       {dict} -- Dictionary of configuration arguments.
     """
     vlabels = self.io_vector_labels()
-    return {
+    retval = {
       'n_sensors': len(vlabels['sensors']),
       'n_actuators': len(vlabels['actuators']),
       'victory_field_idx': vlabels['sensors'].index('VICTORY')
     }
+    if symmetries:
+      retval['symmetries'] = self.symmetries()
+    return retval
+
+
+  def symmetries(self):
+    """Gets the permutations of the sensor and actuator vectors that the game's rules
+    don't care about.
+
+    Sensors are already relative to the player's orientation, so rotating the whole
+    maze changes nothing the player can see; there's nothing left to gain from the
+    rotations. What's left is the mirror image: swap left for right, in both what's
+    seen and what's done, and turning and walking work just the same.
+
+    That only holds across mazes that bend either way, though. In a maze that always
+    bends left, walking forward with an exit on your left heads for the goal, and with
+    one on your right heads away from it, so a player that only ever plays left-bending
+    mazes mustn't treat them as one. Mix in mirrored games for that.
+    Returns:
+      {list(dict)} -- Each has a 'sensors' and an 'actuators' permutation, where
+          permutation[i] is the index of the element that ends up at i.
+    """
+    vlabels = self.io_vector_labels()
+    mirror = {'LEFT': 'RIGHT', 'RIGHT': 'LEFT', 'TURN LEFT': 'TURN RIGHT', 'TURN RIGHT': 'TURN LEFT'}
+    return [{
+      field: [labels.index(mirror.get(label, label)) for label in labels]
+      for field, labels in vlabels.items()
+    }]
 
 
   def io_vector_labels(self):
@@ -120,10 +162,10 @@ class ElMazeGame:
       cardinal_exits.add('SOUTH')
 
     if self.__position > self.__bend_position:
-      cardinal_exits.add('EAST')
+      cardinal_exits.add(self.__back_after_bend)
 
     if self.__position >= self.__bend_position and self.__position < self.__victory_position:
-      cardinal_exits.add('WEST')
+      cardinal_exits.add(self.__forward_after_bend)
 
     relative_exits = set([find_turn(self.__orientation, cardexit) for cardexit in cardinal_exits])    
     return relative_exits
@@ -159,7 +201,7 @@ class ElMazeGame:
 
     if cmd.startswith('GO'):
       if 'FORWARD' in gs:
-        if self.__orientation in ['NORTH', 'WEST']:
+        if self.__orientation in ['NORTH', self.__forward_after_bend]:
           self.__position += 1
         else:
           self.__position -= 1
@@ -198,6 +240,9 @@ class ElMazeGame:
     sl[agent_x] = CARDINALS_ASCII[self.__orientation]
     ss[agent_line] = ''.join(sl)
 
+    if self.__forward_after_bend == 'EAST':
+      ss = [line[::-1].translate(str.maketrans('<>', '><')) for line in ss]
+
 
     sout = '\n'.join(ss)
     print(sout)
@@ -43,13 +43,21 @@ class TeeMazeGame:
   learn to turn left when it comes to the end of a hallway of 
   pre-defined length.
   """
-  def __init__(self, num_steps_before_bend, num_steps_after_bend):
+  def __init__(self, num_steps_before_bend, num_steps_after_bend, rng=None):
+    """
+    Arguments:
+      rng {numpy.random.Generator} -- Picks the starting orientation. If not given,
+          the random module does.
+    """
     self.title = 'Tee Maze Game {}x{}'.format(num_steps_before_bend, num_steps_after_bend)
     self.turn = 0
 
     self.__is_alive = True 
     self.__position = 0
-    self.__orientation = random.choice(CARDINALS)
+    if rng is not None:
+      self.__orientation = CARDINALS[int(rng.integers(len(CARDINALS)))]
+    else:
+      self.__orientation = random.choice(CARDINALS)
     self.__victory_position = num_steps_before_bend + num_steps_after_bend
     self.__bend_position = num_steps_before_bend
 
@@ -1,9 +1,30 @@
 
-
-from .action import *
-from .outcome import *
-from .estimate import *
-from .experience import *
-from .lookahead import *
+from .._lazy import lazy_exports
 
 
+# Submodules get imported the first time something from them is used, so that
+# processes that only need a piece of the planner don't pay for all of it.
+__all__, __getattr__, __dir__ = lazy_exports(__name__, {
+  'bitvector': ['BitVector'],
+  'rng': ['get_rng', 'bitvectors_from_rows', 'random_bits', 'random_sparse_bits'],
+  'cancel': ['PlanningCancelled', 'check_interrupt'],
+  'action': ['Action', 'ActionGeneratorParams', 'ActionGenerator'],
+  'outcome': ['Outcome', 'OutcomeGeneratorParams', 'OutcomeGenerator'],
+  'estimate': ['OutcomeLikelihoodEstimatorParams', 'OutcomeLikelihoodEstimator'],
+  'utility': ['LinearUtility', 'CallableUtility', 'as_utility'],
+  'experience': ['SensorsRecord', 'ActuatorsRecord', 'ExperienceRepo'],
+  'lookahead': ['Lookahead', 'LookaheadCache'],
+  'neighbors': ['hamming_distance', 'pack_bits', 'HammingIndex'],
+  'proposal': ['OutcomeProposerParams', 'OutcomeProposer'],
+  'pool': ['NodePool', 'new_action', 'new_outcome', 'release_actions', 'release_outcomes'],
+  'bestfirst': ['BestFirstPlannerParams', 'BestFirstPlanner'],
+  'learning': ['BackgroundLearnerParams', 'BackgroundLearner'],
+  'ingest': ['iter_trajectory_chunks', 'group_experiences'],
+  'repo_arrays': ['ArraySituations', 'LazyHammingIndex', 'pack_bitvectors', 'unpack_bitvectors', 'repo_to_arrays'],
+  'shared_repo': ['SharedRepoExport', 'attach_shared_repo'],
+  'experience_service': ['ExperienceServer', 'RemoteExperienceRepo'],
+  'cached_repo': ['CachedExperienceRepo'],
+  'symmetry': ['Canonicalizer', 'CanonicalExperienceRepo'],
+  'registers': ['RegisterFactoredRepo'],
+  'options': ['OptionLibraryParams', 'Option', 'OptionLibrary'],
+})
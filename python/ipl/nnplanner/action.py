@@ -1,31 +1,58 @@
-import numpy  # pylint: disable=E0401
+from .bitvector import BitVector
+from .cancel import check_interrupt
+from .pool import new_action, release_actions, release_outcomes
+from .rng import bitvectors_from_rows, get_rng, random_sparse_bits
 
 class Action:
   """
   An action and possible outcomes.
   """
+  __slots__ = ('actuators', 'outcomes', 'expected_utility', 'option')
+
   def __init__(self, actuators=None):
-    self.actuators = actuators or []
+    self.reset(actuators)
+
+
+  def reset(self, actuators=None):
+    self.actuators = BitVector(actuators or ())
     self.outcomes = []
     self.expected_utility = 0
+    # The Option this action starts, if it was credited with one.
+    self.option = None
 
 
-  def evaluate(self, sensors, outcome_generator, recursion_depth=0):
+  def evaluate(self, sensors, outcome_generator, recursion_depth=0, bound=None, outcomes=None, utilities=None):
     """Computes the action's expected utility by examining the action's likely outcomes
     and weighing their utilities accordingly.
     Arguments:
       sensors {list} -- The context of sensor states in which this action occurs.
       outcome_generator {OutcomeGenerator} -- An object that lets us generate outcomes.
       recursion_depth {int} -- Passed along to outcome generator.
+      bound {float} -- The expected utility of the best competing action found so far.
+          If given, we stop expanding outcomes as soon as it's clear that this action
+          can't beat it, and the expected utility we report is only a lower bound.
+      outcomes {list(Outcome)} -- The action's outcomes, if they've already been
+          proposed by outcome_generator. Ignored if bound is given.
+      utilities {list(float)} -- What outcome_generator.score made of outcomes.
     """
     self.expected_utility = 0
 
     #print('recursion_depth=', recursion_depth, ' Evaluating action ', sensors, self.actuators)
-    self.outcomes = outcome_generator.generate(
-      sensors_prev=sensors, 
-      actuators=self.actuators,
-      recursion_depth=recursion_depth
-    )
+    if bound is None and outcomes is not None:
+      self.outcomes = outcomes
+      for oc, u in zip(outcomes, utilities):
+        outcome_generator.expand(oc, recursion_depth=recursion_depth, absolute_utility=u)
+    elif bound is None:
+      self.outcomes = outcome_generator.generate(
+        sensors_prev=sensors, 
+        actuators=self.actuators,
+        recursion_depth=recursion_depth
+      )
+    else:
+      self.outcomes = outcome_generator.propose(
+        sensors_prev=sensors, 
+        actuators=self.actuators
+      )
 
     # Curiosity!
     # Curiosity is somewhat complicated. It should be based on a utility function that
@@ -43,7 +70,13 @@ class Action:
 
     # Remove any outcomes whose state is the state we're currently in.
     # No sense wasting time recursing upon ourselves.
-    self.outcomes = [oc for oc in self.outcomes if oc.sensors != sensors]
+    self_loops = [oc for oc in self.outcomes if oc.sensors == sensors]
+    if self_loops:
+      self.outcomes = [oc for oc in self.outcomes if oc.sensors != sensors]
+      release_outcomes(outcome_generator.organism, self_loops)
+
+    if bound is not None:
+      self.__expand_outcomes_bounded(outcome_generator, recursion_depth, bound)
 
     for oc in self.outcomes:
       self.expected_utility += oc.estimated_weighted_utility
@@ -59,25 +92,39 @@ class Action:
 
 
 
-  def fill_random(self, params):
+  def __expand_outcomes_bounded(self, outcome_generator, recursion_depth, bound):
+    """Expand outcomes, most likely first, until they're all expanded or until even 
+    the rosiest view of the remaining ones can't make this action beat the bound.
+    Utilities never exceed 1.0, so an unexpanded outcome can't contribute more than
+    its optimistic probability.
+    """
+    utility_so_far = 0
+    optimism_remaining = sum(oc.probability_most_optimistic() for oc in self.outcomes)
+
+    for i, oc in enumerate(self.outcomes):
+      if .9 * (utility_so_far + optimism_remaining) <= bound:
+        release_outcomes(outcome_generator.organism, self.outcomes[i:])
+        self.outcomes = self.outcomes[:i]
+        return
+
+      outcome_generator.expand(oc, recursion_depth=recursion_depth)
+      utility_so_far += oc.estimated_weighted_utility
+      optimism_remaining -= oc.probability_most_optimistic()
+
+
+
+  def fill_random(self, params, rng=None):
     """Fill the action vector based on the configuration of an action generator.
     Arguments:
       params {ActionGeneratorParams} -- Describes how to create this vector.
+      rng {numpy.random.Generator} -- Where the randomness comes from. If not given,
+          a shared, unseeded generator.
     """
-    self.actuators = [0] * params.action_vector_dimensionality
-
-    nactive = numpy.random.normal(
-        params.activity_level_mean, params.activity_level_stdev)
-    if nactive < 0:
-      nactive = 0
-    nactive = int(nactive)
-    if nactive >= params.action_vector_dimensionality:
-      nactive = params.action_vector_dimensionality
-
-    indices = numpy.random.choice(
-        params.action_vector_dimensionality, nactive, False)
-    for index in indices:
-      self.actuators[index] = 1
+    if rng is None:
+      rng = get_rng()
+    self.actuators = random_sparse_bits(
+      rng, 1, params.action_vector_dimensionality,
+      params.activity_level_mean, params.activity_level_stdev)[0]
 
 
   def __eq__(self, other):
@@ -95,7 +142,7 @@ class Action:
 class ActionGeneratorParams:
   """An object that configures an action generator.
   """
-  def __init__(self, action_vector_dimensionality, activity_level_mean, activity_level_stdev, num_generate, num_keep):
+  def __init__(self, action_vector_dimensionality, activity_level_mean, activity_level_stdev, num_generate, num_keep, **kwargs):
     """Configure an action generator.
 
     Arguments:
@@ -104,6 +151,14 @@ class ActionGeneratorParams:
       activity_level_stdev {float} -- The standard deviation of the number of nonzero elements.
       num_generate {int} -- How many actions to generate, including repeats.
       num_keep {int} -- Of all actions generated, keep the best num_keep ones.
+      branch_and_bound {bool} -- Stop evaluating an action as soon as it provably can't
+          beat the best action evaluated before it.
+      num_registers {int} -- How many of the last action elements are the organism's
+          registers. If given, random actions are drawn over the game-facing elements
+          only, and mostly leave the registers as they are, rather than treating them
+          like any other element.
+      register_flip_probability {float} -- The chance that a random action flips any
+          one register.
     """
     self.action_vector_dimensionality = action_vector_dimensionality
     self.activity_level_mean = activity_level_mean
@@ -111,6 +166,18 @@ class ActionGeneratorParams:
     self.num_generate = num_generate
     self.num_keep = num_keep
 
+    self.branch_and_bound = kwargs.get('branch_and_bound')
+    if self.branch_and_bound is None:
+      self.branch_and_bound = False
+
+    self.num_registers = kwargs.get('num_registers')
+    if self.num_registers is None:
+      self.num_registers = 0
+
+    self.register_flip_probability = kwargs.get('register_flip_probability')
+    if self.register_flip_probability is None:
+      self.register_flip_probability = .25
+
 
 class ActionGenerator:
   """Generates random action vectors.
@@ -132,11 +199,16 @@ class ActionGenerator:
     self.params = params
 
 
-  def generate(self, sensors, recursion_depth=0):
+  def generate(self, sensors, recursion_depth=0, options=None):
     """Creates a population of proposed actions.
     Arguments:
       sensors {list} -- The state of the sensors in which these actions will be taken.
+      options {dict} -- From OptionLibrary.propose. The first action of each option is
+          included, and credited with the option's expected utility if that's better
+          than what its own evaluation comes to.
     """
+    check_interrupt(self.organism)
+
     DEBUGGGGGGGGG = False
     if recursion_depth == 5 and (sensors == [0,1,0,1,0,0] or sensors == [0,1,0,1,0,1]):
       DEBUGGGGGGGGG = True
@@ -145,32 +217,55 @@ class ActionGenerator:
       print('SITUATION ', sensors)
 
 
-    population = []
-    if self.organism is not None and self.organism.outcome_likelihood_estimator is not None:
-      population += self.organism.outcome_likelihood_estimator.get_known_actions(sensors)
+    if options is None:
+      options = {}
+    population = self.propose(sensors, options=options)
 
     if DEBUGGGGGGGGG:
-      print('KNOWN ACTIONS')
+      print('KNOWN AND RANDOM ACTIONS')
       for action in population:
         print('\t', action)
 
-    for _ in range(self.params.num_generate):
-      action = Action()
-      action.fill_random(self.params)
-
-      if action in population:
-        continue
-
-      population.append(action)
-
+    outcome_generator = self.organism.outcome_generator if self.organism else None
+    if outcome_generator and not self.params.branch_and_bound:
+      # Every outcome of every action gets expanded, so propose them all first, and
+      # score the states of the whole level in one go. One action's outcomes alone are
+      # too few for batching to pay.
+      outcomeses = [outcome_generator.propose(sensors, action.actuators) for action in population]
+      utilities = outcome_generator.score([oc for outcomes in outcomeses for oc in outcomes])
+      i = 0
+      for action, outcomes in zip(population, outcomeses):
+        action.evaluate(
+          sensors,
+          outcome_generator,
+          recursion_depth=recursion_depth,
+          outcomes=outcomes,
+          utilities=utilities[i:i + len(outcomes)]
+        )
+        i += len(outcomes)
 
+    # With branch-and-bound, an action only needs to be evaluated well enough to tell
+    # that it loses to the best one so far. Pruned actions report a lower bound on
+    # their expected utility, which still sorts them below the winner.
+    best_expected_utility = None
     for action in population:
-      if self.organism and self.organism.outcome_generator:
+      if outcome_generator and self.params.branch_and_bound:
         action.evaluate(
           sensors, 
-          self.organism.outcome_generator, 
-          recursion_depth=recursion_depth
+          outcome_generator, 
+          recursion_depth=recursion_depth,
+          bound=best_expected_utility
         )
+        if best_expected_utility is None or action.expected_utility > best_expected_utility:
+          best_expected_utility = action.expected_utility
+
+    # An option sees past the end of the lookahead, so it gets the credit when it
+    # expects more than the planning tree does.
+    for action in population:
+      option = options.get(action.actuators)
+      if option is not None and option.expected_utility > action.expected_utility:
+        action.expected_utility = option.expected_utility
+        action.option = option
 
     if DEBUGGGGGGGGG:
       print('AFTER CULL')
@@ -180,12 +275,80 @@ class ActionGenerator:
           print('\t\t', action.outcomes)
 
 
-    numpy.random.shuffle(population)
-    population.sort(key=lambda a: -a.expected_utility)
-    population = population[:self.params.num_keep]
+    return self.cull(population)
+
+
+
+  def propose(self, sensors, options=None):
+    """Creates a population of candidate actions without evaluating them: 
+    every action known to have been tried in this situation, plus random ones.
+    Arguments:
+      sensors {list} -- The state of the sensors in which these actions will be taken.
+      options {dict} -- From OptionLibrary.propose. The first action of each option
+          is included too.
+    Returns:
+      {list(Action)} -- Distinct actions, known ones first.
+    """
+    population = []
+    if self.organism is not None and self.organism.outcome_likelihood_estimator is not None:
+      population += self.organism.outcome_likelihood_estimator.get_known_actions(sensors)
+
+    for actuators in options or ():
+      action = new_action(self.organism, actuators)
+      if action in population:
+        release_actions(self.organism, [action])
+        continue
+      population.append(action)
+
+    for actuators in self.__random_actuatorses(sensors):
+      action = new_action(self.organism, actuators)
+
+      if action in population:
+        release_actions(self.organism, [action])
+        continue
+
+      population.append(action)
 
     return population
 
+
+
+  def __random_actuatorses(self, sensors):
+    rng = get_rng(self.organism)
+    params = self.params
+    n_registers = params.num_registers
+    if not n_registers:
+      return random_sparse_bits(
+        rng, params.num_generate, params.action_vector_dimensionality,
+        params.activity_level_mean, params.activity_level_stdev)
+
+    # Every register doubles the number of distinct actions, and so the size of the
+    # search. Draw the game-facing part as usual, and only occasionally change the
+    # registers from what they are now.
+    game_actuatorses = random_sparse_bits(
+      rng, params.num_generate, params.action_vector_dimensionality - n_registers,
+      params.activity_level_mean, params.activity_level_stdev)
+    registers = BitVector(sensors)[-n_registers:].to_int()
+    flips = bitvectors_from_rows(rng.random((params.num_generate, n_registers)) < params.register_flip_probability)
+    return [
+      game_actuators + BitVector.from_int(registers ^ flip.to_int(), n_registers)
+      for game_actuators, flip in zip(game_actuatorses, flips)
+    ]
+
+
+
+  def cull(self, population):
+    """Keep the best evaluated actions, breaking ties randomly.
+    Arguments:
+      population {list(Action)} -- Evaluated actions.
+    Returns:
+      {list(Action)} -- At most num_keep actions, best first.
+    """
+    get_rng(self.organism).shuffle(population)
+    population.sort(key=lambda a: -a.expected_utility)
+    release_actions(self.organism, population[self.params.num_keep:])
+    return population[:self.params.num_keep]
+
       
 
 
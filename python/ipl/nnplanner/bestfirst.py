@@ -0,0 +1,178 @@
+
+import heapq
+
+from .cancel import check_interrupt
+from .pool import release_actions
+
+
+class BestFirstPlannerParams:
+  """Configuration for a best-first planner.
+  """
+  def __init__(self, node_budget, **kwargs):
+    """
+    Arguments:
+      node_budget {int} -- How many outcomes the planner may expand per decision,
+          across the whole tree.
+    """
+    self.node_budget = node_budget
+
+
+
+class _OutcomeNode:
+  """An outcome in the planning tree, plus the bookkeeping the search needs.
+  """
+  __slots__ = ('outcome', 'weight', 'recursion_depth', 'actions', 'terminal')
+
+  def __init__(self, outcome, weight, recursion_depth):
+    self.outcome = outcome
+    # The most that this node's utility could possibly move the root's expected utility.
+    self.weight = weight
+    self.recursion_depth = recursion_depth
+    self.actions = None
+    self.terminal = False
+
+
+
+class BestFirstPlanner:
+  """Plans by expanding the most promising outcomes anywhere in the tree first.
+
+  The depth-first planner (ActionGenerator and OutcomeGenerator recursing into one
+  another) expands every kept outcome all the way down before moving on to its
+  siblings, so its effort is spread evenly regardless of what actually matters.
+  Here, instead, every unexpanded outcome in the tree sits in one priority queue,
+  keyed by the product of the optimistic probabilities and the .9-per-level
+  discounts along its path from the root. Since utilities are bounded by 1.0,
+  that product is the most the outcome could possibly change the decision, so
+  that's the order we expand them in, until a node budget for the whole decision
+  runs out.
+  """
+
+  def __init__(self, organism, params):
+    """Create the planner.
+    Arguments:
+      params {BestFirstPlannerParams} -- Configuration info.
+    """
+    self.organism = organism
+    self.params = params
+
+
+
+  def plan(self, sensors, recursion_depth=0):
+    """Evaluate candidate actions in the current situation.
+    Arguments:
+      sensors {BitVector} -- The current sensor state.
+      recursion_depth {int} -- How many steps forward to look, max.
+    Returns:
+      {list(Action)} -- The best actions, best first, with expected utilities filled in,
+          just like ActionGenerator.generate.
+    """
+    action_generator = self.organism.action_generator
+    outcome_generator = self.organism.outcome_generator
+
+    # Like the lookahead cache in the depth-first planner, remember which states we've
+    # already expanded so that we don't give credit for finding a second way to get there.
+    # The current state is worth nothing; there's no point in an action that just gets
+    # us back to where we already are.
+    expanded_states = {sensors: recursion_depth}
+
+    frontier = []
+    counter = 0
+
+    root_actions = action_generator.propose(sensors)
+    root_action_children = []
+    for action in root_actions:
+      children = self.__propose_outcomes(sensors, action, 1.0, recursion_depth)
+      root_action_children.append(children)
+      for node in children:
+        heapq.heappush(frontier, (-node.weight, counter, node))
+        counter += 1
+
+    budget = self.params.node_budget
+    while frontier and budget > 0:
+      _, _, node = heapq.heappop(frontier)
+      budget -= 1
+      check_interrupt(self.organism)
+      outcome_generator.num_expanded += 1
+
+      outcome = node.outcome
+      outcome.estimated_absolute_utility = self.__utility(outcome.sensors)
+      if outcome.estimated_absolute_utility >= outcome_generator.params.recursion_threshold:
+        node.terminal = True
+        continue
+      if node.recursion_depth <= 0:
+        continue
+
+      explored_depth = expanded_states.get(outcome.sensors)
+      if explored_depth is not None and explored_depth >= node.recursion_depth:
+        node.terminal = True
+        outcome.estimated_absolute_utility = 0
+        continue
+      expanded_states[outcome.sensors] = node.recursion_depth
+
+      node.actions = []
+      for action in action_generator.propose(outcome.sensors):
+        children = self.__propose_outcomes(outcome.sensors, action, node.weight, node.recursion_depth - 1)
+        node.actions.append((action, children))
+        for child in children:
+          heapq.heappush(frontier, (-child.weight, counter, child))
+          counter += 1
+
+    for action, children in zip(root_actions, root_action_children):
+      self.__back_up_action(action, children)
+      action.outcomes = [node.outcome for node in children]
+
+    return action_generator.cull(root_actions)
+
+
+
+  def __propose_outcomes(self, sensors, action, parent_weight, recursion_depth):
+    outcome_generator = self.organism.outcome_generator
+    outcomes = outcome_generator.propose(sensors, action.actuators)
+
+    # Mirror Action.evaluate: having no foreseeable outcomes is different
+    # from only having outcomes that go nowhere.
+    action.expected_utility = .1 if len(outcomes) == 0 else 0
+    outcomes = [oc for oc in outcomes if oc.sensors != sensors]
+
+    return [
+      _OutcomeNode(oc, parent_weight * .9 * oc.probability_most_optimistic(), recursion_depth)
+      for oc in outcomes
+    ]
+
+
+  def __utility(self, sensors):
+    metric = self.organism.outcome_generator.sensors_utility_metric
+    return metric(sensors) if metric else 0
+
+
+  def __back_up_action(self, action, children):
+    if not children:
+      return
+    action.expected_utility = 0
+    for node in children:
+      oc = node.outcome
+      oc.estimated_weighted_utility = self.__back_up_outcome(node) * oc.probability_most_optimistic()
+      action.expected_utility += oc.estimated_weighted_utility
+    action.expected_utility *= .9
+
+
+  def __back_up_outcome(self, node):
+    oc = node.outcome
+    if node.actions is None:
+      # Never popped off the frontier, or popped but not worth recursing into.
+      if not node.terminal and node.recursion_depth >= 0:
+        oc.estimated_absolute_utility = self.__utility(oc.sensors)
+      return oc.estimated_absolute_utility
+
+    if node.actions:
+      for action, children in node.actions:
+        self.__back_up_action(action, children)
+      best = max(action.expected_utility for action, _ in node.actions)
+      oc.estimated_absolute_utility = min(best, 1.0)
+
+    # Interior nodes don't outlive the search.
+    for action, children in node.actions:
+      action.outcomes = [child.outcome for child in children]
+    release_actions(self.organism, [action for action, _ in node.actions])
+    return oc.estimated_absolute_utility
+
@@ -0,0 +1,137 @@
+
+
+class BitVector:
+  """An immutable, hashable vector of bits.
+
+  Sensor and actuator vectors get copied, compared, hashed, sliced and concatenated
+  constantly during planning. Packing the bits into a single int makes all of those
+  cheap, while indexing, iteration, len() and comparison against plain lists still
+  behave the way game code expects a list of 0s and 1s to behave.
+
+  The first element of the vector is the most significant bit of the packed int.
+  """
+  __slots__ = ('_bits', '_len', '_hash')
+
+  def __new__(cls, values=()):
+    """Create a bit vector.
+    Arguments:
+      values {iterable} -- Elements of the vector. Anything truthy counts as a 1.
+    """
+    if type(values) is cls:
+      # They're immutable, so there's no reason to copy one.
+      return values
+
+    bits = 0
+    n = 0
+    for x in values:
+      bits = (bits << 1) | (1 if x else 0)
+      n += 1
+    return cls.from_int(bits, n)
+
+
+  @classmethod
+  def from_int(cls, bits, length):
+    """Create a bit vector directly from its packed representation.
+    Arguments:
+      bits {int} -- The packed bits, first element most significant.
+      length {int} -- Number of elements in the vector.
+    """
+    self = object.__new__(cls)
+    object.__setattr__(self, '_bits', bits)
+    object.__setattr__(self, '_len', length)
+    object.__setattr__(self, '_hash', None)
+    return self
+
+
+  def __setattr__(self, name, value):
+    raise AttributeError('BitVector is immutable.')
+
+
+  def __reduce__(self):
+    return (BitVector.from_int, (self._bits, self._len))
+
+
+  def to_int(self):
+    return self._bits
+
+
+  def popcount(self):
+    """Number of elements that are 1.
+    """
+    return bin(self._bits).count('1')
+
+
+  def hamming(self, other):
+    """Number of positions at which this vector differs from another of the same length.
+    """
+    other = BitVector(other)
+    return bin(self._bits ^ other._bits).count('1')
+
+
+  def __len__(self):
+    return self._len
+
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      start, stop, step = index.indices(self._len)
+      if step == 1:
+        n = max(0, stop - start)
+        bits = (self._bits >> (self._len - start - n)) & ((1 << n) - 1) if n else 0
+        return BitVector.from_int(bits, n)
+      return BitVector([self[i] for i in range(start, stop, step)])
+
+    if index < 0:
+      index += self._len
+    if index < 0 or index >= self._len:
+      raise IndexError('BitVector index out of range')
+    return (self._bits >> (self._len - 1 - index)) & 1
+
+
+  def __iter__(self):
+    bits = self._bits
+    for shift in range(self._len - 1, -1, -1):
+      yield (bits >> shift) & 1
+
+
+  def __add__(self, other):
+    if not isinstance(other, (BitVector, list, tuple)):
+      return NotImplemented
+    other = BitVector(other)
+    return BitVector.from_int((self._bits << other._len) | other._bits, self._len + other._len)
+
+
+  def __radd__(self, other):
+    if not isinstance(other, (list, tuple)):
+      return NotImplemented
+    return BitVector(other) + self
+
+
+  def __eq__(self, other):
+    if isinstance(other, BitVector):
+      return self._bits == other._bits and self._len == other._len
+    if isinstance(other, (list, tuple)):
+      return len(other) == self._len and all(a == b for a, b in zip(self, other))
+    return NotImplemented
+
+
+  def __ne__(self, other):
+    eq = self.__eq__(other)
+    if eq is NotImplemented:
+      return eq
+    return not eq
+
+
+  def __hash__(self):
+    # We're equal to the tuple of our bits, so we have to hash the same as it does.
+    # Worked out the first time it's needed, since that's a loop over the bits.
+    h = self._hash
+    if h is None:
+      h = hash(tuple(self))
+      object.__setattr__(self, '_hash', h)
+    return h
+
+
+  def __repr__(self):
+    return '[' + ', '.join('1' if x else '0' for x in self) + ']'
+
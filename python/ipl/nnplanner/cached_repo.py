@@ -0,0 +1,224 @@
+
+import collections
+import threading
+
+from .experience import ActuatorsRecord, SensorsRecord
+
+
+class CachedExperienceRepo:
+  """A bounded, least-recently-used, read-through cache in front of another repo.
+
+  Within a turn, the planner asks the same questions of the repo over and over:
+  every branch of the planning tree that reaches a situation looks up its actions,
+  and their outcomes, again. When the repo is a RemoteExperienceRepo, or a view of one
+  on disk or in shared memory, each of those costs real latency. This answers repeats
+  from memory instead.
+
+  Adds made through the cache go straight to the backend, and drop whatever the cache
+  knew about that situation. Adds made by anybody else, like other organisms sharing a
+  remote repo, can't be seen, so cached answers also expire after max_age turns; call
+  new_turn() once a turn (the Organism does) to move the clock on.
+
+  Anything the cache doesn't handle itself is passed through to the backend.
+  """
+
+  def __init__(self, backend, max_entries=4096, max_age=1):
+    """
+    Arguments:
+      backend -- The repo to cache. Anything with ExperienceRepo's query methods.
+      max_entries {int} -- The most answers to remember.
+      max_age {int} -- How many turns an answer stays good for. 1 means only for the
+          turn it was fetched in. None means forever, which is only safe if nobody
+          else adds to the backend.
+    """
+    if max_entries < 1:
+      raise ValueError('max_entries', 'Must be at least 1.')
+    self.backend = backend
+    self.max_entries = max_entries
+    self.max_age = max_age
+
+    self.generation = 0
+    self.hits = 0
+    self.misses = 0
+
+    # (method, arguments) to (generation fetched, situation, answer), least recently
+    # used first.
+    self.__entries = collections.OrderedDict()
+    # Situation to the keys of the entries that are about it.
+    self.__by_situation = {}
+    # Goes up with every invalidation, so that answers fetched across one aren't kept.
+    self.__num_invalidations = 0
+    self.__lock = threading.Lock()
+
+
+  def __getstate__(self):
+    # The cache itself isn't worth keeping.
+    return {'backend': self.backend, 'max_entries': self.max_entries, 'max_age': self.max_age}
+
+
+  def __setstate__(self, state):
+    self.__init__(state['backend'], max_entries=state['max_entries'], max_age=state['max_age'])
+
+
+  def __getattr__(self, name):
+    # Only called for what we don't have ourselves. Dunders are left alone, so that
+    # pickling and copying don't go looking for them on a backend that isn't there yet.
+    if name.startswith('__'):
+      raise AttributeError(name)
+    return getattr(self.__dict__['backend'], name)
+
+
+  @property
+  def concurrent(self):
+    return self.backend.concurrent
+
+  @concurrent.setter
+  def concurrent(self, value):
+    # The background learner switches this on; it's the backend that needs to know.
+    self.backend.concurrent = value
+
+
+  def __len__(self):
+    return len(self.backend)
+
+
+  @property
+  def hit_ratio(self):
+    """Fraction of lookups answered from the cache. 0 if there haven't been any.
+    """
+    total = self.hits + self.misses
+    return self.hits / total if total else 0.0
+
+
+  def reset_stats(self):
+    self.hits = 0
+    self.misses = 0
+
+
+  def new_turn(self):
+    """Advance the generation stamp. Answers older than max_age turns stop being used.
+    """
+    self.generation += 1
+
+
+  def clear(self):
+    with self.__lock:
+      self.__entries.clear()
+      self.__by_situation.clear()
+
+
+  def invalidate(self, sensors):
+    """Forget everything cached about a situation.
+    Arguments:
+      sensors {list} -- The situation's sensor state.
+    """
+    situation_key = SensorsRecord.compute_key(sensors)
+    with self.__lock:
+      self.__num_invalidations += 1
+      self.__forget(situation_key)
+      # A new situation might be somebody's nearest neighbour now.
+      self.__forget(None)
+
+
+  def __forget(self, situation_key):
+    for key in self.__by_situation.pop(situation_key, ()):
+      self.__entries.pop(key, None)
+
+
+  def __lookup(self, situation_key, key, fetch):
+    with self.__lock:
+      entry = self.__entries.get(key)
+      if entry is not None:
+        generation, _, answer = entry
+        if self.max_age is None or self.generation - generation < self.max_age:
+          self.__entries.move_to_end(key)
+          self.hits += 1
+          return answer
+        self.__evict(key)
+      self.misses += 1
+      num_invalidations = self.__num_invalidations
+
+    # Don't hold the lock while we wait on the backend.
+    answer = fetch()
+
+    with self.__lock:
+      if num_invalidations != self.__num_invalidations:
+        return answer
+      self.__entries[key] = (self.generation, situation_key, answer)
+      self.__entries.move_to_end(key)
+      self.__by_situation.setdefault(situation_key, set()).add(key)
+      while len(self.__entries) > self.max_entries:
+        self.__evict(next(iter(self.__entries)))
+    return answer
+
+
+  def __evict(self, key):
+    _, situation_key, _ = self.__entries.pop(key)
+    keys = self.__by_situation[situation_key]
+    keys.discard(key)
+    if not keys:
+      del self.__by_situation[situation_key]
+
+
+
+  def add(self, sensors_prev, actuators, sensors_observed, magnitude=1):
+    """See ExperienceRepo.add.
+    """
+    self.backend.add(sensors_prev, actuators, sensors_observed, magnitude=magnitude)
+    self.invalidate(sensors_prev)
+
+
+  def get_outcome_probability(self, sensors_prev, actuators, sensors_next):
+    """See ExperienceRepo.get_outcome_probability.
+    """
+    situation_key = SensorsRecord.compute_key(sensors_prev)
+    action_key = ActuatorsRecord.compute_key(actuators)
+    outcome_key = SensorsRecord.compute_key(sensors_next)
+    return self.__lookup(
+      situation_key,
+      ('get_outcome_probability', situation_key, action_key, outcome_key),
+      lambda: self.backend.get_outcome_probability(situation_key, action_key, outcome_key))
+
+
+  def lookup_outcomes(self, sensors, actuators, prob_threshold=0):
+    """See ExperienceRepo.lookup_outcomes.
+    """
+    situation_key = SensorsRecord.compute_key(sensors)
+    action_key = ActuatorsRecord.compute_key(actuators)
+    # A copy, because callers are allowed to do what they like with the list.
+    return list(self.__lookup(
+      situation_key,
+      ('lookup_outcomes', situation_key, action_key, prob_threshold),
+      lambda: self.backend.lookup_outcomes(situation_key, action_key, prob_threshold=prob_threshold)))
+
+
+  def lookup_actions(self, sensors):
+    """See ExperienceRepo.lookup_actions.
+    """
+    situation_key = SensorsRecord.compute_key(sensors)
+    return list(self.__lookup(
+      situation_key,
+      ('lookup_actions', situation_key),
+      lambda: self.backend.lookup_actions(situation_key)))
+
+
+  def get_action_count(self, sensors, actuators):
+    """See ExperienceRepo.get_action_count.
+    """
+    situation_key = SensorsRecord.compute_key(sensors)
+    action_key = ActuatorsRecord.compute_key(actuators)
+    return self.__lookup(
+      situation_key,
+      ('get_action_count', situation_key, action_key),
+      lambda: self.backend.get_action_count(situation_key, action_key))
+
+
+  def nearest_situations(self, sensors, k=1, max_distance=None):
+    """See ExperienceRepo.nearest_situations.
+    """
+    situation_key = SensorsRecord.compute_key(sensors)
+    # Filed under None rather than the situation, since any add can change the answer.
+    return list(self.__lookup(
+      None,
+      ('nearest_situations', situation_key, k, max_distance),
+      lambda: self.backend.nearest_situations(situation_key, k=k, max_distance=max_distance)))
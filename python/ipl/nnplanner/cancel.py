@@ -0,0 +1,26 @@
+
+import time
+
+
+class PlanningCancelled(Exception):
+  """Raised from inside the planner when the organism's interrupt has been set.
+  """
+  pass
+
+
+
+def check_interrupt(organism):
+  """Called by the planners once per tree level. Bails out of planning if someone
+  has asked the organism to stop, and gives other threads a chance to run if the
+  organism is configured to be cooperative about it.
+  Arguments:
+    organism {Organism} -- The organism doing the planning. May be None.
+  """
+  if organism is None:
+    return
+  if organism.interrupt is not None and organism.interrupt.is_set():
+    raise PlanningCancelled()
+  if organism.cooperative_yield:
+    # Sleeping for zero seconds releases the GIL, so an event loop running on another
+    # thread gets to make progress even while a big search is underway.
+    time.sleep(0)
@@ -3,7 +3,9 @@ import math
 import random
 
 from .action import Action
+from .bitvector import BitVector
 from .outcome import Outcome
+from .pool import new_action, new_outcome
 
 
 class OutcomeLikelihoodEstimatorParams:
@@ -16,6 +18,16 @@ class OutcomeLikelihoodEstimatorParams:
     self.forget_delta_threshold = kwargs.get('forget_delta_threshold') 
     if self.forget_delta_threshold is None:
       self.forget_delta_threshold = 0.005
+
+    # When a situation has never been encountered, borrow experience from up to
+    # neighbor_k of the most similar situations that have. 0 disables borrowing.
+    self.neighbor_k = kwargs.get('neighbor_k')
+    if self.neighbor_k is None:
+      self.neighbor_k = 0
+
+    self.neighbor_max_distance = kwargs.get('neighbor_max_distance')
+    if self.neighbor_max_distance is None:
+      self.neighbor_max_distance = 1
     #self.n_registers = 0
 
 
@@ -102,14 +114,16 @@ class OutcomeLikelihoodEstimator:
     if self.organism is None or self.organism.experience_repo is None:
       raise ValueError('Experience repo must be specified.')
     sensorsprobs = self.organism.experience_repo.lookup_outcomes(sensors_prev, action, prob_threshold=0)
+    if not sensorsprobs:
+      sensorsprobs = self.__borrow_outcomes(sensors_prev, action)
 
     outcomes = []
     for sensorsprob in sensorsprobs:
       sensors = sensorsprob[0]
       prob = sensorsprob[1]
       ci = sensorsprob[2]
-      c = Outcome()
-      c.sensors = sensors
+      c = new_outcome(self.organism)
+      c.sensors = BitVector(sensors)
       c.probability = prob
       c.probability_95ci = ci
       outcomes.append(c)
@@ -121,16 +135,52 @@ class OutcomeLikelihoodEstimator:
     if self.organism is None or self.organism.experience_repo is None:
       raise ValueError('Experience repo must be specified.')
     actuatorses = self.organism.experience_repo.lookup_actions(sensors_prev)
+    if not actuatorses:
+      for _, neighbor in self.__neighbors(sensors_prev):
+        for actuators in self.organism.experience_repo.lookup_actions(neighbor):
+          if actuators not in actuatorses:
+            actuatorses.append(actuators)
 
     actions = []
     for actuators in actuatorses:
-      a = Action()
-      a.actuators = actuators
+      a = new_action(self.organism, actuators)
       actions.append(a)
 
     return actions
 
 
+  def __neighbors(self, sensors):
+    if not self.params.neighbor_k:
+      return []
+    return self.organism.experience_repo.nearest_situations(
+      sensors, 
+      k=self.params.neighbor_k, 
+      max_distance=self.params.neighbor_max_distance)
+
+
+  def __borrow_outcomes(self, sensors_prev, action):
+    """Guess at the outcomes of an action in an unfamiliar situation, by looking at what
+    happened when it was performed in the nearest familiar situation. We assume that the
+    action changes the same sensors here as it did there, and we widen the confidence
+    interval in proportion to how different the two situations are.
+    """
+    for distance, neighbor in self.__neighbors(sensors_prev):
+      neighbor_outcomes = self.organism.experience_repo.lookup_outcomes(neighbor, action)
+      if not neighbor_outcomes:
+        continue
+
+      retval = []
+      for sensors_next, prob, ci in neighbor_outcomes:
+        sensors_borrowed = BitVector.from_int(
+          BitVector(sensors_prev).to_int() ^ neighbor.to_int() ^ sensors_next.to_int(), 
+          len(sensors_prev))
+        ci = min(ci + distance / len(sensors_prev), 1)
+        retval.append( (sensors_borrowed, prob, ci) )
+      return retval
+
+    return []
+
+
   def consolidate_experiences(self, max_experience_repo_size, verbosity=0):
     """Tries to determine which experiences can be removed from the repo, that will have a negligible effect
     on the estimate results.
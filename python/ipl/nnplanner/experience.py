@@ -1,5 +1,9 @@
 
 import math
+import threading
+
+from .bitvector import BitVector
+from .neighbors import HammingIndex
 
 
 class SensorsRecord:
@@ -8,13 +12,20 @@ class SensorsRecord:
     self.count = 0
     self.responses = {}
 
+  def copy(self):
+    """A new version of this record. The record objects it refers to are shared.
+    """
+    retval = SensorsRecord(self.sensors)
+    retval.count = self.count
+    retval.responses = dict(self.responses)
+    return retval
+
   def key(self):
     return SensorsRecord.compute_key(self.sensors)
 
   @staticmethod
   def compute_key(sensors):
-    retval = ''.join([str(x) for x in sensors])
-    return retval
+    return BitVector(sensors)
 
 
 
@@ -24,58 +35,148 @@ class ActuatorsRecord:
     self.count = 0
     self.outcomes = {}
 
+  def copy(self):
+    """A new version of this record. The record objects it refers to are shared.
+    """
+    retval = ActuatorsRecord(self.actuators)
+    retval.count = self.count
+    retval.outcomes = dict(self.outcomes)
+    return retval
+
   def key(self):
     return SensorsRecord.compute_key(self.actuators)
 
   @staticmethod
   def compute_key(actuators):
-    retval = ''.join([str(x) for x in actuators])
-    return retval
+    return BitVector(actuators)
 
 
 
 
 class ExperienceRepo:
-  def __init__(self):
+  def __init__(self, concurrent=False):
     """A database of situations encountered, responses tried, and outcomes achieved.
+    Arguments:
+      concurrent {bool} -- Make it safe for other threads to read from the repo while
+          one thread adds to it. Records are then never modified in place; add() builds
+          a new version of the situation's record and swaps it in whole, so any reader
+          sees either the old version or the new one, never a half-updated mixture.
     """
     self.situations = {}
+    self.situation_index = HammingIndex()
     self.__total_record_count = 0
 
+    self.concurrent = concurrent
+    self.__write_lock = threading.Lock()
+
+    # Goes up by one with every add().
+    self.version = 0
+
+    # Views of a repo that lives somewhere else (see shared_repo), and snapshots, can't
+    # be added to.
+    self.read_only = False
+    # Snapshots share their parent's neighbour index, which goes on growing after
+    # they're taken, so they only count the situations they have themselves.
+    self.__index_shared = False
+
+
+  def __getstate__(self):
+    state = dict(self.__dict__)
+    state.pop('_ExperienceRepo__write_lock', None)
+    return state
+
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.__write_lock = threading.Lock()
+    if 'concurrent' not in state:
+      self.concurrent = False
+      self.version = 0
+    if 'read_only' not in state:
+      self.read_only = False
+    if '_ExperienceRepo__index_shared' not in state:
+      self.__index_shared = False
+
+    # Repos pickled before we used BitVectors are keyed by strings of digits.
+    if any(isinstance(k, str) for k in self.situations):
+      self.__rekey()
+      state.pop('situation_index', None)
+
+    # Repos pickled before we kept a neighbour index need one built for them.
+    if 'situation_index' not in state:
+      self.situation_index = HammingIndex()
+      for situation_record in self.situations.values():
+        self.situation_index.add(situation_record.sensors)
+
 
   def __len__(self):
     return self.__total_record_count
 
 
+  def __rekey(self):
+    situations = {}
+    for situation_record in self.situations.values():
+      situation_record.sensors = SensorsRecord.compute_key(situation_record.sensors)
+      responses = {}
+      for action_record in situation_record.responses.values():
+        action_record.actuators = ActuatorsRecord.compute_key(action_record.actuators)
+        outcomes = {}
+        for outcome_record in action_record.outcomes.values():
+          outcome_record.sensors = SensorsRecord.compute_key(outcome_record.sensors)
+          outcomes[outcome_record.sensors] = outcome_record
+        action_record.outcomes = outcomes
+        responses[action_record.actuators] = action_record
+      situation_record.responses = responses
+      situations[situation_record.sensors] = situation_record
+    self.situations = situations
+
+
 
   def add(self, sensors_prev, actuators, sensors_observed, magnitude=1):
     """Add several experiences to the repo.
     Arguments:
-      sensors_prev {list} -- Previous sensor state.
-      actuators {list} -- The action taken.
-      sensors_observed {list} -- The subsequent state of the world observed.
+      sensors_prev {BitVector} -- Previous sensor state.
+      actuators {BitVector} -- The action taken.
+      sensors_observed {BitVector} -- The subsequent state of the world observed.
     """
+    if self.read_only:
+      raise ValueError('read_only', 'This repo is a read-only view.')
+
     situation_key = SensorsRecord.compute_key(sensors_prev)
     action_key = ActuatorsRecord.compute_key(actuators)
     outcome_key = SensorsRecord.compute_key(sensors_observed)
 
-    new_situation = False
-    new_action = False
-    new_outcome = False
+    if not self.concurrent:
+      self.__add(situation_key, action_key, outcome_key, magnitude)
+      return
 
-    if situation_key not in self.situations:
-      self.situations[situation_key] = SensorsRecord(sensors_prev)  
-    situation_record = self.situations[situation_key]
+    with self.__write_lock:
+      self.__add(situation_key, action_key, outcome_key, magnitude)
 
-    if action_key not in situation_record.responses:
-      situation_record.responses[action_key] = ActuatorsRecord(actuators)
-    action_record = situation_record.responses[action_key]
 
-    if outcome_key not in action_record.outcomes:
-      action_record.outcomes[outcome_key] = SensorsRecord(sensors_observed)
-    outcome_record = action_record.outcomes[outcome_key]
 
-    self.__total_record_count += magnitude
+  def __add(self, situation_key, action_key, outcome_key, magnitude):
+    situation_record = self.situations.get(situation_key)
+    is_new_situation = situation_record is None
+    if is_new_situation:
+      situation_record = SensorsRecord(situation_key)
+    elif self.concurrent:
+      situation_record = situation_record.copy()
+
+    action_record = situation_record.responses.get(action_key)
+    if action_record is None:
+      action_record = ActuatorsRecord(action_key)
+    elif self.concurrent:
+      action_record = action_record.copy()
+    situation_record.responses[action_key] = action_record
+
+    outcome_record = action_record.outcomes.get(outcome_key)
+    if outcome_record is None:
+      outcome_record = SensorsRecord(outcome_key)
+    elif self.concurrent:
+      outcome_record = outcome_record.copy()
+    action_record.outcomes[outcome_key] = outcome_record
+
     situation_record.count += magnitude
     action_record.count += magnitude
     outcome_record.count += magnitude
@@ -100,6 +201,126 @@ class ExperienceRepo:
         action_record.count += magboost
         outcome_record.count += magboost
 
+    # Publish. In concurrent mode, this one assignment is what makes the
+    # new version of the situation visible to readers.
+    self.situations[situation_key] = situation_record
+    if is_new_situation:
+      self.situation_index.add(situation_key)
+    self.__total_record_count += magnitude
+    self.version += 1
+
+
+
+  def ingest(self, source, chunk_size=4096, n_sensors=None, n_actuators=None, utility_fn=None, exact=True):
+    """Bulk-load recorded experiences, a chunk at a time.
+
+    By default, experiences are added one at a time, in order, so the repo ends up
+    exactly as if each had gone through add(), salience boosts and all.
+
+    With exact=False, repeats of the same experience within a chunk are grouped
+    together with their magnitudes summed before they touch the repo, so each distinct
+    experience costs one add. That's much quicker for repetitive recordings, but the
+    salience boost then gets applied once per distinct experience per chunk instead of
+    once per occurrence, and in a different order. Wherever the boost kicks in, the
+    counts, and so the probabilities, come out different.
+    Arguments:
+      source -- An iterable of experience tuples, or the path to a .npz or .csv file.
+          See iter_trajectory_chunks for the details.
+      chunk_size {int} -- How many experiences to read at a time.
+      n_sensors {int} -- Number of sensors. Only needed for CSV files.
+      n_actuators {int} -- Number of actuators. Only needed for CSV files.
+      utility_fn {function} -- Used to compute magnitudes, if the source doesn't have them.
+      exact {bool} -- Add experiences one at a time, in order. If False, group repeats
+          within each chunk first.
+    Returns:
+      {int} -- How many experiences were read.
+    """
+    # Imported here so that the repo doesn't drag numpy in with it.
+    from .ingest import iter_trajectory_chunks, group_experiences
+
+    retval = 0
+    chunks = iter_trajectory_chunks(
+      source, 
+      chunk_size=chunk_size, 
+      n_sensors=n_sensors, 
+      n_actuators=n_actuators, 
+      utility_fn=utility_fn)
+
+    for sensors_prev, actuators, sensors_observed, magnitude in chunks:
+      retval += len(sensors_prev)
+      if exact:
+        indices = range(len(sensors_prev))
+        magnitudes = magnitude
+      else:
+        indices, magnitudes = group_experiences(sensors_prev, actuators, sensors_observed, magnitude)
+
+      for i, m in zip(indices, magnitudes):
+        self.add(
+          BitVector(sensors_prev[i]), 
+          BitVector(actuators[i]), 
+          BitVector(sensors_observed[i]), 
+          magnitude=int(m))
+
+    return retval
+
+
+
+  def to_arrays(self):
+    """Flattens the repo into a handful of contiguous numpy arrays, which are much
+    quicker to save and load than the records themselves. See repo_arrays.
+    Returns:
+      {dict} -- Array name to array.
+    """
+    from .repo_arrays import repo_to_arrays
+    return repo_to_arrays(self)
+
+
+  @staticmethod
+  def from_arrays(arrays, lazy=False):
+    """Rebuilds a repo from the arrays made by to_arrays.
+    Arguments:
+      arrays {dict} -- Array name to array.
+      lazy {bool} -- Don't build any records, or the neighbour index, until they're
+          needed. The repo's situations are then an ArraySituations rather than a dict.
+    Returns:
+      {ExperienceRepo}
+    """
+    from .repo_arrays import ArraySituations, LazyHammingIndex
+
+    situations = ArraySituations(arrays)
+    retval = ExperienceRepo()
+    _, _, retval.__total_record_count, retval.version = (int(x) for x in arrays['repo_info'])
+    if lazy:
+      retval.situations = situations
+      retval.situation_index = LazyHammingIndex(situations.base_keys)
+    else:
+      retval.situations = situations.materialize()
+      for key in retval.situations:
+        retval.situation_index.add(key)
+    return retval
+
+
+
+  def snapshot(self):
+    """Gets a read-only view of the repo as it is right now, unaffected by later adds.
+    Only meaningful for concurrent repos, whose records are never modified in place.
+    Returns:
+      {ExperienceRepo} -- A repo that shares records with this one.
+    """
+    if not self.concurrent:
+      raise ValueError('concurrent', 'Only concurrent repos can be snapshotted.')
+    retval = ExperienceRepo(concurrent=True)
+    with self.__write_lock:
+      retval.situations = dict(self.situations)
+      retval.__total_record_count = self.__total_record_count
+      retval.version = self.version
+    retval.read_only = True
+    # Copying the index would cost as much as building it again. Share it instead, and
+    # skip whatever it's learned about since.
+    retval.situation_index = self.situation_index
+    retval.__index_shared = True
+    return retval
+
 
 
   def get_outcome_probability(self, sensors_prev, actuators, sensors_next):
@@ -131,20 +352,27 @@ class ExperienceRepo:
       return (0, 1)
 
     p = outcome_record.count / action_record.count
+    return p, ExperienceRepo.confidence_interval(p, action_record.count)
+
+
 
+  @staticmethod
+  def confidence_interval(p, n):
+    """The 95% confidence interval of an observed outcome probability.
+    Arguments:
+      p {float} -- The observed probability.
+      n {int} -- How many times the action was tried.
+    """
     # To compute confidence interval, start with the tautology that
     # the outcome either happens or it doesn't. Treat it like a
     # Bernouli trial.
     # https://en.wikipedia.org/wiki/Binomial_proportion_confidence_interval
     # https://sigmazone.com/binomial-confidence-intervals/
     z95 = 1.96
-    n = action_record.count
     ci = z95 * math.sqrt ( p*(1.0-p) / n )
 
     # Normalize the CI range to [0,1]
-    ci = min(ci, 1)
-
-    return p, ci
+    return min(ci, 1)
 
 
 
@@ -155,7 +383,7 @@ class ExperienceRepo:
       actuators {list} -- Action to take.
       prob_threshold {float} -- Don't return outcomes whose probability is below this.
     Returns:
-      {list( (list, float, float) )} -- Sorted list of subsequent sensor states, with 
+      {list( (BitVector, float, float) )} -- Sorted list of subsequent sensor states, with 
           probabilities and confidence intervals.
     """
     situation_key = SensorsRecord.compute_key(sensors)
@@ -171,15 +399,10 @@ class ExperienceRepo:
     
     retval = []
     for outcome_record in action_record.outcomes.values():
-      sensors_next = outcome_record.sensors
-      # This isn't super computationally efficient, but it helps to consolidate
-      # the confidence interval calculation code.
-      # TODO: Factor out the confidence interval calculation code.
-      prob, ci = self.get_outcome_probability(sensors, actuators, sensors_next)
-
       prob = outcome_record.count / action_record.count
       if prob >= prob_threshold:
-        retval.append( (sensors_next, prob, ci) )
+        ci = ExperienceRepo.confidence_interval(prob, action_record.count)
+        retval.append( (outcome_record.sensors, prob, ci) )
 
     retval.sort(key = lambda x: -x[1])
     return retval
@@ -190,7 +413,7 @@ class ExperienceRepo:
     Arguments:
       sensors {list} -- Sensor state.
     Returns:
-      {list(list)} -- List of action vectors.
+      {list(BitVector)} -- List of action vectors.
     """
     situation_key = SensorsRecord.compute_key(sensors)
     situation_record = self.situations.get(situation_key)
@@ -202,6 +425,54 @@ class ExperienceRepo:
       retval.append(action_record.actuators)
 
     return retval
+
+
+
+  def nearest_situations(self, sensors, k=1, max_distance=None):
+    """Finds the previously-encountered situations most similar to the given one.
+    Arguments:
+      sensors {list} -- Sensor state.
+      k {int} -- How many situations to return.
+      max_distance {int} -- Ignore situations that differ in more than this many sensors.
+    Returns:
+      {list( (int, BitVector) )} -- Hamming distances and sensor states, nearest first.
+          Includes the situation itself, at distance 0, if it's been encountered.
+    """
+    accept = self.situations.__contains__ if self.__index_shared else None
+    return self.situation_index.nearest(sensors, k=k, max_distance=max_distance, accept=accept)
+
+
+
+  def get_action_count(self, sensors, actuators):
+    """Gets how many times (weighted by magnitude) an action has been taken in a situation.
+    Arguments:
+      sensors {list} -- Sensor state.
+      actuators {list} -- Action taken.
+    Returns:
+      {int} -- The action's count, or 0 if it was never tried in this situation.
+    """
+    situation_record = self.situations.get(SensorsRecord.compute_key(sensors))
+    if not situation_record:
+      return 0
+
+    action_record = situation_record.responses.get(ActuatorsRecord.compute_key(actuators))
+    if not action_record:
+      return 0
+    return action_record.count
+
+
+
+  def iter_experiences(self):
+    """Walks every distinct experience in the repo.
+    Yields:
+      {(BitVector, BitVector, BitVector, int)} -- Previous sensor state, action taken, subsequent sensor state,
+          and the number of times (weighted by magnitude) it was observed.
+    """
+    # Take a list up front, in case another thread adds situations while we're walking.
+    for situation_record in list(self.situations.values()):
+      for action_record in situation_record.responses.values():
+        for outcome_record in action_record.outcomes.values():
+          yield (situation_record.sensors, action_record.actuators, outcome_record.sensors, outcome_record.count)
     
     
     
@@ -0,0 +1,682 @@
+"""Host one experience repo for many organisms, over a socket.
+
+    python -m ipl.nnplanner.experience_service --unix /tmp/ipl-experience.sock
+    python -m ipl.nnplanner.experience_service --port 7117 --exprepo organism-exprepo.p
+
+Organisms then use a RemoteExperienceRepo in place of their own ExperienceRepo.
+
+Requests and responses are frames of a 9-byte header (payload length, request id,
+opcode or status) and a payload. Vectors go over the wire as their length and their
+bit-packed bytes.
+"""
+
+import argparse
+import os
+import selectors
+import socket
+import struct
+import threading
+
+from .bitvector import BitVector
+from .experience import ExperienceRepo
+
+
+_HEADER = struct.Struct('!IIB')
+_U16 = struct.Struct('!H')
+_U32 = struct.Struct('!I')
+_I64 = struct.Struct('!q')
+_F64 = struct.Struct('!d')
+_PROBABILITY = struct.Struct('!dd')
+_INFO = struct.Struct('!qq')
+
+OP_ADD = 1
+OP_GET_OUTCOME_PROBABILITY = 2
+OP_LOOKUP_OUTCOMES = 3
+OP_LOOKUP_ACTIONS = 4
+OP_NEAREST_SITUATIONS = 5
+OP_GET_ACTION_COUNT = 6
+OP_INFO = 7
+OP_EXPERIENCES = 8
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+
+
+def _connect_family(address):
+  # Strings are Unix socket paths, (host, port) tuples are TCP.
+  return socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+
+
+class _Reader:
+  """Walks the fields of a payload.
+  """
+  def __init__(self, data):
+    self.data = data
+    self.offset = 0
+
+  def take(self, fmt):
+    values = fmt.unpack_from(self.data, self.offset)
+    self.offset += fmt.size
+    return values
+
+  def u32(self):
+    return self.take(_U32)[0]
+
+  def i64(self):
+    return self.take(_I64)[0]
+
+  def f64(self):
+    return self.take(_F64)[0]
+
+  def vector(self):
+    length = self.take(_U16)[0]
+    nbytes = (length + 7) // 8
+    bits = int.from_bytes(self.data[self.offset:self.offset + nbytes], 'big')
+    self.offset += nbytes
+    return BitVector.from_int(bits, length)
+
+
+def _vector(v):
+  v = BitVector(v)
+  return _U16.pack(len(v)) + v.to_int().to_bytes((len(v) + 7) // 8, 'big')
+
+
+def _vectors(vs):
+  return _U32.pack(len(vs)) + b''.join(_vector(v) for v in vs)
+
+
+
+# What the server does for each opcode: decode the request, ask the repo, encode the answer.
+
+def _serve_add(repo, r):
+  repo.add(r.vector(), r.vector(), r.vector(), magnitude=r.i64())
+  return b''
+
+def _serve_get_outcome_probability(repo, r):
+  return _PROBABILITY.pack(*repo.get_outcome_probability(r.vector(), r.vector(), r.vector()))
+
+def _serve_lookup_outcomes(repo, r):
+  outcomes = repo.lookup_outcomes(r.vector(), r.vector(), prob_threshold=r.f64())
+  return _U32.pack(len(outcomes)) + b''.join(_vector(s) + _PROBABILITY.pack(p, ci) for s, p, ci in outcomes)
+
+def _serve_lookup_actions(repo, r):
+  return _vectors(repo.lookup_actions(r.vector()))
+
+def _serve_nearest_situations(repo, r):
+  sensors, k, max_distance = r.vector(), r.u32(), r.i64()
+  neighbors = repo.nearest_situations(sensors, k=k, max_distance=None if max_distance < 0 else max_distance)
+  return _U32.pack(len(neighbors)) + b''.join(_U32.pack(d) + _vector(s) for d, s in neighbors)
+
+def _serve_get_action_count(repo, r):
+  return _I64.pack(repo.get_action_count(r.vector(), r.vector()))
+
+def _serve_info(repo, r):
+  return _INFO.pack(len(repo), repo.version)
+
+def _serve_experiences(repo, r):
+  experiences = list(repo.iter_experiences())
+  return _U32.pack(len(experiences)) + b''.join(
+    _vector(s) + _vector(a) + _vector(o) + _I64.pack(count) for s, a, o, count in experiences)
+
+_HANDLERS = {
+  OP_ADD: _serve_add,
+  OP_GET_OUTCOME_PROBABILITY: _serve_get_outcome_probability,
+  OP_LOOKUP_OUTCOMES: _serve_lookup_outcomes,
+  OP_LOOKUP_ACTIONS: _serve_lookup_actions,
+  OP_NEAREST_SITUATIONS: _serve_nearest_situations,
+  OP_GET_ACTION_COUNT: _serve_get_action_count,
+  OP_INFO: _serve_info,
+  OP_EXPERIENCES: _serve_experiences,
+}
+
+
+
+class _ServerConnection:
+  def __init__(self, sock):
+    self.sock = sock
+    self.inbox = bytearray()
+    self.outbox = bytearray()
+
+
+
+class ExperienceServer:
+  """Serves an experience repo to any number of RemoteExperienceRepo clients.
+
+  One thread does all the work, so the repo never sees two requests at once. Each time
+  round its loop, it reads whatever every ready connection has sent, answers all of the
+  requests it got in one batch, and writes each connection's answers back in one go.
+  Clients that pipeline their requests therefore cost one read and one write per
+  batch, rather than per request.
+  """
+
+  def __init__(self, repo=None, address=('127.0.0.1', 0)):
+    """Binds the socket. Nothing gets served until start() or serve_forever().
+    Arguments:
+      repo {ExperienceRepo} -- The repo to serve. A new one if not given.
+      address {str or tuple} -- A Unix socket path, or a (host, port) to listen on.
+          Port 0 picks a free port; see the address attribute for the one we got.
+    """
+    self.repo = repo if repo is not None else ExperienceRepo()
+    self.num_requests = 0
+    self.num_batches = 0
+
+    self.listener = socket.socket(_connect_family(address), socket.SOCK_STREAM)
+    if isinstance(address, str):
+      if os.path.exists(address):
+        os.unlink(address)
+    else:
+      self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self.listener.bind(address)
+    self.listener.listen()
+    self.listener.setblocking(False)
+    self.address = self.listener.getsockname()
+
+    self.__selector = selectors.DefaultSelector()
+    self.__selector.register(self.listener, selectors.EVENT_READ)
+    # Writing a byte to this wakes the loop up, so close() doesn't have to wait for traffic.
+    self.__wakeup_r, self.__wakeup_w = socket.socketpair()
+    self.__wakeup_r.setblocking(False)
+    self.__selector.register(self.__wakeup_r, selectors.EVENT_READ)
+    self.__stopping = False
+    self.__serving = False
+    self.__thread = None
+
+
+  def __enter__(self):
+    return self.start()
+
+  def __exit__(self, *args):
+    self.close()
+
+
+  def start(self):
+    """Serve on a background thread.
+    Returns:
+      {ExperienceServer} -- self.
+    """
+    if self.__thread is None:
+      self.__thread = threading.Thread(target=self.serve_forever, name='ipl-experience-server', daemon=True)
+      self.__thread.start()
+    return self
+
+
+  def close(self):
+    self.__stopping = True
+    if self.__serving:
+      try:
+        self.__wakeup_w.send(b'\0')
+      except OSError:
+        # The loop's already gone.
+        pass
+    if self.__thread is not None:
+      self.__thread.join()
+      self.__thread = None
+    elif not self.__serving:
+      self.__shutdown()
+
+
+  def serve_forever(self):
+    self.__serving = True
+    try:
+      while not self.__stopping:
+        batch = []
+        for key, events in self.__selector.select():
+          if key.fileobj is self.listener:
+            self.__accept()
+          elif key.fileobj is self.__wakeup_r:
+            self.__wakeup_r.recv(4096)
+          else:
+            if events & selectors.EVENT_READ:
+              self.__read(key.data, batch)
+            if events & selectors.EVENT_WRITE:
+              self.__write(key.data)
+        if batch:
+          self.__answer(batch)
+    finally:
+      self.__shutdown()
+
+
+  def __accept(self):
+    try:
+      sock, _ = self.listener.accept()
+    except BlockingIOError:
+      return
+    sock.setblocking(False)
+    if sock.family != socket.AF_UNIX:
+      sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    self.__selector.register(sock, selectors.EVENT_READ, _ServerConnection(sock))
+
+
+  def __read(self, conn, batch):
+    try:
+      data = conn.sock.recv(1 << 16)
+    except (BlockingIOError, InterruptedError):
+      return
+    except OSError:
+      data = b''
+    if not data:
+      self.__drop(conn)
+      return
+
+    conn.inbox += data
+    offset = 0
+    while len(conn.inbox) - offset >= _HEADER.size:
+      length, request_id, op = _HEADER.unpack_from(conn.inbox, offset)
+      end = offset + _HEADER.size + length
+      if len(conn.inbox) < end:
+        break
+      batch.append((conn, request_id, op, bytes(conn.inbox[offset + _HEADER.size:end])))
+      offset = end
+    del conn.inbox[:offset]
+
+
+  def __answer(self, batch):
+    self.num_batches += 1
+    self.num_requests += len(batch)
+    touched = []
+    for conn, request_id, op, payload in batch:
+      try:
+        handler = _HANDLERS.get(op)
+        if handler is None:
+          raise ValueError('op', 'Unknown opcode {}.'.format(op))
+        status, body = STATUS_OK, handler(self.repo, _Reader(payload))
+      except Exception as e: # pylint: disable=W0703
+        # Tell the client, rather than taking the whole service down.
+        status, body = STATUS_ERROR, repr(e).encode('utf-8')
+      if not conn.outbox:
+        touched.append(conn)
+      conn.outbox += _HEADER.pack(len(body), request_id, status) + body
+    for conn in touched:
+      self.__write(conn)
+
+
+  def __write(self, conn):
+    if conn.sock.fileno() < 0:
+      return
+    try:
+      sent = conn.sock.send(conn.outbox)
+    except (BlockingIOError, InterruptedError):
+      sent = 0
+    except OSError:
+      self.__drop(conn)
+      return
+    del conn.outbox[:sent]
+    # Only ask to hear about writability while there's something left to write.
+    self.__selector.modify(conn.sock, selectors.EVENT_READ | (selectors.EVENT_WRITE if conn.outbox else 0), conn)
+
+
+  def __drop(self, conn):
+    conn.outbox.clear()
+    self.__selector.unregister(conn.sock)
+    conn.sock.close()
+
+
+  def __shutdown(self):
+    for key in list(self.__selector.get_map().values()):
+      key.fileobj.close()
+    self.__selector.close()
+    self.__wakeup_w.close()
+    if isinstance(self.address, str) and os.path.exists(self.address):
+      os.unlink(self.address)
+
+
+
+class _ClientConnection:
+  def __init__(self, address, timeout):
+    if isinstance(address, str):
+      self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      self.sock.settimeout(timeout)
+      self.sock.connect(address)
+    else:
+      self.sock = socket.create_connection(address, timeout=timeout)
+      self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    self.next_id = 0
+    # Requests sent on this connection whose responses haven't been read yet.
+    self.num_unanswered = 0
+
+  def frame(self, op, payload):
+    self.next_id = (self.next_id + 1) & 0xffffffff
+    return _HEADER.pack(len(payload), self.next_id, op) + payload
+
+  def read_exactly(self, n):
+    buf = bytearray()
+    while len(buf) < n:
+      chunk = self.sock.recv(n - len(buf))
+      if not chunk:
+        raise ConnectionError('The experience service closed the connection.')
+      buf += chunk
+    return bytes(buf)
+
+  def read_response(self):
+    length, _, status = _HEADER.unpack(self.read_exactly(_HEADER.size))
+    body = self.read_exactly(length)
+    self.num_unanswered -= 1
+    return status, body
+
+  def close(self):
+    self.sock.close()
+
+
+
+# How the client encodes each kind of query, and decodes its answer.
+
+def _request_get_outcome_probability(sensors_prev, actuators, sensors_next):
+  return OP_GET_OUTCOME_PROBABILITY, _vector(sensors_prev) + _vector(actuators) + _vector(sensors_next), _decode_probability
+
+def _request_lookup_outcomes(sensors, actuators, prob_threshold=0):
+  return OP_LOOKUP_OUTCOMES, _vector(sensors) + _vector(actuators) + _F64.pack(prob_threshold), _decode_outcomes
+
+def _request_lookup_actions(sensors):
+  return OP_LOOKUP_ACTIONS, _vector(sensors), _decode_vectors
+
+def _request_nearest_situations(sensors, k=1, max_distance=None):
+  payload = _vector(sensors) + _U32.pack(k) + _I64.pack(-1 if max_distance is None else max_distance)
+  return OP_NEAREST_SITUATIONS, payload, _decode_neighbors
+
+def _request_get_action_count(sensors, actuators):
+  return OP_GET_ACTION_COUNT, _vector(sensors) + _vector(actuators), _decode_count
+
+
+def _decode_none(r):
+  return None
+
+def _decode_probability(r):
+  return r.take(_PROBABILITY)
+
+def _decode_outcomes(r):
+  return [(r.vector(),) + r.take(_PROBABILITY) for _ in range(r.u32())]
+
+def _decode_vectors(r):
+  return [r.vector() for _ in range(r.u32())]
+
+def _decode_neighbors(r):
+  return [(r.u32(), r.vector()) for _ in range(r.u32())]
+
+def _decode_count(r):
+  return r.i64()
+
+def _decode_info(r):
+  return r.take(_INFO)
+
+def _decode_experiences(r):
+  return [(r.vector(), r.vector(), r.vector(), r.i64()) for _ in range(r.u32())]
+
+_REQUESTS = {
+  'get_outcome_probability': _request_get_outcome_probability,
+  'lookup_outcomes': _request_lookup_outcomes,
+  'lookup_actions': _request_lookup_actions,
+  'nearest_situations': _request_nearest_situations,
+  'get_action_count': _request_get_action_count,
+}
+
+
+
+class RemoteExperienceRepo:
+  """An ExperienceRepo that lives in an ExperienceServer, possibly in another process.
+
+  Has the same query and add methods as ExperienceRepo, so it can be dropped in as an
+  organism's experience_repo. Calls are made over a pool of connections, so several
+  threads can use one of these at once.
+
+  add() doesn't wait for the server to acknowledge the experience; adds are pipelined,
+  and their acknowledgements read the next time the connection is used. Queries always
+  wait for any outstanding adds first, so a client always sees its own adds. Use
+  batch() to pipeline queries too.
+  """
+
+  confidence_interval = staticmethod(ExperienceRepo.confidence_interval)
+
+  def __init__(self, address, pool_size=4, timeout=None, max_unanswered=256):
+    """Connections are only made as they're needed.
+    Arguments:
+      address {str or tuple} -- The server's Unix socket path, or its (host, port).
+      pool_size {int} -- The most connections to keep open at once.
+      timeout {float} -- Seconds to wait on the server before giving up. Forever if None.
+      max_unanswered {int} -- The most pipelined requests to have in flight on one
+          connection before we stop and read some answers.
+    """
+    self.address = address if isinstance(address, str) else tuple(address)
+    self.pool_size = pool_size
+    self.timeout = timeout
+    self.max_unanswered = max_unanswered
+    self.concurrent = True
+    self.read_only = False
+
+    self.__lock = threading.Condition()
+    self.__idle = []
+    self.__num_open = 0
+    self.__num_unacknowledged = 0
+
+
+  def __reduce__(self):
+    # Sockets can't be pickled, but the address can, and that's all a worker needs.
+    return (RemoteExperienceRepo, (self.address, self.pool_size, self.timeout, self.max_unanswered))
+
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+
+  def close(self):
+    """Waits for outstanding adds, then closes every connection.
+    """
+    self.flush()
+    with self.__lock:
+      idle, self.__idle = self.__idle, []
+      self.__num_open -= len(idle)
+    for conn in idle:
+      conn.close()
+
+
+  def __checkout(self):
+    with self.__lock:
+      while not self.__idle and self.__num_open >= self.pool_size:
+        self.__lock.wait()
+      if self.__idle:
+        return self.__idle.pop()
+      self.__num_open += 1
+    try:
+      return _ClientConnection(self.address, self.timeout)
+    except:
+      with self.__lock:
+        self.__num_open -= 1
+        self.__lock.notify_all()
+      raise
+
+
+  def __checkin(self, conn, broken=False):
+    with self.__lock:
+      if broken:
+        self.__num_open -= 1
+        self.__num_unacknowledged -= conn.num_unanswered
+      else:
+        self.__idle.append(conn)
+      self.__lock.notify_all()
+    if broken:
+      conn.close()
+
+
+  def __drain(self, conn, keep=0):
+    # Reads add acknowledgements until no more than keep are outstanding.
+    error = None
+    while conn.num_unanswered > keep:
+      status, body = conn.read_response()
+      with self.__lock:
+        self.__num_unacknowledged -= 1
+      if status != STATUS_OK and error is None:
+        error = body
+    if error is not None:
+      raise RuntimeError('The experience service failed to add an experience: {}'.format(error.decode('utf-8')))
+
+
+  def flush(self):
+    """Wait until the server has acknowledged every add made so far.
+    """
+    while True:
+      with self.__lock:
+        while self.__num_unacknowledged and not any(c.num_unanswered for c in self.__idle):
+          # Whoever has the connection will read the acknowledgements.
+          self.__lock.wait()
+        if not self.__num_unacknowledged:
+          return
+        conns = [c for c in self.__idle if c.num_unanswered]
+        self.__idle = [c for c in self.__idle if not c.num_unanswered]
+      for conn in conns:
+        self.__use(conn, self.__drain, conn)
+
+
+  def __use(self, conn, fn, *args):
+    try:
+      retval = fn(*args)
+    except (OSError, ConnectionError):
+      self.__checkin(conn, broken=True)
+      raise
+    except:
+      self.__checkin(conn)
+      raise
+    self.__checkin(conn)
+    return retval
+
+
+  def __round_trip(self, conn, requests):
+    self.__drain(conn)
+    responses = []
+    # Keep no more than max_unanswered in flight, so neither side's buffers fill up.
+    for start in range(0, len(requests), self.max_unanswered):
+      chunk = requests[start:start + self.max_unanswered]
+      conn.sock.sendall(b''.join(conn.frame(op, payload) for op, payload, _ in chunk))
+      conn.num_unanswered += len(chunk)
+      for _, _, decode in chunk:
+        status, body = conn.read_response()
+        if status != STATUS_OK:
+          responses.append(RuntimeError('The experience service failed: {}'.format(body.decode('utf-8'))))
+        else:
+          responses.append(decode(_Reader(body)))
+    return responses
+
+
+  def __call_many(self, requests):
+    if self.__num_unacknowledged:
+      self.flush()
+    conn = self.__checkout()
+    responses = self.__use(conn, self.__round_trip, conn, requests)
+    for response in responses:
+      if isinstance(response, RuntimeError):
+        raise response
+    return responses
+
+
+  def __call(self, op, payload, decode):
+    return self.__call_many([(op, payload, decode)])[0]
+
+
+  def __send_add(self, conn, frame):
+    if conn.num_unanswered >= self.max_unanswered:
+      self.__drain(conn, keep=self.max_unanswered // 2)
+    conn.sock.sendall(frame)
+    conn.num_unanswered += 1
+    with self.__lock:
+      self.__num_unacknowledged += 1
+
+
+  def add(self, sensors_prev, actuators, sensors_observed, magnitude=1):
+    """See ExperienceRepo.add. Returns as soon as the experience has been sent.
+    """
+    payload = _vector(sensors_prev) + _vector(actuators) + _vector(sensors_observed) + _I64.pack(magnitude)
+    conn = self.__checkout()
+    self.__use(conn, self.__send_add, conn, conn.frame(OP_ADD, payload))
+
+
+  def get_outcome_probability(self, sensors_prev, actuators, sensors_next):
+    """See ExperienceRepo.get_outcome_probability.
+    """
+    return self.__call(*_request_get_outcome_probability(sensors_prev, actuators, sensors_next))
+
+
+  def lookup_outcomes(self, sensors, actuators, prob_threshold=0):
+    """See ExperienceRepo.lookup_outcomes.
+    """
+    return self.__call(*_request_lookup_outcomes(sensors, actuators, prob_threshold))
+
+
+  def lookup_actions(self, sensors):
+    """See ExperienceRepo.lookup_actions.
+    """
+    return self.__call(*_request_lookup_actions(sensors))
+
+
+  def nearest_situations(self, sensors, k=1, max_distance=None):
+    """See ExperienceRepo.nearest_situations.
+    """
+    return self.__call(*_request_nearest_situations(sensors, k, max_distance))
+
+
+  def get_action_count(self, sensors, actuators):
+    """See ExperienceRepo.get_action_count.
+    """
+    return self.__call(*_request_get_action_count(sensors, actuators))
+
+
+  def batch(self, calls):
+    """Makes many queries in one round trip.
+    Arguments:
+      calls {list( (str, tuple) )} -- Method names and their positional arguments,
+          e.g. [('lookup_actions', (sensors,)), ('lookup_outcomes', (sensors, actuators))].
+    Returns:
+      {list} -- What each method would have returned, in order.
+    """
+    requests = []
+    for name, args in calls:
+      if name not in _REQUESTS:
+        raise ValueError('calls', 'Can\'t batch {}.'.format(name))
+      requests.append(_REQUESTS[name](*args))
+    return self.__call_many(requests)
+
+
+  def __len__(self):
+    return self.__call(OP_INFO, b'', _decode_info)[0]
+
+
+  @property
+  def version(self):
+    return self.__call(OP_INFO, b'', _decode_info)[1]
+
+
+  def iter_experiences(self):
+    """See ExperienceRepo.iter_experiences. Fetches all of them in one go.
+    """
+    return iter(self.__call(OP_EXPERIENCES, b'', _decode_experiences))
+
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(prog='python -m ipl.nnplanner.experience_service', description=__doc__,
+    formatter_class=argparse.RawDescriptionHelpFormatter)
+  where = parser.add_mutually_exclusive_group(required=True)
+  where.add_argument('--unix', help='Listen on this Unix socket path.')
+  where.add_argument('--port', type=int, help='Listen on this TCP port.')
+  parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on, with --port.')
+  parser.add_argument('--exprepo', help='Pickled experience repo to start from.')
+  args = parser.parse_args(argv)
+
+  repo = None
+  if args.exprepo:
+    import pickle
+    with open(args.exprepo, 'rb') as f:
+      repo = pickle.load(f)
+
+  server = ExperienceServer(repo, address=args.unix or (args.host, args.port))
+  print('Serving {} experiences on {}'.format(len(server.repo), server.address), flush=True)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,162 @@
+
+import itertools
+import zipfile
+
+import numpy  # pylint: disable=E0401
+
+from .bitvector import BitVector
+
+
+def iter_trajectory_chunks(source, chunk_size=4096, n_sensors=None, n_actuators=None, utility_fn=None):
+  """Reads recorded experiences in chunks of arrays.
+  Arguments:
+    source -- One of:
+        * An iterable of (sensors_prev, actuators, sensors_observed) or
+          (sensors_prev, actuators, sensors_observed, magnitude) tuples.
+        * The path of a .npz file with 2-D arrays 'sensors_prev', 'actuators' and
+          'sensors_observed', and optionally 1-D arrays 'magnitude' or 'turn'. The
+          arrays are read a chunk at a time, not loaded whole.
+        * The path of a .csv file with one experience per row: n_sensors columns of
+          previous sensors, n_actuators of actuators, n_sensors of observed sensors, and
+          optionally a magnitude column.
+    chunk_size {int} -- How many experiences per chunk.
+    n_sensors {int} -- Number of sensors. Only needed for CSV files.
+    n_actuators {int} -- Number of actuators. Only needed for CSV files.
+    utility_fn {function} -- If given, and the source has no magnitudes but does have 'turn'
+        (which transition of its episode each experience was, counting from 1), then
+        magnitudes are computed the way the organism computes them: experiences that
+        arrive at a state with positive utility get the number of turns it took.
+  Yields:
+    {(ndarray, ndarray, ndarray, ndarray)} -- Previous sensors, actuators and observed
+        sensors as 2-D arrays of 0s and 1s, one row per experience, and magnitudes.
+  """
+  if isinstance(source, str) and source.endswith('.npz'):
+    chunks = _iter_npz_chunks(source, chunk_size)
+  elif isinstance(source, str) and source.endswith('.csv'):
+    if n_sensors is None or n_actuators is None:
+      raise ValueError('n_sensors', 'Must be provided to read CSV files.')
+    chunks = _iter_csv_chunks(source, chunk_size, n_sensors, n_actuators)
+  elif isinstance(source, str):
+    raise ValueError('source', 'Unrecognized trajectory file type: {}'.format(source))
+  else:
+    chunks = _iter_tuple_chunks(source, chunk_size)
+
+  for sensors_prev, actuators, sensors_observed, magnitude, turn in chunks:
+    if magnitude is None:
+      magnitude = numpy.ones(len(sensors_prev), dtype=numpy.int64)
+      if utility_fn is not None and turn is not None:
+        rewarded = numpy.array([utility_fn(BitVector(s)) > 0 for s in sensors_observed])
+        # The organism has been awake one turn longer than the number of
+        # transitions it's made, because its first turn has nothing to learn from.
+        magnitude[rewarded] = turn[rewarded] + 1
+    yield sensors_prev, actuators, sensors_observed, magnitude
+
+
+
+def group_experiences(sensors_prev, actuators, sensors_observed, magnitude):
+  """Collapses repeated experiences within a chunk, summing their magnitudes.
+  Returns:
+    {(ndarray, ndarray)} -- The row index of the first occurrence of each distinct
+        experience, in order of first occurrence, and the summed magnitude of each.
+  """
+  packed = numpy.ascontiguousarray(numpy.hstack([
+    numpy.packbits(sensors_prev.astype(numpy.uint8), axis=1),
+    numpy.packbits(actuators.astype(numpy.uint8), axis=1),
+    numpy.packbits(sensors_observed.astype(numpy.uint8), axis=1),
+  ]))
+  rows = packed.view(numpy.dtype((numpy.void, packed.shape[1]))).ravel()
+  _, first_index, inverse = numpy.unique(rows, return_index=True, return_inverse=True)
+  totals = numpy.bincount(inverse.ravel(), weights=magnitude, minlength=len(first_index))
+
+  order = numpy.argsort(first_index)
+  return first_index[order], totals[order]
+
+
+
+def _iter_tuple_chunks(source, chunk_size):
+  iterator = iter(source)
+  while True:
+    rows = list(itertools.islice(iterator, chunk_size))
+    if not rows:
+      return
+    sensors_prev = numpy.array([r[0] for r in rows], dtype=numpy.uint8)
+    actuators = numpy.array([r[1] for r in rows], dtype=numpy.uint8)
+    sensors_observed = numpy.array([r[2] for r in rows], dtype=numpy.uint8)
+    magnitude = None
+    if len(rows[0]) > 3:
+      magnitude = numpy.array([r[3] for r in rows], dtype=numpy.int64)
+    yield sensors_prev, actuators, sensors_observed, magnitude, None
+
+
+_NPZ_COLUMNS = ('sensors_prev', 'actuators', 'sensors_observed', 'magnitude', 'turn')
+_NPZ_REQUIRED = 3
+
+
+def _iter_npz_chunks(path, chunk_size):
+  with zipfile.ZipFile(path) as archive:
+    members = set(archive.namelist())
+    for name in _NPZ_COLUMNS[:_NPZ_REQUIRED]:
+      if name + '.npy' not in members:
+        raise ValueError('source', 'No {} array in {}.'.format(name, path))
+
+    columns = [
+      _iter_npy_rows(archive, name + '.npy', chunk_size) if name + '.npy' in members else itertools.repeat(None)
+      for name in _NPZ_COLUMNS
+    ]
+    try:
+      for chunk in zip(*columns):
+        yield chunk
+    finally:
+      for column in columns:
+        if hasattr(column, 'close'):
+          column.close()
+
+
+def _iter_npy_rows(archive, member, chunk_size):
+  # Reads a .npy file inside a zip archive chunk_size rows at a time, straight out of
+  # the (possibly compressed) stream.
+  with archive.open(member) as f:
+    version = numpy.lib.format.read_magic(f)
+    if version == (1, 0):
+      shape, fortran_order, dtype = numpy.lib.format.read_array_header_1_0(f)
+    elif version == (2, 0):
+      shape, fortran_order, dtype = numpy.lib.format.read_array_header_2_0(f)
+    else:
+      shape, fortran_order, dtype = None, True, None
+
+    if fortran_order or not shape or dtype.hasobject:
+      # Not laid out a row at a time. These are rare enough to just load whole.
+      f.close()
+      with numpy.load(archive.filename) as data:
+        array = data[member[:-len('.npy')]]
+      for start in range(0, len(array), chunk_size):
+        yield array[start:start + chunk_size]
+      return
+
+    row_shape = tuple(shape[1:])
+    row_bytes = dtype.itemsize * int(numpy.prod(row_shape, dtype=numpy.int64))
+    for start in range(0, shape[0], chunk_size):
+      n = min(chunk_size, shape[0] - start)
+      buf = f.read(n * row_bytes)
+      yield numpy.frombuffer(buf, dtype=dtype).reshape((n,) + row_shape)
+
+
+def _iter_csv_chunks(path, chunk_size, n_sensors, n_actuators):
+  with open(path) as f:
+    while True:
+      lines = list(itertools.islice(f, chunk_size))
+      if not lines:
+        return
+      table = numpy.loadtxt(lines, delimiter=',', dtype=numpy.int64, ndmin=2)
+      i_actuators = n_sensors
+      i_observed = i_actuators + n_actuators
+      i_magnitude = i_observed + n_sensors
+      magnitude = table[:, i_magnitude] if table.shape[1] > i_magnitude else None
+      yield (
+        table[:, :i_actuators],
+        table[:, i_actuators:i_observed],
+        table[:, i_observed:i_magnitude],
+        magnitude,
+        None,
+      )
+
@@ -0,0 +1,182 @@
+
+import queue
+import threading
+
+
+class BackgroundLearnerParams:
+  """Configuration for a background learner.
+  """
+  def __init__(self, **kwargs):
+    """
+    Arguments:
+      queue_size {int} -- How many experiences may be waiting to be learned. Once the
+          queue is full, submitting more blocks until the learner catches up.
+      batch_size {int} -- The most experiences the learner takes on in one go.
+      batch_timeout {float} -- Seconds the worker waits for new experiences before
+          checking whether it's been told to stop.
+    """
+    self.queue_size = kwargs.get('queue_size')
+    if self.queue_size is None:
+      self.queue_size = 1024
+
+    self.batch_size = kwargs.get('batch_size')
+    if self.batch_size is None:
+      self.batch_size = 64
+
+    self.batch_timeout = kwargs.get('batch_timeout')
+    if self.batch_timeout is None:
+      self.batch_timeout = .1
+
+
+
+class BackgroundLearner:
+  """Learns from experiences on a worker thread, so that the cost of learning doesn't
+  land on the organism's turn.
+
+  The organism submits each experience instead of adding it to its repo directly. The
+  worker drains the queue in batches, adds each experience to the repo and the outcome
+  proposer, and then lets the outcome likelihood estimator learn from the repo. Every
+  time it finishes a batch, it publishes a new model version: a snapshot of the repo,
+  and a copy of the proposer that reads from it.
+
+  While the learner runs, the live repo and proposer belong to the worker. The
+  organism plans with whichever model was published last (see published()), so a
+  whole decision sees one consistent version of what's been learned. stop() hands the
+  live ones back. Repos that can't be snapshotted are published as they are, and read
+  while the worker writes to them.
+  """
+
+  def __init__(self, organism, params):
+    """Create the learner. It doesn't do anything until it's started.
+    Arguments:
+      params {BackgroundLearnerParams} -- Configuration info.
+    """
+    self.organism = organism
+    self.params = params
+
+    self.queue = queue.Queue(maxsize=params.queue_size)
+    self.num_learned = 0
+
+    # What the worker writes to.
+    self.repo = None
+    self.proposer = None
+    # (version, repo, proposer), replaced whole every time a batch is learned.
+    self.__published = (0, None, None)
+
+    self.__thread = None
+    self.__stopping = threading.Event()
+    self.__error = None
+
+
+  @property
+  def published_version(self):
+    return self.__published[0]
+
+
+  def published(self):
+    """
+    Returns:
+      {(int, ExperienceRepo, OutcomeProposer)} -- The latest model version, and the
+          repo and proposer to plan with. Until the learner's started, that's just
+          the organism's own.
+    """
+    if self.__thread is None:
+      return (self.published_version, self.organism.experience_repo, self.organism.outcome_proposer)
+    return self.__published
+
+
+  def start(self):
+    if self.__thread is not None:
+      return
+    self.repo = self.organism.experience_repo
+    self.proposer = self.organism.outcome_proposer
+    if self.repo is not None:
+      self.repo.concurrent = True
+    if self.proposer is not None:
+      self.proposer.repo = self.repo
+    self.__publish(self.published_version)
+    self.__stopping.clear()
+    self.__thread = threading.Thread(target=self.__work, name='ipl-learner', daemon=True)
+    self.__thread.start()
+
+
+  def stop(self):
+    """Learn whatever is still queued, then shut down the worker.
+    """
+    if self.__thread is None:
+      return
+    try:
+      self.flush()
+    finally:
+      self.__stopping.set()
+      self.__thread.join()
+      self.__thread = None
+      self.organism.experience_repo = self.repo
+      self.organism.outcome_proposer = self.proposer
+      if self.proposer is not None:
+        self.proposer.repo = None
+
+
+  def submit(self, sensors_prev, actuators, sensors_observed, magnitude=1):
+    """Queue an experience for learning. Arguments are as for ExperienceRepo.add.
+    """
+    if self.__error is not None:
+      raise RuntimeError('The background learner failed.') from self.__error
+    self.queue.put((sensors_prev, actuators, sensors_observed, magnitude))
+
+
+  def flush(self):
+    """Wait until everything submitted so far has been learned.
+    """
+    self.queue.join()
+    if self.__error is not None:
+      raise RuntimeError('The background learner failed.') from self.__error
+
+
+  def __work(self):
+    while not self.__stopping.is_set():
+      try:
+        batch = [self.queue.get(timeout=self.params.batch_timeout)]
+      except queue.Empty:
+        continue
+      while len(batch) < self.params.batch_size:
+        try:
+          batch.append(self.queue.get_nowait())
+        except queue.Empty:
+          break
+
+      try:
+        self.__learn(batch)
+      except Exception as e: # pylint: disable=W0703
+        # Don't let the organism carry on as if it were learning.
+        self.__error = e
+      finally:
+        for _ in batch:
+          self.queue.task_done()
+
+
+  def __learn(self, batch):
+    organism = self.organism
+    for sensors_prev, actuators, sensors_observed, magnitude in batch:
+      if self.repo is not None:
+        self.repo.add(sensors_prev, actuators, sensors_observed, magnitude=magnitude)
+      if self.proposer is not None:
+        self.proposer.observe(sensors_prev, actuators, sensors_observed, magnitude=magnitude)
+
+    # The estimator keeps nothing of its own; everything it knows, it reads from
+    # whichever repo the organism is planning with.
+    if organism.outcome_likelihood_estimator is not None:
+      organism.outcome_likelihood_estimator.learn(self.repo)
+
+    self.num_learned += len(batch)
+    self.__publish(self.published_version + 1)
+
+
+  def __publish(self, version):
+    repo = self.repo
+    # Look on the class, so that wrappers don't hand us their backend's snapshot.
+    if getattr(type(repo), 'snapshot', None) is not None:
+      repo = repo.snapshot()
+    proposer = self.proposer.frozen_copy(repo) if self.proposer is not None else None
+    self.__published = (version, repo, proposer)
+
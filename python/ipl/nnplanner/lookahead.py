@@ -1,6 +1,11 @@
 
 
+from .bitvector import BitVector
+
+
 class Lookahead:
+  __slots__ = ('sensors', 'best_actuators', 'utility', 'recursion_depth')
+
   def __init__(self, sensors, best_actuators, utility, recursion_depth):
     self.sensors = sensors
     self.best_actuators = best_actuators
@@ -14,8 +19,7 @@ class Lookahead:
 
   @staticmethod
   def sensors_key(sensors):
-    retval = str(['{:.02f}'.format(x) for x in sensors])
-    return retval
+    return BitVector(sensors)
 
 
 class LookaheadCache:
@@ -0,0 +1,131 @@
+
+import heapq
+
+from .bitvector import BitVector
+
+
+def hamming_distance(bits1, bits2):
+  """Number of positions at which two bit vectors differ.
+  Arguments:
+    bits1 {int} -- A bit vector packed into an int.
+    bits2 {int} -- A bit vector packed into an int.
+  Returns:
+    {int} -- The Hamming distance.
+  """
+  return bin(bits1 ^ bits2).count('1')
+
+
+def pack_bits(vector):
+  """Packs a binary vector into an int, first element most significant.
+  Arguments:
+    vector {list} -- A vector of 0s and 1s.
+  Returns:
+    {int} -- The packed bits.
+  """
+  if isinstance(vector, BitVector):
+    return vector.to_int()
+  retval = 0
+  for x in vector:
+    retval = (retval << 1) | (1 if x else 0)
+  return retval
+
+
+
+class _BKNode:
+  __slots__ = ('bits', 'item', 'children')
+
+  def __init__(self, bits, item):
+    self.bits = bits
+    self.item = item
+    self.children = {}
+
+
+
+class HammingIndex:
+  """A BK-tree over binary vectors, for nearest-neighbour queries in Hamming space.
+
+  Every child of a node sits at a known distance from that node, so the triangle
+  inequality lets a query skip whole subtrees that can't possibly contain anything
+  closer than what it has already found. For the clustered vectors we actually
+  encounter, that means a query touches a small fraction of the stored vectors.
+  """
+
+  def __init__(self):
+    self.root = None
+    self.__size = 0
+
+
+  def __len__(self):
+    return self.__size
+
+
+  def add(self, vector, item=None):
+    """Index a vector. Adding the same vector twice is a no-op.
+    Arguments:
+      vector {list} -- A binary vector.
+      item {object} -- What to return when this vector is found. Defaults to the vector itself.
+    """
+    bits = pack_bits(vector)
+    if item is None:
+      item = vector
+
+    if self.root is None:
+      self.root = _BKNode(bits, item)
+      self.__size += 1
+      return
+
+    node = self.root
+    while True:
+      d = hamming_distance(bits, node.bits)
+      if d == 0:
+        return
+      child = node.children.get(d)
+      if child is None:
+        node.children[d] = _BKNode(bits, item)
+        self.__size += 1
+        return
+      node = child
+
+
+  def nearest(self, vector, k=1, max_distance=None, accept=None):
+    """Find the k stored vectors closest to the given one.
+    Arguments:
+      vector {list} -- A binary vector.
+      k {int} -- How many neighbours to return.
+      max_distance {int} -- Don't return anything farther away than this.
+      accept {function} -- If given, only items for which this returns True count.
+    Returns:
+      {list( (int, object) )} -- Distances and items, nearest first.
+    """
+    if self.root is None or k <= 0:
+      return []
+
+    bits = pack_bits(vector)
+    radius = max_distance if max_distance is not None else len(vector)
+
+    # Max-heap (by negated distance) of the best k found so far. The counter
+    # breaks ties so that we never have to compare items.
+    best = []
+    counter = 0
+
+    stack = [self.root]
+    while stack:
+      node = stack.pop()
+      d = hamming_distance(bits, node.bits)
+      if d <= radius and (accept is None or accept(node.item)):
+        heapq.heappush(best, (-d, counter, node.item))
+        counter += 1
+        if len(best) > k:
+          heapq.heappop(best)
+        if len(best) == k:
+          radius = min(radius, -best[0][0])
+
+      # Copying the children is atomic, which keeps us safe from concurrent add()s.
+      for dchild, child in list(node.children.items()):
+        if d - radius <= dchild <= d + radius:
+          stack.append(child)
+
+    retval = [(-negd, item) for negd, _, item in best]
+    retval.sort(key=lambda x: x[0])
+    return retval
+
@@ -0,0 +1,241 @@
+
+from .bitvector import BitVector
+
+
+class OptionLibraryParams:
+  """Configuration for an option library.
+  """
+  def __init__(self, **kwargs):
+    """
+    Arguments:
+      max_length {int} -- The longest action sequence to remember.
+      min_count {int} -- How many successful episodes a sequence has to have been part
+          of before it's proposed.
+      max_options {int} -- The most options to propose in any one situation.
+      max_episode_length {int} -- The most steps of the current episode to keep.
+    """
+    self.max_length = kwargs.get('max_length')
+    if self.max_length is None:
+      self.max_length = 12
+
+    self.min_count = kwargs.get('min_count')
+    if self.min_count is None:
+      self.min_count = 2
+
+    self.max_options = kwargs.get('max_options')
+    if self.max_options is None:
+      self.max_options = 3
+
+    self.max_episode_length = kwargs.get('max_episode_length')
+    if self.max_episode_length is None:
+      self.max_episode_length = 1000
+
+
+
+class Option:
+  """An action sequence, and what the experience repo expects it to do from the
+  situation it was proposed in.
+  """
+  __slots__ = ('actuatorses', 'predictions', 'probabilities', 'utility', 'expected_utility')
+
+  def __init__(self, actuatorses, predictions, probabilities, utility):
+    """
+    Arguments:
+      actuatorses {tuple(BitVector)} -- The actions, in order.
+      predictions {tuple(BitVector)} -- The situation we expect to be in after each one.
+      probabilities {tuple(float)} -- How likely each prediction is, given the one before.
+      utility {float} -- The utility of the last prediction.
+    """
+    self.actuatorses = actuatorses
+    self.predictions = predictions
+    self.probabilities = probabilities
+    self.utility = utility
+    self.expected_utility = self.expected_utility_from(0)
+
+  def __len__(self):
+    return len(self.actuatorses)
+
+  def expected_utility_from(self, step):
+    """What the rest of the option is worth, once its first step actions have been
+    taken and have turned out as predicted. Those are certain now, so neither their
+    probabilities nor their discounts count against it any more.
+    """
+    p = 1
+    for q in self.probabilities[step:]:
+      p *= q
+    # Discounted the same way every level of the planning tree is.
+    return self.utility * p * .9 ** (len(self) - step)
+
+  def __repr__(self):
+    return 'OPTION: {} steps ${:.02f}'.format(len(self), self.expected_utility)
+
+
+
+class _OptionNode:
+  """A node of an option trie. The path from the root to it is an action sequence.
+  """
+  __slots__ = ('children', 'count', 'num_endings')
+
+  def __init__(self):
+    self.children = {}
+    # How many mined sequences passed through here, and how many ended here.
+    self.count = 0
+    self.num_endings = 0
+
+
+
+class OptionLibrary:
+  """Remembers action sequences that got the organism to its goal, so that it can
+  propose them again as single macro-actions.
+
+  The planner only looks action_outcome_lookahead steps ahead, so once the organism
+  has learned its way around, it still can't see the goal from far away, and has to
+  replan every step on the way there. Here, whenever an episode reaches positive
+  utility, every suffix of the path it took (with any loops cut out of it) is filed in
+  a trie under the situation it starts from. Sequences that have worked at least
+  min_count times get proposed to the action generator, which plays out each one
+  against the experience repo and credits its first action with the whole sequence's
+  discounted utility. The organism then follows the rest of the sequence without
+  replanning, for as long as what it observes is what the repo predicted.
+  """
+
+  def __init__(self, organism, params):
+    """
+    Arguments:
+      params {OptionLibraryParams} -- Configuration info.
+    """
+    self.organism = organism
+    self.params = params
+
+    # Starting situation to trie root.
+    self.tries = {}
+    # (sensors, actuators) for each step of the current episode so far.
+    self.episode = []
+
+
+  def __len__(self):
+    return len(self.tries)
+
+
+  def reset_episode(self):
+    self.episode = []
+
+
+  def observe(self, sensors_prev, actuators, sensors_observed):
+    """Record a step of the current episode. If it reached the goal, mine the episode
+    for options and start a new one.
+    """
+    self.episode.append((BitVector(sensors_prev), BitVector(actuators)))
+    if len(self.episode) > self.params.max_episode_length:
+      self.episode = self.episode[-self.params.max_episode_length:]
+
+    if self.organism.utility_fn(sensors_observed) > 0:
+      self.learn_path(self.episode, sensors_observed)
+      self.episode = []
+
+
+  def learn_path(self, steps, sensors_final):
+    """File away every suffix of a successful path.
+    Arguments:
+      steps {list((BitVector, BitVector))} -- The situation and the action taken in it,
+          for every step of the path.
+      sensors_final {list} -- Where the path ended up.
+    """
+    steps = _erase_loops(steps, BitVector(sensors_final))[-self.params.max_length:]
+    for i, (sensors, _) in enumerate(steps):
+      node = self.tries.setdefault(sensors, _OptionNode())
+      for _, actuators in steps[i:]:
+        node = node.children.setdefault(actuators, _OptionNode())
+        node.count += 1
+      node.num_endings += 1
+
+
+  def sequences(self, sensors):
+    """
+    Arguments:
+      sensors {list} -- A situation.
+    Returns:
+      {list(tuple(BitVector))} -- The action sequences that have reached the goal from
+          here at least min_count times, most often first.
+    """
+    root = self.tries.get(BitVector(sensors))
+    if root is None:
+      return []
+    found = []
+    stack = [(root, ())]
+    while stack:
+      node, path = stack.pop()
+      if path and node.num_endings >= self.params.min_count:
+        found.append((node.num_endings, path))
+      for actuators, child in node.children.items():
+        # Nothing further down can have ended more often than this passed through.
+        if child.count >= self.params.min_count:
+          stack.append((child, path + (actuators,)))
+    found.sort(key=lambda f: (-f[0], len(f[1])))
+    return [path for _, path in found]
+
+
+  def evaluate(self, sensors, actuatorses):
+    """Plays out an action sequence against the experience repo, following the most
+    likely outcome of every step.
+    Arguments:
+      sensors {list} -- Where the sequence starts.
+      actuatorses {tuple(BitVector)} -- The sequence.
+    Returns:
+      {Option} -- The sequence, cut short wherever it reaches positive utility, or None
+          if the repo doesn't expect it to get there.
+    """
+    repo = self.organism.experience_repo
+    utility_fn = self.organism.utility_fn
+    predictions = []
+    probabilities = []
+    for i, actuators in enumerate(actuatorses):
+      outcomes = repo.lookup_outcomes(sensors, actuators)
+      if not outcomes:
+        return None
+      sensors, p, _ = max(outcomes, key=lambda o: o[1])
+      predictions.append(sensors)
+      probabilities.append(p)
+      utility = utility_fn(sensors)
+      if utility > 0:
+        n = i + 1
+        return Option(tuple(actuatorses[:n]), tuple(predictions), tuple(probabilities), min(utility, 1))
+    return None
+
+
+  def propose(self, sensors):
+    """
+    Arguments:
+      sensors {list} -- The situation to act in.
+    Returns:
+      {dict} -- First actuators to the best Option that starts with them, for at most
+          max_options options.
+    """
+    retval = {}
+    for actuatorses in self.sequences(sensors):
+      option = self.evaluate(sensors, actuatorses)
+      if option is None:
+        continue
+      best = retval.get(option.actuatorses[0])
+      if best is None or option.expected_utility > best.expected_utility:
+        retval[option.actuatorses[0]] = option
+      if len(retval) >= self.params.max_options:
+        break
+    return retval
+
+
+
+def _erase_loops(steps, sensors_final):
+  # Whenever the path comes back to a situation it's been in before, everything it
+  # did in between got it nowhere.
+  retval = []
+  seen = {}
+  for sensors, actuators in steps + [(sensors_final, None)]:
+    i = seen.get(sensors)
+    if i is not None:
+      for s, _ in retval[i:]:
+        del seen[s]
+      del retval[i:]
+    seen[sensors] = len(retval)
+    retval.append((sensors, actuators))
+  return retval[:-1]
@@ -1,10 +1,24 @@
-import numpy  # pylint: disable=E0401
-import random
+from .bitvector import BitVector
+from .pool import new_outcome, release_actions, release_outcomes
+from .rng import get_rng, random_bits
+from .utility import as_utility
 
 
 class Outcome:
+  __slots__ = (
+    'sensors', 
+    'probability', 
+    'probability_95ci', 
+    'estimated_absolute_utility', 
+    'estimated_weighted_utility'
+  )
+
   def __init__(self):
-    self.sensors = []
+    self.reset()
+
+
+  def reset(self):
+    self.sensors = BitVector()
 
     self.probability = None
     self.probability_95ci = None
@@ -12,19 +26,21 @@ class Outcome:
     self.estimated_absolute_utility = 0
     self.estimated_weighted_utility = 0
 
-    self.responses = []
-
 
   def probability_most_optimistic(self):
     return min(self.probability + self.probability_95ci, 1.0)
 
 
-  def fill_random(self, params):
+  def fill_random(self, params, rng=None):
     """Populate the sensors with a random vector.
     Arguments:
       params {OutcomeGeneratorParams} -- Config object with info about how to construct the vector.
+      rng {numpy.random.Generator} -- Where the randomness comes from. If not given,
+          a shared, unseeded generator.
     """
-    self.sensors = list(numpy.random.randint(2, size=params.sensor_vector_dimensionality))
+    if rng is None:
+      rng = get_rng()
+    self.sensors = random_bits(rng, 1, params.sensor_vector_dimensionality)[0]
 
 
 
@@ -33,7 +49,8 @@ class Outcome:
       action_generator=None,
       lookahead_cache=None,
       recursion_depth=0,
-      recursion_threshold=1):
+      recursion_threshold=1,
+      absolute_utility=None):
     """Compute the utility of this Outcome.
     Arguments:
       sensors_utility_metric {function} -- A function that takes a sensors vector and returns a scalar
@@ -45,8 +62,12 @@ class Outcome:
       recursion_depth {int} -- How deep the current recursion has gotten.
       recursion_threshold {float} -- Value between 0 and 1. Any outcomes with a utility below this level 
           will be attempted to be boosted by recursing.
+      absolute_utility {float} -- The utility of this outcome's own sensor state, if it's already
+          been computed. Saves calling sensors_utility_metric.
     """
-    if sensors_utility_metric:
+    if absolute_utility is not None:
+      self.estimated_absolute_utility = absolute_utility
+    elif sensors_utility_metric:
       self.estimated_absolute_utility = sensors_utility_metric(self.sensors)
     else:
       self.estimated_absolute_utility = 0
@@ -87,6 +108,9 @@ class Outcome:
           if lookahead_cache is not None:
             lookahead_cache.put(self.sensors, best_action.actuators, best_action.expected_utility, recursion_depth)
 
+        # Nobody else holds onto the subtree, so its nodes can be reused.
+        release_actions(action_generator.organism, recursed_actions)
+
 
 
   def estimate_likelihood(self, 
@@ -146,7 +170,7 @@ class Outcome:
 
 
 class OutcomeGeneratorParams:
-  def __init__(self, sensor_vector_dimensionality, num_generate, num_keep, prob_threshold, recursion_threshold):
+  def __init__(self, sensor_vector_dimensionality, num_generate, num_keep, prob_threshold, recursion_threshold, **kwargs):
     """
     Arguments:
       sensor_vector_dimensionality {float} -- Number of elements in an action vector.
@@ -156,12 +180,17 @@ class OutcomeGeneratorParams:
       prob_threshold {float} -- Value between 0 and 1. Below this probability value, outcomes aren't even considered.
       recursion_threshold {float} -- Value between 0 and 1. Above this utility value, outcome exploration won't recurse;
           it's considered a categorical win.
+      min_score_batch {int} -- Score at least this many outcomes at a time with the
+          utility metric's evaluate_many, and fewer one at a time. If not given, the
+          metric's own min_batch, if it has one. Otherwise they're never batched.
     """
     self.sensor_vector_dimensionality = sensor_vector_dimensionality
     self.num_generate = num_generate
     self.num_keep = num_keep
     self.prob_threshold = prob_threshold
     self.recursion_threshold = recursion_threshold
+
+    self.min_score_batch = kwargs.get('min_score_batch')
     
 
 
@@ -180,27 +209,68 @@ class OutcomeGenerator:
     """
     self.organism = organism
     self.params = params
-    self.sensors_utility_metric = sensors_utility_metric
+    self.sensors_utility_metric = as_utility(sensors_utility_metric)
+
+    # How many outcomes have had their utilities estimated. The organism resets
+    # this every turn, so it's a measure of how big the planning tree got.
+    self.num_expanded = 0
 
 
 
   def generate(self, sensors_prev, actuators, recursion_depth=0):
-    """Generates a population of plausible sensor state vectors.
+    """Generates a population of plausible sensor state vectors, and estimates
+    the utility of each of them.
     Returns:
     {list} A list of Outcome objects.
     """
-    #print('recursion_depth=', recursion_depth, ' Generating outcomes for ', sensors_prev, actuators)
+    population = self.propose(sensors_prev, actuators)
+
+    # Determine the utility of every member of the surviving population. Their own
+    # states get scored all at once; recursion has to happen one at a time.
+    utilities = self.score(population)
+    for c, u in zip(population, utilities):
+      self.expand(c, recursion_depth=recursion_depth, absolute_utility=u)
+
+    # NOTE: It might be more useful to explore *some* of the utilities of lower-probability
+    # outcomes. After all, a fairly low-probability outcome could have a very high utility,
+    # while all other higher-probability options could have low utility.
+
+    return population
+
+
+
+  def propose(self, sensors_prev, actuators):
+    """Generates a population of plausible sensor state vectors, with likelihoods
+    but without utilities.
+    Returns:
+    {list} A list of Outcome objects, most optimistically likely first.
+    """
+    #print('Generating outcomes for ', sensors_prev, actuators)
 
     population = []
     if self.organism is not None and self.organism.outcome_likelihood_estimator is not None:
       population += self.organism.outcome_likelihood_estimator.get_known_outcomes(sensors_prev, actuators)
   
   
-    for _ in range(self.params.num_generate):
-      outcome = Outcome()
-      outcome.fill_random(self.params)
+    # If we have a proposer, spend the candidate budget on plausible states rather
+    # than on uniformly random ones.
+    rng = get_rng(self.organism)
+    # With no budget, it's known outcomes only, and there's nothing to draw.
+    proposed_sensorses = []
+    if self.params.num_generate <= 0:
+      pass
+    elif self.organism is not None and self.organism.outcome_proposer is not None:
+      proposed_sensorses = self.organism.outcome_proposer.propose(
+        sensors_prev, actuators, self.params.num_generate)
+    else:
+      proposed_sensorses = random_bits(rng, self.params.num_generate, self.params.sensor_vector_dimensionality)
+
+    for sensors in proposed_sensorses:
+      outcome = new_outcome(self.organism)
+      outcome.sensors = sensors
 
       if outcome in population:
+        release_outcomes(self.organism, [outcome])
         continue
   
       outcome.estimate_likelihood(
@@ -211,31 +281,57 @@ class OutcomeGenerator:
 
       population.append(outcome)
 
-    random.shuffle(population)
+    rng.shuffle(population)
     population.sort(key=lambda c: -c.probability_most_optimistic() )
+    culled = [c for c in population if c.probability_most_optimistic() <= self.params.prob_threshold]
     population = [c for c in population if c.probability_most_optimistic() > self.params.prob_threshold]
+    culled += population[self.params.num_keep:]
     population = population[:self.params.num_keep]
+    release_outcomes(self.organism, culled)
 
-    #print(population)
+    return population
 
-    # Determine the utility of every member of the surviving population.
-    for c in population:
-      c.estimate_utility(
-        sensors_utility_metric=self.sensors_utility_metric,
-        action_generator=self.organism.action_generator,
-        recursion_depth=recursion_depth,
-        recursion_threshold=self.params.recursion_threshold,
-        lookahead_cache = self.organism.lookahead_cache
-      )
-      # Optimism! 
-      # Bias the utility estimate towards the top of the 95% confidence interval.
-      c.estimated_weighted_utility = c.estimated_absolute_utility * c.probability_most_optimistic()
 
-    # NOTE: It might be more useful to explore *some* of the utilities of lower-probability
-    # outcomes. After all, a fairly low-probability outcome could have a very high utility,
-    # while all other higher-probability options could have low utility.
 
-    return population
+  def score(self, outcomes):
+    """Computes the utility of each outcome's own sensor state, without recursing.
+    Arguments:
+      outcomes {list(Outcome)} -- Outcomes to score.
+    Returns:
+      {list(float)} -- One utility per outcome.
+    """
+    metric = self.sensors_utility_metric
+    if metric is None:
+      return [0] * len(outcomes)
+    min_batch = self.params.min_score_batch
+    if min_batch is None:
+      min_batch = getattr(metric, 'min_batch', None)
+    if min_batch is None or len(outcomes) < min_batch:
+      return [metric(c.sensors) for c in outcomes]
+    return metric.evaluate_many([c.sensors for c in outcomes]).tolist()
+
+
+
+  def expand(self, outcome, recursion_depth=0, absolute_utility=None):
+    """Estimates the utility of a proposed outcome, recursing into the actions
+    that could follow it if need be.
+    Arguments:
+      outcome {Outcome} -- An outcome produced by propose().
+      recursion_depth {int} -- How many more steps forward we may look.
+      absolute_utility {float} -- The outcome's score, if score() already computed it.
+    """
+    self.num_expanded += 1
+    outcome.estimate_utility(
+      sensors_utility_metric=self.sensors_utility_metric,
+      action_generator=self.organism.action_generator,
+      recursion_depth=recursion_depth,
+      recursion_threshold=self.params.recursion_threshold,
+      lookahead_cache = self.organism.lookahead_cache,
+      absolute_utility=absolute_utility
+    )
+    # Optimism! 
+    # Bias the utility estimate towards the top of the 95% confidence interval.
+    outcome.estimated_weighted_utility = outcome.estimated_absolute_utility * outcome.probability_most_optimistic()
 
 
 
@@ -0,0 +1,103 @@
+
+class NodePool:
+  """A free-list of Action and Outcome objects, reused from turn to turn.
+
+  A deep lookahead builds and throws away a huge number of planning tree nodes on
+  every turn. Rather than make the allocator and garbage collector deal with all of
+  them, planner code releases nodes it's done with back to the pool, and takes
+  nodes from the pool instead of constructing new ones.
+
+  Once a node is released, nothing may hold onto it; it'll get handed out again
+  with different contents.
+  """
+
+  def __init__(self, max_free=100000):
+    """
+    Arguments:
+      max_free {int} -- Don't keep more than this many of each kind of node lying around.
+    """
+    self.max_free = max_free
+    self.free_actions = []
+    self.free_outcomes = []
+
+
+  def action(self, actuators=None):
+    """Get a fresh Action.
+    Arguments:
+      actuators {BitVector} -- The actuator vector to give it.
+    """
+    if not self.free_actions:
+      from .action import Action
+      return Action(actuators)
+    a = self.free_actions.pop()
+    a.reset(actuators)
+    return a
+
+
+  def outcome(self):
+    """Get a fresh Outcome.
+    """
+    if not self.free_outcomes:
+      from .outcome import Outcome
+      return Outcome()
+    c = self.free_outcomes.pop()
+    c.reset()
+    return c
+
+
+  def release_actions(self, actions):
+    """Return actions, and all of the outcomes hanging off of them, to the pool.
+    Arguments:
+      actions {list(Action)} -- Actions that are no longer referenced by anything.
+    """
+    for a in actions:
+      self.release_outcomes(a.outcomes)
+      a.outcomes = []
+      if len(self.free_actions) < self.max_free:
+        self.free_actions.append(a)
+
+
+  def release_outcomes(self, outcomes):
+    """Return outcomes to the pool.
+    Arguments:
+      outcomes {list(Outcome)} -- Outcomes that are no longer referenced by anything.
+    """
+    room = self.max_free - len(self.free_outcomes)
+    if room > 0:
+      self.free_outcomes.extend(outcomes[:room])
+
+
+
+def new_action(organism, actuators=None):
+  """Get an Action, from the organism's node pool if it has one.
+  """
+  pool = organism.node_pool if organism is not None else None
+  if pool is None:
+    from .action import Action
+    return Action(actuators)
+  return pool.action(actuators)
+
+
+def new_outcome(organism):
+  """Get an Outcome, from the organism's node pool if it has one.
+  """
+  pool = organism.node_pool if organism is not None else None
+  if pool is None:
+    from .outcome import Outcome
+    return Outcome()
+  return pool.outcome()
+
+
+def release_actions(organism, actions):
+  """Return actions to the organism's node pool, if it has one.
+  """
+  if organism is not None and organism.node_pool is not None:
+    organism.node_pool.release_actions(actions)
+
+
+def release_outcomes(organism, outcomes):
+  """Return outcomes to the organism's node pool, if it has one.
+  """
+  if organism is not None and organism.node_pool is not None:
+    organism.node_pool.release_outcomes(outcomes)
+
@@ -0,0 +1,236 @@
+
+import numpy  # pylint: disable=E0401
+
+from .experience import ActuatorsRecord, SensorsRecord
+from .rng import bitvectors_from_rows, get_rng
+
+
+class OutcomeProposerParams:
+  """Configuration for an outcome proposer.
+  """
+  def __init__(self, n_sensors, n_actuators, **kwargs):
+    """
+    Arguments:
+      n_sensors {int} -- Number of elements in a sensor vector.
+      n_actuators {int} -- Number of elements in an actuator vector.
+      prior_flip_rate {float} -- Before we know anything about an action, how likely we
+          assume each sensor is to change state after it's performed.
+      action_pseudocount {float} -- How many observations' worth of weight the prior flip
+          rate gets against the observed flip rates of an action.
+      situation_pseudocount {float} -- How many observations' worth of weight the
+          action-wide flip model gets against the exact (situation, action) frequencies.
+    """
+    self.n_sensors = n_sensors
+    self.n_actuators = n_actuators
+
+    self.prior_flip_rate = kwargs.get('prior_flip_rate')
+    if self.prior_flip_rate is None:
+      self.prior_flip_rate = 0.1
+
+    self.action_pseudocount = kwargs.get('action_pseudocount')
+    if self.action_pseudocount is None:
+      self.action_pseudocount = 2
+
+    self.situation_pseudocount = kwargs.get('situation_pseudocount')
+    if self.situation_pseudocount is None:
+      self.situation_pseudocount = 1
+
+
+
+class OutcomeProposer:
+  """Proposes plausible next sensor states, given a situation and an action.
+
+  Uniformly random sensor vectors are almost always impossible states, so sampling
+  them is mostly wasted work. Instead, we build a per-bit Bernoulli distribution
+  over the next state and sample from that. The distribution blends two things:
+    * The per-bit frequencies of the outcomes actually seen after this exact action
+      in this exact situation, if there are any.
+    * A per-action "flip model": how often each sensor bit changed state after this
+      action, across every situation it was ever tried in. This lets us make
+      reasonable guesses about situations we've never been in.
+  """
+
+  def __init__(self, organism, params):
+    """Create the proposer.
+    Arguments:
+      params {OutcomeProposerParams} -- Configuration info.
+    """
+    self.organism = organism
+    self.params = params
+
+    # Maps action keys to [total count, numpy array of per-bit flip counts].
+    self.flip_counts = {}
+    # What each (situation, action) pair has put into flip_counts, so that it can be
+    # taken back out again when the repo's counts for the pair change.
+    self.pair_counts = {}
+    self.fitted_repo = None
+    # The repo to model. If None, whatever the organism's repo is at the time.
+    self.repo = None
+
+
+
+  def fit(self, experience_repo):
+    """Rebuild the flip model from scratch out of everything in the experience repo.
+    Arguments:
+      experience_repo {ExperienceRepo} -- Repository of all experiences the organism has ever had.
+    """
+    self.flip_counts = {}
+    self.pair_counts = {}
+    self.fitted_repo = experience_repo
+    if experience_repo is None:
+      return
+
+    pairs = {}
+    for sensors_prev, actuators, sensors_next, count in experience_repo.iter_experiences():
+      key = (SensorsRecord.compute_key(sensors_prev), ActuatorsRecord.compute_key(actuators))
+      pair = pairs.get(key)
+      if pair is None:
+        pair = pairs[key] = [0, numpy.zeros(len(sensors_prev))]
+      pair[0] += count
+      pair[1] += count * (numpy.array(sensors_prev) != numpy.array(sensors_next))
+
+    for (situation_key, action_key), (count, flips) in pairs.items():
+      self.__set_pair(situation_key, action_key, count, flips)
+
+
+
+  def observe(self, sensors_prev, actuators, sensors_observed, magnitude=1):
+    """Update the flip model with a single new experience. Call this whenever
+    the same experience gets added to the experience repo, after it's been added.
+
+    The flip model is weighted by the repo's own counts, salience boosts and all, the
+    same as fit() weights it. So rather than adding in the magnitude, this rereads the
+    (situation, action) pair's counts from the repo.
+    Arguments:
+      sensors_prev {list} -- Previous sensor state.
+      actuators {list} -- The action taken.
+      sensors_observed {list} -- The subsequent state of the world observed.
+    """
+    if self.__needs_fit():
+      # Fitting reads the repo, which already contains this experience.
+      self.fit(self.__repo())
+      return
+
+    repo = self.fitted_repo
+    situation_key = SensorsRecord.compute_key(sensors_prev)
+    action_key = ActuatorsRecord.compute_key(actuators)
+    s = numpy.array(situation_key)
+    count = repo.get_action_count(situation_key, action_key)
+    flips = numpy.zeros(len(s))
+    for sensors_next, prob, _ in repo.lookup_outcomes(situation_key, action_key):
+      flips += prob * count * (s != numpy.array(sensors_next))
+    self.__set_pair(situation_key, action_key, count, flips)
+
+
+
+  def bit_probabilities(self, sensors_prev, actuators):
+    """Compute the probability of each sensor being on after the action is performed.
+    Arguments:
+      sensors_prev {list} -- The situation in which the action is performed.
+      actuators {list} -- The action.
+    Returns:
+      {numpy.ndarray} -- One probability per sensor.
+    """
+    if self.__needs_fit():
+      self.fit(self.__repo())
+
+    s = numpy.array(sensors_prev, dtype=float)
+
+    n_a = 0
+    flips_a = 0
+    fc = self.flip_counts.get(ActuatorsRecord.compute_key(actuators))
+    if fc is not None:
+      n_a, flips_a = fc
+    k_a = self.params.action_pseudocount
+    flip_rate = (flips_a + k_a * self.params.prior_flip_rate) / (n_a + k_a)
+    p_flip_model = s * (1 - flip_rate) + (1 - s) * flip_rate
+
+    ones_sa, n_sa = self.__situation_bit_counts(sensors_prev, actuators)
+    if not n_sa:
+      return p_flip_model
+
+    k_sa = self.params.situation_pseudocount
+    return (ones_sa + k_sa * p_flip_model) / (n_sa + k_sa)
+
+
+
+  def propose(self, sensors_prev, actuators, num_generate):
+    """Sample likely next sensor states.
+    Arguments:
+      sensors_prev {list} -- The situation in which the action is performed.
+      actuators {list} -- The action.
+      num_generate {int} -- How many samples to draw, including repeats.
+    Returns:
+      {list(BitVector)} -- Distinct sensor vectors, in the order they were first drawn.
+    """
+    if num_generate <= 0:
+      return []
+    p = self.bit_probabilities(sensors_prev, actuators)
+    draws = get_rng(self.organism).random((num_generate, len(p))) < p
+
+    retval = []
+    seen = set()
+    for sensors in bitvectors_from_rows(draws):
+      if sensors in seen:
+        continue
+      seen.add(sensors)
+      retval.append(sensors)
+    return retval
+
+
+
+  def frozen_copy(self, repo):
+    """A copy of the model as it is now, which won't change when this one does.
+    Arguments:
+      repo -- What the copy reads exact (situation, action) counts from. Should be a
+          snapshot of this one's repo, taken at the same time.
+    Returns:
+      {OutcomeProposer}
+    """
+    retval = OutcomeProposer(self.organism, self.params)
+    # The flip arrays are replaced rather than modified, so they can be shared.
+    retval.flip_counts = {key: list(fc) for key, fc in self.flip_counts.items()}
+    retval.pair_counts = dict(self.pair_counts)
+    retval.fitted_repo = repo
+    retval.repo = repo
+    return retval
+
+
+  def __repo(self):
+    if self.repo is not None:
+      return self.repo
+    return self.organism.experience_repo if self.organism is not None else None
+
+
+  def __needs_fit(self):
+    return self.organism is not None and self.fitted_repo is not self.__repo()
+
+
+  def __set_pair(self, situation_key, action_key, count, flips):
+    fc = self.flip_counts.get(action_key)
+    if fc is None:
+      fc = [0, numpy.zeros(len(flips))]
+      self.flip_counts[action_key] = fc
+    old = self.pair_counts.get((situation_key, action_key))
+    if old is not None:
+      fc[0] -= old[0]
+      fc[1] = fc[1] - old[1]
+    fc[0] += count
+    fc[1] = fc[1] + flips
+    self.pair_counts[(situation_key, action_key)] = (count, flips)
+
+
+  def __situation_bit_counts(self, sensors_prev, actuators):
+    repo = self.__repo()
+    if repo is None:
+      return None, 0
+
+    n_sa = repo.get_action_count(sensors_prev, actuators)
+    if not n_sa:
+      return None, 0
+
+    ones_sa = 0
+    for sensors_next, prob, _ in repo.lookup_outcomes(sensors_prev, actuators):
+      ones_sa = ones_sa + prob * n_sa * numpy.array(sensors_next)
+    return ones_sa, n_sa
+
@@ -0,0 +1,253 @@
+
+import threading
+
+from .bitvector import BitVector
+from .experience import ExperienceRepo
+
+
+# Prefix for the arrays of the register-conditioned repo, in to_arrays.
+_REGISTER_REPO_PREFIX = 'register_repo_'
+
+
+class RegisterFactoredRepo:
+  """An experience repo that learns what it can about the game without the organism's
+  register bits getting in the way, and backs off to that when it has to.
+
+  The organism appends its registers to both its sensors and its actuators, and the
+  register half of an action simply becomes the register half of the next situation.
+  A plain ExperienceRepo treats them as more bits of the world, so every register
+  doubles the situations it has to learn about, and what it learns about the game with
+  the registers one way tells it nothing about them any other way.
+
+  Here, every experience goes into two repos. The register repo keeps it whole, so its
+  statistics are conditioned on the registers, which is what lets them carry memory:
+  the same game situation can turn out differently depending on how the organism got
+  there, and the registers are how it tells. The game repo keeps only the game-facing
+  bits, pooled across every register state. Answers blend the two, with the pooled
+  statistics weighted as backoff_weight observations' worth, so that they fill in
+  while a register state has seen little, and fade out as it sees more. Outcomes come
+  back with their registers filled in from the action, since that's the only thing
+  they can be.
+  """
+
+  def __init__(self, num_registers, game_repo=None, register_repo=None, backoff_weight=1):
+    """
+    Arguments:
+      num_registers {int} -- How many bits at the end of every sensor and actuator
+          vector are registers.
+      game_repo {ExperienceRepo} -- Where to keep the pooled game-facing experiences. A
+          new one if not given.
+      register_repo {ExperienceRepo} -- Where to keep whole experiences, registers and
+          all. A new one if not given.
+      backoff_weight {float} -- How many observations' worth the pooled statistics
+          count for, against the register-conditioned ones.
+    """
+    if num_registers < 1:
+      raise ValueError('num_registers', 'Must be at least 1.')
+    if backoff_weight < 0:
+      raise ValueError('backoff_weight', 'Must not be negative.')
+    self.num_registers = num_registers
+    self.game_repo = game_repo if game_repo is not None else ExperienceRepo()
+    self.register_repo = register_repo if register_repo is not None else ExperienceRepo()
+    self.backoff_weight = backoff_weight
+
+    self.version = 0
+    self.__write_lock = threading.Lock()
+
+
+  def __getstate__(self):
+    state = dict(self.__dict__)
+    state.pop('_RegisterFactoredRepo__write_lock', None)
+    return state
+
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.__write_lock = threading.Lock()
+
+
+  def __len__(self):
+    return len(self.register_repo)
+
+
+  @property
+  def concurrent(self):
+    return self.register_repo.concurrent
+
+  @concurrent.setter
+  def concurrent(self, value):
+    self.game_repo.concurrent = value
+    self.register_repo.concurrent = value
+
+
+  @property
+  def read_only(self):
+    return self.register_repo.read_only
+
+
+  def snapshot(self):
+    """See ExperienceRepo.snapshot.
+    """
+    with self.__write_lock:
+      retval = RegisterFactoredRepo(
+        self.num_registers,
+        self.game_repo.snapshot(),
+        self.register_repo.snapshot(),
+        backoff_weight=self.backoff_weight)
+      retval.version = self.version
+    return retval
+
+
+  def split(self, v):
+    """Splits a sensor or actuator vector into its game-facing bits and its registers.
+    """
+    v = BitVector(v)
+    n = len(v) - self.num_registers
+    return v[:n], v[n:]
+
+
+
+  def add(self, sensors_prev, actuators, sensors_observed, magnitude=1):
+    """See ExperienceRepo.add.
+    """
+    situation, _ = self.split(sensors_prev)
+    game_actuators, _ = self.split(actuators)
+    outcome, _ = self.split(sensors_observed)
+
+    # Both at once, so that a snapshot never has one without the other.
+    with self.__write_lock:
+      self.game_repo.add(situation, game_actuators, outcome, magnitude=magnitude)
+      self.register_repo.add(sensors_prev, actuators, sensors_observed, magnitude=magnitude)
+      self.version += 1
+
+
+  def __blend(self, sensors, actuators):
+    # Outcome to (probability, effective count), blending the register repo's counts
+    # with backoff_weight observations' worth of the pooled ones.
+    situation, _ = self.split(sensors)
+    game_actuators, next_registers = self.split(actuators)
+
+    n_exact = self.register_repo.get_action_count(sensors, actuators)
+    weight = self.backoff_weight
+    pooled = self.game_repo.lookup_outcomes(situation, game_actuators) if weight else []
+    if not pooled:
+      weight = 0
+    n = n_exact + weight
+    if not n:
+      return {}, 0
+
+    blend = {}
+    for outcome, p, _ in self.register_repo.lookup_outcomes(sensors, actuators):
+      blend[outcome] = p * n_exact / n
+    for outcome, p, _ in pooled:
+      outcome = outcome + next_registers
+      blend[outcome] = blend.get(outcome, 0) + p * weight / n
+    return blend, n
+
+
+  def get_outcome_probability(self, sensors_prev, actuators, sensors_next):
+    """See ExperienceRepo.get_outcome_probability.
+    """
+    _, next_registers = self.split(actuators)
+    _, outcome_registers = self.split(sensors_next)
+    if outcome_registers != next_registers:
+      # The registers always end up the way the action set them. Anything else is
+      # certainly impossible.
+      return (0, 0)
+
+    blend, n = self.__blend(sensors_prev, actuators)
+    p = blend.get(BitVector(sensors_next))
+    if p is None:
+      return (0, 1)
+    return p, ExperienceRepo.confidence_interval(p, n)
+
+
+  def lookup_outcomes(self, sensors, actuators, prob_threshold=0):
+    """See ExperienceRepo.lookup_outcomes.
+    """
+    blend, n = self.__blend(sensors, actuators)
+    retval = [
+      (outcome, p, ExperienceRepo.confidence_interval(p, n))
+      for outcome, p in blend.items()
+      if p >= prob_threshold
+    ]
+    retval.sort(key=lambda x: -x[1])
+    return retval
+
+
+  def lookup_actions(self, sensors):
+    """See ExperienceRepo.lookup_actions. Actions tried in this exact situation,
+    registers and all, come first. After them come the game actions tried in this game
+    situation under any other register state, with the registers left as they are.
+    """
+    situation, registers = self.split(sensors)
+    retval = list(self.register_repo.lookup_actions(sensors))
+    known = set(retval)
+    for game_actuators in self.game_repo.lookup_actions(situation):
+      actuators = game_actuators + registers
+      if actuators not in known:
+        known.add(actuators)
+        retval.append(actuators)
+    return retval
+
+
+  def get_action_count(self, sensors, actuators):
+    """See ExperienceRepo.get_action_count. This is the effective count behind
+    lookup_outcomes: the times it was tried in this register state, plus backoff_weight
+    if it's been tried in this game situation at all.
+    """
+    _, n = self.__blend(sensors, actuators)
+    return n
+
+
+  def nearest_situations(self, sensors, k=1, max_distance=None):
+    """See ExperienceRepo.nearest_situations. Neighbours are found among the game
+    situations, and reported with this situation's registers.
+    """
+    situation, registers = self.split(sensors)
+    return [(d, s + registers) for d, s in self.game_repo.nearest_situations(situation, k=k, max_distance=max_distance)]
+
+
+  def iter_experiences(self):
+    """See ExperienceRepo.iter_experiences. Yields the experiences as they happened,
+    registers and all.
+    """
+    return self.register_repo.iter_experiences()
+
+
+
+  def to_arrays(self):
+    """See ExperienceRepo.to_arrays. The game repo's arrays go in as they are, and the
+    register repo's go in alongside them, with their names prefixed.
+    """
+    import numpy  # pylint: disable=E0401
+
+    retval = self.game_repo.to_arrays()
+    for name, array in self.register_repo.to_arrays().items():
+      retval[_REGISTER_REPO_PREFIX + name] = array
+    retval['register_info'] = numpy.array([self.num_registers, self.version], dtype=numpy.int64)
+    retval['register_backoff_weight'] = numpy.array([self.backoff_weight], dtype=float)
+    return retval
+
+
+  @staticmethod
+  def from_arrays(arrays, lazy=False):
+    """Rebuilds a repo from the arrays made by to_arrays.
+    Arguments:
+      lazy {bool} -- Passed along to ExperienceRepo.from_arrays, for both repos.
+    """
+    game_repo = ExperienceRepo.from_arrays(arrays, lazy=lazy)
+    register_arrays = {
+      name[len(_REGISTER_REPO_PREFIX):]: array
+      for name, array in arrays.items()
+      if name.startswith(_REGISTER_REPO_PREFIX)
+    }
+    if not register_arrays or 'register_backoff_weight' not in arrays:
+      raise ValueError('arrays', 'Not made by RegisterFactoredRepo.to_arrays; the register repo is missing.')
+    register_repo = ExperienceRepo.from_arrays(register_arrays, lazy=lazy)
+
+    num_registers, version = [int(x) for x in arrays['register_info']]
+    backoff_weight = float(arrays['register_backoff_weight'][0])
+    retval = RegisterFactoredRepo(num_registers, game_repo, register_repo, backoff_weight=backoff_weight)
+    retval.version = version
+    return retval
@@ -0,0 +1,318 @@
+
+import numpy  # pylint: disable=E0401
+
+from .bitvector import BitVector
+from .experience import ActuatorsRecord, SensorsRecord
+from .neighbors import HammingIndex
+
+
+# The arrays that make up an experience repo. The three levels of records are laid out
+# like compressed sparse rows: situation i's actions are rows situation_action_start[i]
+# to situation_action_start[i+1] of the action arrays, and likewise for each action's
+# outcomes. Vectors are bit-packed, one row each.
+REPO_ARRAYS = (
+  'situation_bits', 'situation_count', 'situation_action_start',
+  'action_bits', 'action_count', 'action_outcome_start',
+  'outcome_bits', 'outcome_count',
+  'repo_info',
+)
+
+# Optional arrays for looking situations up: their rows in order of their bits, and
+# their bits in that order. Without them, ArraySituations sorts on first lookup.
+INDEX_ARRAYS = ('situation_order', 'situation_sorted_bits')
+
+
+
+def pack_bitvectors(vectors, length):
+  """Bit-packs vectors of the same length into a 2-D uint8 array, one row each.
+  """
+  nbytes = (length + 7) // 8
+  pad = -length % 8
+  buf = bytearray()
+  count = 0
+  for v in vectors:
+    count += 1
+    if len(v) != length:
+      raise ValueError('vectors', 'Expected vectors of length {}, got one of length {}.'.format(length, len(v)))
+    buf += (BitVector(v).to_int() << pad).to_bytes(nbytes, 'big')
+  return numpy.frombuffer(bytes(buf), dtype=numpy.uint8).reshape(count, nbytes)
+
+
+def unpack_bitvector(row, length):
+  """The BitVector in one row of an array made by pack_bitvectors.
+  """
+  return BitVector.from_int(int.from_bytes(row.tobytes(), 'big') >> (-length % 8), length)
+
+
+def unpack_bitvectors(bits, length):
+  """All the BitVectors in an array made by pack_bitvectors.
+  """
+  nbytes = bits.shape[1]
+  if not nbytes:
+    return [BitVector.from_int(0, length)] * len(bits)
+  pad = -length % 8
+  buf = numpy.ascontiguousarray(bits).tobytes()
+  return [
+    BitVector.from_int(int.from_bytes(buf[i:i + nbytes], 'big') >> pad, length)
+    for i in range(0, len(buf), nbytes)
+  ]
+
+
+
+def repo_to_arrays(repo):
+  """Flattens an experience repo into contiguous arrays. ExperienceRepo.from_arrays
+  turns them back into a repo.
+  Arguments:
+    repo {ExperienceRepo} -- The repo.
+  Returns:
+    {dict} -- Array name to array; see REPO_ARRAYS.
+  """
+  situation_records = list(repo.situations.values())
+  sensor_length = len(situation_records[0].sensors) if situation_records else 0
+  actuator_length = 0
+
+  situation_count = []
+  situation_action_start = [0]
+  action_records = []
+  action_count = []
+  action_outcome_start = [0]
+  outcome_records = []
+  outcome_count = []
+  for situation_record in situation_records:
+    situation_count.append(situation_record.count)
+    for action_record in situation_record.responses.values():
+      actuator_length = len(action_record.actuators)
+      action_records.append(action_record.actuators)
+      action_count.append(action_record.count)
+      for outcome_record in action_record.outcomes.values():
+        outcome_records.append(outcome_record.sensors)
+        outcome_count.append(outcome_record.count)
+      action_outcome_start.append(len(outcome_records))
+    situation_action_start.append(len(action_records))
+
+  return {
+    'situation_bits': pack_bitvectors([r.sensors for r in situation_records], sensor_length),
+    'situation_count': numpy.array(situation_count, dtype=numpy.int64),
+    'situation_action_start': numpy.array(situation_action_start, dtype=numpy.int64),
+    'action_bits': pack_bitvectors(action_records, actuator_length),
+    'action_count': numpy.array(action_count, dtype=numpy.int64),
+    'action_outcome_start': numpy.array(action_outcome_start, dtype=numpy.int64),
+    'outcome_bits': pack_bitvectors(outcome_records, sensor_length),
+    'outcome_count': numpy.array(outcome_count, dtype=numpy.int64),
+    # Vector lengths, total record count, version.
+    'repo_info': numpy.array([sensor_length, actuator_length, len(repo), repo.version], dtype=numpy.int64),
+  }
+
+
+
+def situation_index_arrays(arrays):
+  """Computes the optional lookup arrays for a repo's arrays.
+  Returns:
+    {dict} -- Array name to array; see INDEX_ARRAYS.
+  """
+  bits = numpy.ascontiguousarray(arrays['situation_bits'])
+  if not bits.size:
+    return {'situation_order': numpy.arange(len(bits)), 'situation_sorted_bits': bits}
+  order = numpy.argsort(_as_void(bits), kind='stable')
+  return {'situation_order': order, 'situation_sorted_bits': bits[order]}
+
+
+def _as_void(bits):
+  # One opaque, comparable item per row.
+  bits = numpy.ascontiguousarray(bits)
+  return bits.view(numpy.dtype((numpy.void, bits.shape[1]))).ravel()
+
+
+
+class ArraySituations:
+  """The situations of an experience repo, backed by the arrays made by repo_to_arrays.
+
+  Behaves like the dict of situation records that ExperienceRepo normally keeps.
+  Records are built from the arrays the first time each one is looked up, and
+  anything stored into the mapping takes precedence over the arrays from then on.
+  """
+
+  def __init__(self, arrays):
+    self.arrays = arrays
+    self.sensor_length, self.actuator_length = (int(x) for x in arrays['repo_info'][:2])
+    self.records = {}
+
+    self.__num_base = len(arrays['situation_count'])
+    self.__sorted_keys = None
+    self.__sorted_rows = None
+
+
+  def __reduce__(self):
+    # Pickle as a plain dict.
+    return (dict, (list(self.materialize().items()),))
+
+
+  def materialize(self):
+    """Builds every record.
+    Returns:
+      {dict} -- Situation key to record, just like ExperienceRepo normally keeps.
+    """
+    a = self.arrays
+    situation_keys = unpack_bitvectors(a['situation_bits'], self.sensor_length)
+    action_keys = unpack_bitvectors(a['action_bits'], self.actuator_length)
+    outcome_keys = unpack_bitvectors(a['outcome_bits'], self.sensor_length)
+    situation_count = a['situation_count'].tolist()
+    situation_action_start = a['situation_action_start'].tolist()
+    action_count = a['action_count'].tolist()
+    action_outcome_start = a['action_outcome_start'].tolist()
+    outcome_count = a['outcome_count'].tolist()
+
+    retval = {}
+    for i, situation_key in enumerate(situation_keys):
+      situation_record = SensorsRecord(situation_key)
+      situation_record.count = situation_count[i]
+      for j in range(situation_action_start[i], situation_action_start[i + 1]):
+        action_record = ActuatorsRecord(action_keys[j])
+        action_record.count = action_count[j]
+        for k in range(action_outcome_start[j], action_outcome_start[j + 1]):
+          outcome_record = SensorsRecord(outcome_keys[k])
+          outcome_record.count = outcome_count[k]
+          action_record.outcomes[outcome_keys[k]] = outcome_record
+        situation_record.responses[action_keys[j]] = action_record
+      retval[situation_key] = situation_record
+    retval.update(self.records)
+    return retval
+
+
+  def base_keys(self):
+    """Every situation in the arrays, in order.
+    """
+    return unpack_bitvectors(self.arrays['situation_bits'], self.sensor_length)
+
+
+  def __find(self, key):
+    if not self.__num_base or len(key) != self.sensor_length:
+      return None
+    if self.__sorted_keys is None:
+      index = self.arrays if 'situation_order' in self.arrays else situation_index_arrays(self.arrays)
+      self.__sorted_rows = index['situation_order']
+      self.__sorted_keys = _as_void(index['situation_sorted_bits'])
+    nbytes = self.arrays['situation_bits'].shape[1]
+    packed = (key.to_int() << (-self.sensor_length % 8)).to_bytes(nbytes, 'big')
+    probe = numpy.frombuffer(packed, dtype=self.__sorted_keys.dtype)[0]
+    i = numpy.searchsorted(self.__sorted_keys, probe)
+    if i < len(self.__sorted_keys) and self.__sorted_keys[i] == probe:
+      return int(self.__sorted_rows[i])
+    return None
+
+
+  def __build(self, row):
+    a = self.arrays
+    situation_record = SensorsRecord(unpack_bitvector(a['situation_bits'][row], self.sensor_length))
+    situation_record.count = int(a['situation_count'][row])
+    action_start, action_end = a['situation_action_start'][row:row + 2]
+    for j in range(action_start, action_end):
+      action_record = ActuatorsRecord(unpack_bitvector(a['action_bits'][j], self.actuator_length))
+      action_record.count = int(a['action_count'][j])
+      outcome_start, outcome_end = a['action_outcome_start'][j:j + 2]
+      for k in range(outcome_start, outcome_end):
+        outcome_record = SensorsRecord(unpack_bitvector(a['outcome_bits'][k], self.sensor_length))
+        outcome_record.count = int(a['outcome_count'][k])
+        action_record.outcomes[outcome_record.sensors] = outcome_record
+      situation_record.responses[action_record.actuators] = action_record
+    return situation_record
+
+
+  def get(self, key, default=None):
+    key = SensorsRecord.compute_key(key)
+    record = self.records.get(key)
+    if record is not None:
+      return record
+    row = self.__find(key)
+    if row is None:
+      return default
+    record = self.__build(row)
+    # Another thread may have beaten us to it; either record is as good as the other.
+    return self.records.setdefault(key, record)
+
+
+  def __getitem__(self, key):
+    record = self.get(key)
+    if record is None:
+      raise KeyError(key)
+    return record
+
+
+  def __setitem__(self, key, record):
+    self.records[SensorsRecord.compute_key(key)] = record
+
+
+  def __contains__(self, key):
+    return self.get(key) is not None
+
+
+  def keys(self):
+    keys = self.base_keys()
+    seen = set(keys)
+    keys += [k for k in list(self.records) if k not in seen]
+    return keys
+
+
+  def __iter__(self):
+    return iter(self.keys())
+
+
+  def __len__(self):
+    return self.__num_base + sum(1 for k in list(self.records) if self.__find(k) is None)
+
+
+  def values(self):
+    return [self[k] for k in self.keys()]
+
+
+  def items(self):
+    return [(k, self[k]) for k in self.keys()]
+
+
+
+class LazyHammingIndex:
+  """A HammingIndex that isn't built until it's first searched.
+  """
+
+  def __init__(self, initial_keys):
+    """
+    Arguments:
+      initial_keys {function} -- Returns the keys to build the index out of.
+    """
+    self.__initial_keys = initial_keys
+    self.__pending = []
+    self.__index = None
+
+
+  def add(self, vector, item=None):
+    if self.__index is None:
+      self.__pending.append((vector, item))
+    else:
+      self.__index.add(vector, item)
+
+
+  def nearest(self, vector, k=1, max_distance=None, accept=None):
+    return self.__built().nearest(vector, k=k, max_distance=max_distance, accept=accept)
+
+
+  def __built(self):
+    if self.__index is None:
+      index = HammingIndex()
+      for key in self.__initial_keys():
+        index.add(key)
+      for vector, item in self.__pending:
+        index.add(vector, item)
+      self.__index = index
+      self.__pending = []
+    return self.__index
+
+
+  def __reduce__(self):
+    # Pickle as the real thing.
+    index = self.__built()
+    return (_identity, (index,))
+
+
+
+def _identity(x):
+  return x
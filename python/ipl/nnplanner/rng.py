@@ -0,0 +1,75 @@
+
+import numpy  # pylint: disable=E0401
+
+from .bitvector import BitVector
+
+
+# Used by anything that isn't attached to an organism with its own generator.
+_shared_rng = numpy.random.default_rng()
+
+
+def get_rng(organism=None):
+  """The random number generator that planning on behalf of an organism should draw from.
+  Arguments:
+    organism {Organism} -- The organism, or None.
+  Returns:
+    {numpy.random.Generator} -- The organism's own generator if it has one, otherwise
+        a shared, unseeded one.
+  """
+  rng = getattr(organism, 'rng', None)
+  return rng if rng is not None else _shared_rng
+
+
+
+def bitvectors_from_rows(rows):
+  """Converts a 2-D array of 0s and 1s to bit vectors, one per row.
+  Arguments:
+    rows {ndarray} -- Anything nonzero counts as a 1.
+  Returns:
+    {list(BitVector)}
+  """
+  rows = numpy.asarray(rows)
+  if rows.ndim != 2:
+    raise ValueError('rows', 'Must be a 2-D array.')
+  n, length = rows.shape
+  packed = numpy.packbits(rows != 0, axis=1)
+  pad = -length % 8
+  return [BitVector.from_int(int.from_bytes(row.tobytes(), 'big') >> pad, length) for row in packed]
+
+
+
+def random_bits(rng, n, length):
+  """Draws uniformly random bit vectors, all at once.
+  Arguments:
+    rng {numpy.random.Generator} -- Where the randomness comes from.
+    n {int} -- How many vectors.
+    length {int} -- Number of elements per vector.
+  Returns:
+    {list(BitVector)}
+  """
+  if n <= 0:
+    return []
+  return bitvectors_from_rows(rng.integers(2, size=(n, length), dtype=numpy.uint8))
+
+
+
+def random_sparse_bits(rng, n, length, activity_mean, activity_stdev):
+  """Draws bit vectors with a normally distributed number of 1s, all at once. Each
+  vector gets its number of active elements from the normal distribution (clipped to
+  [0, length]), and then that many distinct positions, chosen uniformly.
+  Arguments:
+    rng {numpy.random.Generator} -- Where the randomness comes from.
+    n {int} -- How many vectors.
+    length {int} -- Number of elements per vector.
+    activity_mean {float} -- Mean number of 1s per vector.
+    activity_stdev {float} -- Standard deviation of the number of 1s per vector.
+  Returns:
+    {list(BitVector)}
+  """
+  if n <= 0:
+    return []
+  nactive = numpy.clip(rng.normal(activity_mean, activity_stdev, size=n), 0, length).astype(int)
+  # Ranking uniform keys gives every row an independent random permutation of the
+  # positions; the ones ranked below the row's activity count are the active ones.
+  ranks = rng.random((n, length)).argsort(axis=1).argsort(axis=1)
+  return bitvectors_from_rows(ranks < nactive[:, None])
@@ -0,0 +1,105 @@
+
+from multiprocessing import shared_memory
+
+import numpy  # pylint: disable=E0401
+
+from .experience import ExperienceRepo
+from .repo_arrays import situation_index_arrays
+
+
+# Every array starts at a multiple of this many bytes into the block.
+_ALIGN = 64
+
+
+
+class SharedRepoExport:
+  """An experience repo's arrays, copied into one multiprocessing.shared_memory block.
+
+  Hand the descriptor to worker processes, and they can each get a read-only view of
+  the repo with attach_shared_repo, without copying it. The exporting process owns the
+  block: close() or leave the with block once the workers are done with it.
+
+  The export is a copy as of when it was made. Later adds to the original repo
+  don't show up in it.
+  """
+
+  def __init__(self, repo, name=None):
+    """
+    Arguments:
+      repo {ExperienceRepo} -- The repo to export.
+      name {str} -- Name for the shared memory block. Made up if not given.
+    """
+    arrays = repo.to_arrays()
+    # Workers look situations up by their bits. Sort them once here, rather than
+    # once per worker.
+    arrays.update(situation_index_arrays(arrays))
+
+    layout = []
+    offset = 0
+    for array_name, array in arrays.items():
+      array = numpy.ascontiguousarray(array)
+      arrays[array_name] = array
+      layout.append((array_name, array.dtype.str, array.shape, offset))
+      offset += array.nbytes + (-array.nbytes % _ALIGN)
+
+    self.shared_memory = shared_memory.SharedMemory(name=name, create=True, size=max(offset, 1))
+    for array_name, dtype, shape, array_offset in layout:
+      view = numpy.ndarray(shape, dtype=dtype, buffer=self.shared_memory.buf, offset=array_offset)
+      view[...] = arrays[array_name]
+      del view
+
+    # Everything a worker needs to attach. It's small, and pickles.
+    self.descriptor = {'name': self.shared_memory.name, 'arrays': layout}
+
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+
+  def close(self):
+    """Release the block. Workers that are still attached keep their views working,
+    but nobody new can attach.
+    """
+    if self.shared_memory is None:
+      return
+    self.shared_memory.close()
+    self.shared_memory.unlink()
+    self.shared_memory = None
+
+
+
+def attach_shared_repo(descriptor):
+  """Get a read-only view of an exported repo, backed directly by the shared memory.
+
+  Records are built as they're looked up, and kept by the view, so a worker's own
+  memory only grows with the situations it actually visits. The neighbour index is
+  also per worker, and only built if nearest_situations gets called.
+
+  Before Python 3.13, attaching registers the block with the worker's resource
+  tracker too, so workers should be started through multiprocessing by the exporting
+  process (as process pools are), so that they share its tracker. Otherwise the block
+  gets unlinked when the first worker exits.
+  Arguments:
+    descriptor {dict} -- SharedRepoExport.descriptor.
+  Returns:
+    {ExperienceRepo} -- A repo that can be read but not added to.
+  """
+  try:
+    block = shared_memory.SharedMemory(name=descriptor['name'], track=False)
+  except TypeError:
+    block = shared_memory.SharedMemory(name=descriptor['name'])
+
+  arrays = {}
+  for array_name, dtype, shape, offset in descriptor['arrays']:
+    view = numpy.ndarray(tuple(shape), dtype=dtype, buffer=block.buf, offset=offset)
+    view.flags.writeable = False
+    arrays[array_name] = view
+
+  retval = ExperienceRepo.from_arrays(arrays, lazy=True)
+  retval.read_only = True
+  # The views are only good for as long as the block stays mapped.
+  retval.situations.owner = block
+  return retval
@@ -0,0 +1,231 @@
+
+from .bitvector import BitVector
+from .experience import SensorsRecord
+
+
+class Canonicalizer:
+  """Maps situations to a canonical representative of their symmetry class.
+
+  A symmetry is a pair of permutations, one of the sensor vector and one of the
+  actuator vector, under which the game behaves the same: doing the permuted action
+  in the permuted situation leads to the permuted outcome. All of the situations a
+  group of symmetries can turn into each other are equivalent, so we only need to
+  learn about one of them, the canonical one, which is whichever has the smallest
+  packed int.
+
+  Permutations only cover the game's own sensors and actuators. Anything past the end
+  of them, like the organism's registers, is left where it is.
+  """
+
+  def __init__(self, symmetries, max_cached=1 << 16):
+    """
+    Arguments:
+      symmetries {list(dict)} -- Each has a 'sensors' and an 'actuators' permutation,
+          where permutation[i] is the index of the element that ends up at i. They
+          don't need to be closed under composition, and the identity needn't be
+          included; we work out the whole group from them.
+      max_cached {int} -- The most situations to remember canonical forms of.
+    """
+    identity = (
+      tuple(range(len(symmetries[0]['sensors']))) if symmetries else (),
+      tuple(range(len(symmetries[0]['actuators']))) if symmetries else (),
+    )
+    generators = [(tuple(s['sensors']), tuple(s['actuators'])) for s in symmetries]
+    for sensor_perm, actuator_perm in generators:
+      if sorted(sensor_perm) != list(identity[0]) or sorted(actuator_perm) != list(identity[1]):
+        raise ValueError('symmetries', 'Every symmetry must permute the same sensors and actuators.')
+
+    # Close the generators under composition. The identity comes first, so that
+    # situations that are already canonical map to themselves through it.
+    self.group = [identity]
+    frontier = [identity]
+    while frontier:
+      g = frontier.pop()
+      for h in generators:
+        gh = (_compose(g[0], h[0]), _compose(g[1], h[1]))
+        if gh not in self.group:
+          self.group.append(gh)
+          frontier.append(gh)
+    self.inverses = [self.group.index((_invert(g[0]), _invert(g[1]))) for g in self.group]
+
+    self.max_cached = max_cached
+    self.__cache = {}
+
+
+  def __len__(self):
+    return len(self.group)
+
+
+  def canonicalize(self, sensors):
+    """
+    Arguments:
+      sensors {BitVector} -- A situation.
+    Returns:
+      {(BitVector, int)} -- The canonical situation, and which symmetry takes the given
+          situation to it.
+    """
+    sensors = SensorsRecord.compute_key(sensors)
+    retval = self.__cache.get(sensors)
+    if retval is not None:
+      return retval
+
+    retval = (sensors, 0)
+    for g in range(1, len(self.group)):
+      image = self.apply_sensors(sensors, g)
+      if image.to_int() < retval[0].to_int():
+        retval = (image, g)
+
+    if len(self.__cache) >= self.max_cached:
+      self.__cache = {}
+    self.__cache[sensors] = retval
+    return retval
+
+
+  def apply_sensors(self, sensors, g):
+    return _permute(sensors, self.group[g][0])
+
+  def apply_actuators(self, actuators, g):
+    return _permute(actuators, self.group[g][1])
+
+  def restore_sensors(self, sensors, g):
+    """Undoes apply_sensors.
+    """
+    return _permute(sensors, self.group[self.inverses[g]][0])
+
+  def restore_actuators(self, actuators, g):
+    """Undoes apply_actuators.
+    """
+    return _permute(actuators, self.group[self.inverses[g]][1])
+
+
+
+def _compose(p, q):
+  # Applying p and then q.
+  return tuple(p[i] for i in q)
+
+
+def _invert(p):
+  retval = [0] * len(p)
+  for i, j in enumerate(p):
+    retval[j] = i
+  return tuple(retval)
+
+
+def _permute(v, perm):
+  v = BitVector(v)
+  if not perm or perm == tuple(range(len(perm))):
+    return v
+  n = len(perm)
+  return BitVector([v[j] for j in perm]) + v[n:]
+
+
+
+class CanonicalExperienceRepo:
+  """An experience repo that files every experience under its canonical situation.
+
+  Experiences go into the backend translated by whichever symmetry makes their
+  situation canonical, and answers come back translated into the frame of whoever
+  asked. Situations that are equivalent under the symmetries therefore share one set
+  of records, so the repo is smaller, and what's learned in one is known in all.
+
+  What the backend holds, and so what iter_experiences and to_arrays give, is in
+  canonical form. Anything the wrapper doesn't handle itself is passed through.
+  """
+
+  def __init__(self, backend, canonicalizer):
+    """
+    Arguments:
+      backend -- The repo to keep canonical experiences in.
+      canonicalizer {Canonicalizer} -- The symmetries.
+    """
+    self.backend = backend
+    self.canonicalizer = canonicalizer
+
+
+  def __getattr__(self, name):
+    # Only called for what we don't have ourselves. Leave dunders alone, for the sake
+    # of pickling.
+    if name.startswith('__'):
+      raise AttributeError(name)
+    return getattr(self.__dict__['backend'], name)
+
+
+  @property
+  def concurrent(self):
+    return self.backend.concurrent
+
+  @concurrent.setter
+  def concurrent(self, value):
+    # The background learner switches this on; it's the backend that needs to know.
+    self.backend.concurrent = value
+
+
+  def __len__(self):
+    return len(self.backend)
+
+
+  def add(self, sensors_prev, actuators, sensors_observed, magnitude=1):
+    """See ExperienceRepo.add.
+    """
+    c = self.canonicalizer
+    situation, g = c.canonicalize(sensors_prev)
+    self.backend.add(situation, c.apply_actuators(actuators, g), c.apply_sensors(sensors_observed, g), magnitude=magnitude)
+
+
+  def get_outcome_probability(self, sensors_prev, actuators, sensors_next):
+    """See ExperienceRepo.get_outcome_probability.
+    """
+    c = self.canonicalizer
+    situation, g = c.canonicalize(sensors_prev)
+    return self.backend.get_outcome_probability(situation, c.apply_actuators(actuators, g), c.apply_sensors(sensors_next, g))
+
+
+  def lookup_outcomes(self, sensors, actuators, prob_threshold=0):
+    """See ExperienceRepo.lookup_outcomes.
+    """
+    c = self.canonicalizer
+    situation, g = c.canonicalize(sensors)
+    outcomes = self.backend.lookup_outcomes(situation, c.apply_actuators(actuators, g), prob_threshold=prob_threshold)
+    if not g:
+      return outcomes
+    return [(c.restore_sensors(s, g), p, ci) for s, p, ci in outcomes]
+
+
+  def lookup_actions(self, sensors):
+    """See ExperienceRepo.lookup_actions.
+    """
+    c = self.canonicalizer
+    situation, g = c.canonicalize(sensors)
+    actuatorses = self.backend.lookup_actions(situation)
+    if not g:
+      return actuatorses
+    return [c.restore_actuators(a, g) for a in actuatorses]
+
+
+  def get_action_count(self, sensors, actuators):
+    """See ExperienceRepo.get_action_count.
+    """
+    c = self.canonicalizer
+    situation, g = c.canonicalize(sensors)
+    return self.backend.get_action_count(situation, c.apply_actuators(actuators, g))
+
+
+  def nearest_situations(self, sensors, k=1, max_distance=None):
+    """See ExperienceRepo.nearest_situations. The backend only holds canonical
+    situations, and the image of a stored one that's nearest this situation needn't be
+    the canonical one. So every image of this situation gets searched, each hit gets
+    translated back by the symmetry that image came from, and the nearest k of them
+    all are what's returned.
+    """
+    c = self.canonicalizer
+    distances = {}
+    for g in range(len(c)):
+      image = c.apply_sensors(sensors, g)
+      for d, s in self.backend.nearest_situations(image, k=k, max_distance=max_distance):
+        # Permutations don't change Hamming distances.
+        s = c.restore_sensors(s, g)
+        if d < distances.get(s, d + 1):
+          distances[s] = d
+    neighbors = sorted(((d, s) for s, d in distances.items()), key=lambda n: n[0])
+    return neighbors[:k]
+
@@ -0,0 +1,125 @@
+
+import numpy  # pylint: disable=E0401
+
+from .bitvector import BitVector
+
+
+# Calling a LinearUtility costs about the same per term, and evaluate_many costs about
+# the same whatever the batch, so batching pays off once the batch size times the
+# number of terms gets past this. Measured on 6-bit sensors with 1 term (break-even at
+# around 48 vectors) and 30-bit sensors with 10 terms (around 5).
+_BATCH_BREAK_EVEN_TERMS = 48
+
+
+class LinearUtility:
+  """A sensor utility metric of the form bias + sum(weight[i] * sensors[i]).
+
+  Like any utility metric, it can be called on one sensor vector. Because its form is
+  known, it can also score a whole batch of sensor vectors in one numpy operation,
+  which is what OutcomeGenerator does with the outcomes that survive its cull.
+
+  min_batch is the smallest batch that evaluate_many scores faster than calling the
+  metric on each vector would.
+  """
+
+  def __init__(self, weights, bias=0):
+    """
+    Arguments:
+      weights {dict or list} -- Either a dict from sensor index to weight, or a weight
+          for every sensor. Sensors with no weight contribute nothing.
+      bias {float} -- Utility of a sensor vector that's all 0s.
+    """
+    if isinstance(weights, dict):
+      terms = sorted(weights.items())
+    else:
+      terms = [(i, w) for i, w in enumerate(weights) if w]
+    if any(i < 0 for i, _ in terms):
+      raise ValueError('weights', 'Sensor indices must not be negative.')
+
+    self.indices = numpy.array([i for i, _ in terms], dtype=numpy.int64)
+    self.weights = numpy.array([w for _, w in terms], dtype=float)
+    self.bias = float(bias)
+    self.__terms = [(int(i), float(w)) for i, w in terms]
+    self.min_batch = -(-_BATCH_BREAK_EVEN_TERMS // max(len(terms), 1))
+
+
+  def __call__(self, sensors):
+    u = self.bias
+    for i, w in self.__terms:
+      u += w * sensors[i]
+    return u
+
+
+  def evaluate_many(self, sensorses):
+    """Score many sensor vectors at once.
+    Arguments:
+      sensorses {list or ndarray} -- Sensor vectors of the same length, or a 2-D array
+          with one sensor vector per row.
+    Returns:
+      {ndarray} -- One utility per sensor vector.
+    """
+    if isinstance(sensorses, numpy.ndarray):
+      return sensorses[:, self.indices] @ self.weights + self.bias
+    if not len(sensorses):
+      return numpy.zeros(0)
+
+    length = len(sensorses[0])
+    if self.__terms and self.__terms[-1][0] >= length:
+      # Shifting by a negative amount wouldn't complain; it'd just score 0.
+      raise IndexError('Sensor index {} is out of range for vectors of length {}.'.format(
+        self.__terms[-1][0], length))
+    if length > 64:
+      rows = numpy.array([[s[i] for i in self.indices.tolist()] for s in sensorses], dtype=float)
+      return rows @ self.weights + self.bias
+
+    # Pull the weighted bits straight out of the packed ints.
+    packed = numpy.fromiter(
+      (BitVector(s).to_int() for s in sensorses), dtype=numpy.uint64, count=len(sensorses))
+    shifts = (length - 1 - self.indices).astype(numpy.uint64)
+    bits = (packed[:, None] >> shifts[None, :]) & numpy.uint64(1)
+    return bits.astype(float) @ self.weights + self.bias
+
+
+  def __repr__(self):
+    return 'LinearUtility({}, bias={})'.format(dict(self.__terms), self.bias)
+
+
+
+class CallableUtility:
+  """Adapts an arbitrary function of a sensor vector to the utility metric interface.
+  Batches are scored by calling the function once per sensor vector, so this is only
+  the fallback for metrics that can't be expressed any other way.
+  """
+  # Batching never pays.
+  min_batch = None
+
+  def __init__(self, fn):
+    """
+    Arguments:
+      fn {function} -- Takes a sensor vector, returns its utility.
+    """
+    self.fn = fn
+
+
+  def __call__(self, sensors):
+    return self.fn(sensors)
+
+
+  def evaluate_many(self, sensorses):
+    if isinstance(sensorses, numpy.ndarray):
+      sensorses = [BitVector(row) for row in sensorses]
+    return numpy.array([self.fn(s) for s in sensorses], dtype=float)
+
+
+
+def as_utility(metric):
+  """Makes sure a utility metric can score batches.
+  Arguments:
+    metric -- A utility metric object, a plain function of a sensor vector, or None.
+  Returns:
+    The metric itself if it already has evaluate_many, a CallableUtility wrapping it
+    if it's a plain function, or None.
+  """
+  if metric is None or hasattr(metric, 'evaluate_many'):
+    return metric
+  return CallableUtility(metric)
@@ -1,9 +1,12 @@
 
 
 import math
+import time
 import numpy  # pylint: disable=E0401
 
 import ipl.nnplanner as nnplanner
+from ipl.recording import TrajectoryRecorder
+from ipl.utils.quantile_sketch import QuantileSketch
 
 
 
@@ -12,55 +15,160 @@ class Organism:
   """Give it a Game, and watch it play!
   """
 
-  def __init__(self):
+  def __init__(self, seed=None):
+    """
+    Arguments:
+      seed {int} -- Seeds the organism's random number generator, which everything
+          random in its planning draws from. Organisms with the same seed, fed the
+          same sensor inputs, make the same choices.
+    """
+    self.rng = numpy.random.default_rng(seed)
+
+    # Whatever configure was given, so that the organism can be rebuilt from a checkpoint.
+    self.config = None
+
     self.action_generator = None
     self.outcome_likelihood_estimator = None
     self.outcome_generator = None
+    self.outcome_proposer = None
+    self.planner = None
+    self.background_learner = None
+    # Set this to an nnplanner.OptionLibrary to remember and reuse paths to the goal.
+    self.option_library = None
+    self.recorder = None
     self.utility_fn = None
 
     self.experience_repo = None
     self.lookahead_cache = None
+    self.canonicalizer = None
+    self.node_pool = None
+
+    # The planning tree built by the last call to choose_action. Its nodes get
+    # recycled at the start of the next call.
+    self.planned_actions = []
 
     self.sensors = None
     self.action = None
 
+    # The option we're in the middle of following, and how many of its steps we've taken.
+    self.option = None
+    self.option_step = 0
+
     self.action_outcome_lookahead = 5
+    # How many outcome candidates the OutcomeProposer draws for each action, on top of
+    # the ones actually seen before. 0 means don't build a proposer at all.
+    self.num_proposed_outcomes = 0
 
     self.num_registers = 1
     self.registers = []
+    # Learn about the game separately from the registers, and keep random actions from
+    # churning them, so that more registers don't blow up the repo and the search.
+    self.factor_registers = False
 
     self.num_turns_awake = 0
+    self.model_version = 0
+
+    # How long each choose_action took, and how many outcomes it expanded.
+    # Unlike most state, these survive reset_state.
+    self.latency_sketch = QuantileSketch()
+    self.node_count_sketch = QuantileSketch()
 
     self.verbosity = 0
     self.randomtest = False
 
+    # Set this threading.Event to abandon a choose_action call that's in progress;
+    # the call raises nnplanner.PlanningCancelled.
+    self.interrupt = None
+    # Briefly release the GIL at every level of the planning tree.
+    self.cooperative_yield = False
+
+
+
+  def start_recording(self, path, **kwargs):
+    """Record every turn from now on to a trajectory file. See TrajectoryRecorder.
+    Must be called after configure.
+    Arguments:
+      path {str} -- Where to write the file.
+    """
+    self.stop_recording()
+    self.recorder = TrajectoryRecorder(
+      path, 
+      self.outcome_generator.params.sensor_vector_dimensionality, 
+      self.action_generator.params.action_vector_dimensionality,
+      **kwargs)
+
+
+  def stop_recording(self):
+    if self.recorder is not None:
+      self.recorder.close()
+      self.recorder = None
+
+
+
+  def save_checkpoint(self, path):
+    """Save the whole organism to a file. See ipl.checkpoint.
+    """
+    from ipl.checkpoint import save_checkpoint
+    save_checkpoint(self, path)
+
+
+  @staticmethod
+  def load_checkpoint(path, lazy=False):
+    """Restore an organism saved by save_checkpoint. See ipl.checkpoint.
+    Arguments:
+      lazy {bool} -- Build experience records only as they're looked up.
+    Returns:
+      {Organism}
+    """
+    from ipl.checkpoint import load_checkpoint
+    return load_checkpoint(path, lazy=lazy)
+
 
 
   def configure(self, config):
+    self.config = dict(config)
     self.lookahead_cache = nnplanner.LookaheadCache()
     self.experience_repo = nnplanner.ExperienceRepo()
 
+    if self.factor_registers and self.num_registers:
+      self.experience_repo = nnplanner.RegisterFactoredRepo(self.num_registers)
+
+    # If the game says which situations are mirror images or rotations of each other,
+    # learn about each class of them only once. The lookahead cache stays per state:
+    # the planner also uses it to give no credit for reaching a state it already knows
+    # a way to, and knowing a way to a state's mirror image isn't the same thing.
+    self.canonicalizer = None
+    if config.get('symmetries'):
+      self.canonicalizer = nnplanner.Canonicalizer(config['symmetries'])
+      self.experience_repo = nnplanner.CanonicalExperienceRepo(self.experience_repo, self.canonicalizer)
+    self.node_pool = nnplanner.NodePool()
+
     n_actuators = config['n_actuators'] + self.num_registers
     ag_params = nnplanner.ActionGeneratorParams(
-        n_actuators, 1, 3, 3, 10)
+        n_actuators, 1, 3, 3, 10,
+        num_registers=self.num_registers if self.factor_registers else 0)
     self.action_generator = nnplanner.ActionGenerator(self, ag_params)
 
-    victory_field_idx = config['victory_field_idx']
-    def utility_fn(s): return s[victory_field_idx]
-    self.utility_fn = utility_fn
+    self.utility_fn = nnplanner.LinearUtility({config['victory_field_idx']: 1})
 
     n_sensors = config['n_sensors'] + self.num_registers
-    cg_params = nnplanner.OutcomeGeneratorParams(n_sensors, 0, 10, 0, .95)
+    cg_params = nnplanner.OutcomeGeneratorParams(n_sensors, self.num_proposed_outcomes, 10, 0, .95)
     self.outcome_generator = nnplanner.OutcomeGenerator(self, cg_params, self.utility_fn)
 
     ole_params = nnplanner.OutcomeLikelihoodEstimatorParams(
         n_sensors, n_actuators)
     self.outcome_likelihood_estimator = nnplanner.OutcomeLikelihoodEstimator(self, ole_params)
 
+    self.outcome_proposer = None
+    if self.num_proposed_outcomes:
+      op_params = nnplanner.OutcomeProposerParams(n_sensors, n_actuators)
+      self.outcome_proposer = nnplanner.OutcomeProposer(self, op_params)
+
     if self.randomtest:
       self.action_outcome_lookahead = 0
       self.action_generator.outcome_generator = None
       self.outcome_likelihood_estimator = None
+      self.outcome_proposer = None
       # self.experience_repo = None
 
 
@@ -72,9 +180,13 @@ class Organism:
     self.num_turns_awake = 0
     self.sensors = None
     self.action = None
-    self.registers = [0] * self.num_registers
+    self.option = None
+    self.option_step = 0
+    self.registers = nnplanner.BitVector([0] * self.num_registers)
     if self.lookahead_cache is not None:
       self.lookahead_cache.clear()
+    if self.option_library is not None:
+      self.option_library.reset_episode()
 
 
 
@@ -94,7 +206,7 @@ class Organism:
 
 
   def handle_sensor_input(self, sensors):
-    sensors = sensors + self.registers
+    sensors = nnplanner.BitVector(sensors) + self.registers
     self.num_turns_awake += 1
 
     if self.verbosity > 0:
@@ -104,11 +216,21 @@ class Organism:
       # Learn from the last turn's experience. This not only involves learning that
       # the thing we observed happened, but it also involves learning all the things
       # we thought might happen that didn't.
-      if self.experience_repo is not None:
-        magnitude = 1
-        if self.utility_fn(sensors) > 0:
-          magnitude = self.num_turns_awake
+      magnitude = 1
+      if self.utility_fn(sensors) > 0:
+        magnitude = self.num_turns_awake
+
+      if self.background_learner is not None:
+        # The learner takes care of the repo, the proposer and the estimator,
+        # on its own time.
+        self.background_learner.submit(
+          self.sensors,
+          self.action.actuators,
+          sensors,
+          magnitude=magnitude
+        )
 
+      elif self.experience_repo is not None:
         self.experience_repo.add(
           self.sensors,
           self.action.actuators,
@@ -116,11 +238,26 @@ class Organism:
           magnitude=magnitude
         )
 
-      if self.outcome_likelihood_estimator is not None:
+        if self.outcome_proposer is not None:
+          self.outcome_proposer.observe(
+            self.sensors,
+            self.action.actuators,
+            sensors,
+            magnitude=magnitude
+          )
+
+      if self.background_learner is None and self.outcome_likelihood_estimator is not None:
         self.outcome_likelihood_estimator.learn(self.experience_repo)
 
+      if self.option_library is not None:
+        self.option_library.observe(self.sensors, self.action.actuators, sensors)
+
       if self.verbosity > 0 and self.experience_repo is not None:
         print('ORGANISM: Experience repo size: {}'.format(len(self.experience_repo)))
+
+    # Cached repos only trust what they fetched for so many turns.
+    if hasattr(self.experience_repo, 'new_turn'):
+      self.experience_repo.new_turn()
     
     self.sensors = sensors
     self.action = None
@@ -130,10 +267,34 @@ class Organism:
     """Generate potential actions based on predicted outcomes.
     Arguments:
       force_action {list}: A vector of actuator states that the organism will be forced to perform.
+    Returns:
+      {Action} -- The chosen action. It, and its outcomes, are only valid until the next
+          call to choose_action, after which they get recycled.
     """
+    started_at = time.perf_counter()
+
+    if self.node_pool is not None:
+      self.node_pool.release_actions(self.planned_actions)
+    self.planned_actions = []
+
+    if force_action is None and self.option is not None:
+      action = self.__continue_option()
+      if action is not None:
+        self.action = action
+        self.planned_actions = [action]
+        return self.__commit(started_at, 0)
+
     # NOTE: If we want the organism to act on an action plan, then we should at least retain
     # the action tree from its last action decision. Fittingly enough, that can still theoretically
     # be found in self.action, which we haven't cleared yet.
+    if self.outcome_generator is not None:
+      self.outcome_generator.num_expanded = 0
+
+    # Plan with the latest model the background learner has published. It's ours
+    # until the next one comes along, and nobody else changes it in the meantime.
+    if self.background_learner is not None:
+      self.model_version, self.experience_repo, self.outcome_proposer = self.background_learner.published()
+
     if self.lookahead_cache is not None:
       self.lookahead_cache.clear()
 
@@ -146,10 +307,23 @@ class Organism:
         utility=0, 
         recursion_depth=self.action_outcome_lookahead)
 
-    actions = self.action_generator.generate(
-      self.sensors, 
-      recursion_depth=self.action_outcome_lookahead
-    )
+    if self.planner is not None:
+      actions = self.planner.plan(
+        self.sensors,
+        recursion_depth=self.action_outcome_lookahead
+      )
+    else:
+      # Options are only worth looking up once per decision, at the root. Deeper in
+      # the tree, the lookahead is what they'd be standing in for.
+      options = None
+      if self.option_library is not None:
+        options = self.option_library.propose(self.sensors)
+      actions = self.action_generator.generate(
+        self.sensors, 
+        recursion_depth=self.action_outcome_lookahead,
+        options=options
+      )
+    self.planned_actions = list(actions)
 
     if self.verbosity > 0:
       print('ORGANISM: Generated actions (len={})'.format(len(actions)))
@@ -160,8 +334,8 @@ class Organism:
 
     just_pick_best_action = True
     if force_action:
-      self.action = nnplanner.Action()
-      self.action.actuators = force_action
+      self.action = nnplanner.new_action(self, force_action)
+      self.planned_actions.append(self.action)
       self.action.evaluate(
         self.sensors,
         self.outcome_generator
@@ -175,10 +349,79 @@ class Organism:
         choice_ps = [1/len(choice_ps)] * len(choice_ps) 
       else:
         choice_ps = [p/choice_norm for p in choice_ps]
-      self.action = numpy.random.choice(actions, p=choice_ps)
+      self.action = actions[self.rng.choice(len(actions), p=choice_ps)]
+
+    # If the winner was credited with an option, follow the rest of it from here on.
+    self.option = self.action.option
+    self.option_step = 1
+
+    num_nodes = self.outcome_generator.num_expanded if self.outcome_generator is not None else 0
+    return self.__commit(started_at, num_nodes)
+
+
 
+  def __continue_option(self):
+    """The next step of the option we're following, if there is one and everything has
+    gone as predicted so far. Otherwise, drop the option.
+    """
+    option, step = self.option, self.option_step
+    if step >= len(option) or self.sensors != option.predictions[step - 1]:
+      self.option = None
+      return None
+
+    action = nnplanner.new_action(self, option.actuatorses[step])
+    action.expected_utility = option.expected_utility_from(step)
+    action.option = option
+    self.option_step += 1
+    return action
+
+
+
+  def adopt_action(self, action):
+    """Commit to an action that was chosen by some other organism, in lieu of calling
+    choose_action. Only makes sense if that organism was in the same situation and
+    shares our experience.
+    Arguments:
+      action {Action} -- The other organism's chosen action. We take a copy of it, since
+          the other organism will recycle it.
+    Returns:
+      {Action} -- Our copy of the action.
+    """
+    started_at = time.perf_counter()
+    if self.node_pool is not None:
+      self.node_pool.release_actions(self.planned_actions)
+
+    self.action = nnplanner.new_action(self, action.actuators)
+    self.action.expected_utility = action.expected_utility
+    for oc in action.outcomes:
+      oc_copy = nnplanner.new_outcome(self)
+      for field in nnplanner.Outcome.__slots__:
+        setattr(oc_copy, field, getattr(oc, field))
+      self.action.outcomes.append(oc_copy)
+    self.planned_actions = [self.action]
+    # Whatever option we were following, the other organism's plan replaces it.
+    self.option = None
+
+    return self.__commit(started_at, 0)
+
+
+
+  def __commit(self, started_at, num_nodes):
     self.registers = self.action.actuators[-self.num_registers:]
 
+    latency = time.perf_counter() - started_at
+    self.latency_sketch.update(latency)
+    self.node_count_sketch.update(num_nodes)
+
+    if self.recorder is not None:
+      self.recorder.record(
+        self.sensors,
+        self.action.actuators,
+        expected_utility=self.action.expected_utility,
+        node_count=num_nodes,
+        latency=latency
+      )
+
     if self.verbosity > 0:
       print('ORGANISM: Committing to action: {} (registers: {})'.format(self.action, self.registers))
 
@@ -0,0 +1,68 @@
+
+
+class OrganismBatch:
+  """Steps a crowd of organisms together, planning each distinct situation only once.
+
+  When many organisms learn into a single shared ExperienceRepo, any of them that find
+  themselves in the same situation (registers included) would plan exactly the same
+  search. The batch plans it once, with one of them, and has the rest adopt the
+  resulting action.
+  """
+
+  def __init__(self, organisms):
+    """
+    Arguments:
+      organisms {list(Organism)} -- Configured organisms. Those that should share plans
+          must share an experience repo.
+    """
+    self.organisms = list(organisms)
+
+    # How many choose_action calls the most recent batch saved.
+    self.num_deduplicated = 0
+
+
+  def __len__(self):
+    return len(self.organisms)
+
+
+  def handle_sensor_input(self, sensorses):
+    """Give every organism its own sensor input.
+    Arguments:
+      sensorses {list(list)} -- One sensor vector per organism, in order.
+    """
+    if len(sensorses) != len(self.organisms):
+      raise ValueError('sensorses', 'Must have one sensor vector per organism.')
+    for organism, sensors in zip(self.organisms, sensorses):
+      organism.handle_sensor_input(sensors)
+
+
+  def choose_actions(self):
+    """Have every organism commit to an action.
+    Returns:
+      {list(Action)} -- One action per organism, in order.
+    """
+    planned = {}
+    retval = []
+    self.num_deduplicated = 0
+    for organism in self.organisms:
+      key = (id(organism.experience_repo), organism.action_outcome_lookahead, organism.sensors)
+      leader_action = planned.get(key)
+      if leader_action is None:
+        action = organism.choose_action()
+        planned[key] = action
+      else:
+        action = organism.adopt_action(leader_action)
+        self.num_deduplicated += 1
+      retval.append(action)
+    return retval
+
+
+  def step(self, sensorses):
+    """Give every organism its sensor input, and have them all choose actions.
+    Arguments:
+      sensorses {list(list)} -- One sensor vector per organism, in order.
+    Returns:
+      {list(Action)} -- One action per organism, in order.
+    """
+    self.handle_sensor_input(sensorses)
+    return self.choose_actions()
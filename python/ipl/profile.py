@@ -0,0 +1,346 @@
+"""Profile the organism while it plays a game.
+
+    python -m ipl.profile --turns 300 --mode sampling --collapsed planner.folded
+
+Prints where the time went, broken down by planner depth and function, and can
+write the same data as collapsed stacks for flamegraph tools.
+"""
+
+import argparse
+import collections
+import os
+import signal
+import sys
+import threading
+import time
+
+import ipl
+
+
+# Every call to this marks one more level of the depth-first planning tree.
+PLANNER_LEVEL_FUNCTION = 'ActionGenerator.generate'
+
+
+
+def frame_name(code):
+  """A readable name for a function, from its code object.
+  """
+  qualname = getattr(code, 'co_qualname', code.co_name)
+  return '{}:{}'.format(os.path.splitext(os.path.basename(code.co_filename))[0], qualname)
+
+
+def fold_stack(names):
+  """Collapses the planner's recursion out of a call stack.
+
+  The depth-first planner recurses through ActionGenerator.generate, Action.evaluate,
+  OutcomeGenerator.generate and Outcome.estimate_utility once per level of lookahead,
+  so raw stacks are deep and every level looks like a different call path. Folding
+  keeps whatever is outside the planner, replaces the planner's levels with a single
+  'planner depth N' frame, and keeps only what's inside the innermost level.
+  Arguments:
+    names {list(str)} -- Frame names, outermost first.
+  Returns:
+    {tuple(str)} -- The folded stack.
+  """
+  levels = [i for i, name in enumerate(names) if name.endswith(':' + PLANNER_LEVEL_FUNCTION)]
+  if not levels:
+    return tuple(names)
+  return tuple(names[:levels[0]]) + ('planner depth {}'.format(len(levels) - 1),) + tuple(names[levels[-1]:])
+
+
+def stack_depth(stack):
+  """The planner depth of a folded stack, or None if it's outside the planner.
+  """
+  for name in stack:
+    if name.startswith('planner depth '):
+      return int(name[len('planner depth '):])
+  return None
+
+
+
+class DeterministicProfiler:
+  """Times every call and return on the current thread, with sys.setprofile.
+
+  Exact, including C calls, but it slows the program down a lot.
+  Collapsed stacks are weighted by self time, in seconds.
+  """
+
+  def __init__(self):
+    self.collapsed = collections.Counter()
+    self.__stack = []
+
+
+  def start(self):
+    self.__stack = []
+    sys.setprofile(self.__event)
+
+
+  def stop(self):
+    sys.setprofile(None)
+    # Anything still running gets credited for the time it's had so far.
+    now = time.perf_counter()
+    while self.__stack:
+      self.__pop(now)
+
+
+  def __event(self, frame, event, arg):
+    now = time.perf_counter()
+    if event == 'call':
+      self.__stack.append([frame_name(frame.f_code), now, 0])
+    elif event == 'c_call':
+      self.__stack.append(['~' + getattr(arg, '__qualname__', repr(arg)), now, 0])
+    elif event in ('return', 'c_return', 'c_exception'):
+      # Returns from frames that were already running when we started have nothing to pop.
+      if self.__stack:
+        self.__pop(now)
+
+
+  def __pop(self, now):
+    names = [entry[0] for entry in self.__stack]
+    _, started_at, child_time = self.__stack.pop()
+    elapsed = now - started_at
+    self.collapsed[fold_stack(names)] += elapsed - child_time
+    if self.__stack:
+      self.__stack[-1][2] += elapsed
+
+
+
+class SamplingProfiler:
+  """Periodically grabs the stack of the thread that started it.
+
+  Cheap enough to leave the program's timing mostly intact, but only statistically
+  accurate, and blind to C calls. Collapsed stacks are weighted by sample count.
+
+  Where the platform has interval timers, and the profiler is started on the main
+  thread, samples are taken by a SIGPROF handler, every interval seconds of CPU time.
+  Otherwise they're taken from a background thread, which can only look when the
+  profiled thread lets go of the GIL, so the samples pile up wherever it does that
+  (numpy calls, mostly).
+  """
+
+  def __init__(self, interval=.001):
+    """
+    Arguments:
+      interval {float} -- Seconds between samples.
+    """
+    self.interval = interval
+    self.collapsed = collections.Counter()
+    self.num_samples = 0
+
+    self.__root = None
+    self.__thread_id = None
+    self.__thread = None
+    self.__stopping = threading.Event()
+    self.__switch_interval = None
+    self.__previous_handler = None
+
+
+  @property
+  def uses_signals(self):
+    return hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread()
+
+
+  def start(self):
+    # Stacks are recorded from the caller of start() inwards.
+    self.__root = sys._getframe(1) # pylint: disable=W0212
+    if self.uses_signals:
+      self.__thread = None
+      self.__previous_handler = signal.signal(signal.SIGPROF, self.__on_signal)
+      signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+      return
+
+    self.__thread_id = threading.get_ident()
+    # The sampler only gets to run when the interpreter switches threads.
+    self.__switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(min(self.__switch_interval, self.interval))
+    self.__stopping.clear()
+    self.__thread = threading.Thread(target=self.__sample_thread, name='ipl-profiler', daemon=True)
+    self.__thread.start()
+
+
+  def stop(self):
+    if self.__thread is None:
+      signal.setitimer(signal.ITIMER_PROF, 0)
+      signal.signal(signal.SIGPROF, self.__previous_handler)
+      return
+    self.__stopping.set()
+    self.__thread.join()
+    self.__thread = None
+    sys.setswitchinterval(self.__switch_interval)
+
+
+  def __on_signal(self, signum, frame):
+    self.__record(frame)
+
+
+  def __sample_thread(self):
+    while not self.__stopping.wait(self.interval):
+      self.__record(sys._current_frames().get(self.__thread_id)) # pylint: disable=W0212
+
+
+  def __record(self, frame):
+    names = []
+    while frame is not None and frame is not self.__root:
+      names.append(frame_name(frame.f_code))
+      frame = frame.f_back
+    if not names:
+      return
+    names.reverse()
+    self.collapsed[fold_stack(names)] += 1
+    self.num_samples += 1
+
+
+
+def breakdown(collapsed):
+  """Totals collapsed stacks per planner depth and function.
+  Arguments:
+    collapsed {dict} -- Folded stack to weight, as collected by a profiler.
+  Returns:
+    {list(tuple)} -- (depth, function, self weight, cumulative weight) rows, heaviest
+        self weight first. depth is None outside the planner.
+  """
+  self_weight = collections.Counter()
+  cumulative_weight = collections.Counter()
+  for stack, weight in collapsed.items():
+    depth = stack_depth(stack)
+    self_weight[(depth, stack[-1])] += weight
+    # Recursion within one level still only counts once towards a function's total.
+    for name in set(stack):
+      if not name.startswith('planner depth '):
+        cumulative_weight[(depth, name)] += weight
+
+  rows = [(depth, name, self_weight[(depth, name)], w) for (depth, name), w in cumulative_weight.items()]
+  rows.sort(key=lambda r: (-r[2], -r[3]))
+  return rows
+
+
+def format_report(collapsed, unit='s', top=30):
+  """Renders the per-depth summary and the per-depth, per-function breakdown as text.
+  """
+  total = sum(collapsed.values()) or 1
+  precision = 0 if unit == 'samples' else 4
+  lines = []
+
+  per_depth = collections.Counter()
+  for stack, weight in collapsed.items():
+    per_depth[stack_depth(stack)] += weight
+  lines.append('{:>8} {:>12} {:>7}'.format('depth', 'self ' + unit, 'self%'))
+  for depth in sorted(per_depth, key=lambda d: -1 if d is None else d):
+    lines.append('{:>8} {:>12.{p}f} {:>6.1f}%'.format(
+      '-' if depth is None else depth, per_depth[depth], 100 * per_depth[depth] / total, p=precision))
+
+  lines.append('')
+  lines.append('{:>8} {:>12} {:>7} {:>12}  {}'.format('depth', 'self ' + unit, 'self%', 'cum ' + unit, 'function'))
+  for depth, name, self_w, cumulative_w in breakdown(collapsed)[:top]:
+    lines.append('{:>8} {:>12.{p}f} {:>6.1f}% {:>12.{p}f}  {}'.format(
+      '-' if depth is None else depth, self_w, 100 * self_w / total, cumulative_w, name, p=precision))
+  return '\n'.join(lines)
+
+
+def write_collapsed(collapsed, f, scale=1):
+  """Writes collapsed stacks, one 'frame;frame;frame weight' line per stack, which is
+  what flamegraph.pl, speedscope and friends read.
+  Arguments:
+    scale {float} -- Multiply weights by this and round, since the tools want integers.
+        For the deterministic profiler, 1e6 gives microseconds.
+  """
+  for stack, weight in sorted(collapsed.items()):
+    weight = int(round(weight * scale))
+    if weight > 0:
+      f.write('{} {}\n'.format(';'.join(stack), weight))
+
+
+
+def play(organism, game_factory, num_turns, max_game_turns=200):
+  """Plays games until the organism has taken num_turns turns.
+  Returns:
+    {list(float)} -- Seconds per turn.
+  """
+  latencies = []
+  while len(latencies) < num_turns:
+    organism.reset_state()
+    game = game_factory()
+    while not game.eof() and game.turn < max_game_turns and len(latencies) < num_turns:
+      started_at = time.perf_counter()
+      organism.handle_sensor_input(game.sensors())
+      action = organism.choose_action()
+      latencies.append(time.perf_counter() - started_at)
+      game.act(action.actuators)
+    organism.handle_sensor_input(game.sensors())
+  return latencies
+
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(prog='python -m ipl.profile', description=__doc__,
+    formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--mode', choices=['deterministic', 'sampling'], default='deterministic')
+  parser.add_argument('--interval', type=float, default=.001, help='Seconds between samples, in sampling mode.')
+  parser.add_argument('--turns', type=int, default=200, help='How many turns to profile.')
+  parser.add_argument('--warmup', type=int, default=0, help='Turns to play, unprofiled, before profiling.')
+  parser.add_argument('--maze', type=int, nargs=2, metavar=('BEFORE', 'AFTER'),
+    help='El maze size. Random sizes from 1 to 5 if not given.')
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--lookahead', type=int, help='Planning depth. Defaults to the organism\'s own.')
+  parser.add_argument('--planner', choices=['depthfirst', 'branchandbound', 'bestfirst'], default='depthfirst')
+  parser.add_argument('--node-budget', type=int, default=200, help='For the best-first planner.')
+  parser.add_argument('--exprepo', help='Pickled experience repo to start from.')
+  parser.add_argument('--collapsed', help='Write collapsed stacks to this file.')
+  parser.add_argument('--top', type=int, default=30, help='Rows in the breakdown.')
+  args = parser.parse_args(argv)
+
+  import pickle
+  import random
+
+  game_rng = random.Random(args.seed)
+  def game_factory():
+    if args.maze:
+      return ipl.games.ElMazeGame(*args.maze, rng=organism.rng)
+    return ipl.games.ElMazeGame(game_rng.randint(1, 5), game_rng.randint(1, 5), rng=organism.rng)
+
+  organism = ipl.Organism(seed=args.seed)
+  organism.configure(game_factory().player_config())
+  if args.lookahead is not None:
+    organism.action_outcome_lookahead = args.lookahead
+  if args.planner == 'branchandbound':
+    organism.action_generator.params.branch_and_bound = True
+  elif args.planner == 'bestfirst':
+    organism.planner = ipl.nnplanner.BestFirstPlanner(
+      organism, ipl.nnplanner.BestFirstPlannerParams(args.node_budget))
+  if args.exprepo:
+    with open(args.exprepo, 'rb') as f:
+      organism.experience_repo = pickle.load(f)
+
+  if args.warmup:
+    play(organism, game_factory, args.warmup)
+
+  if args.mode == 'deterministic':
+    profiler = DeterministicProfiler()
+    unit, scale = 's', 1e6
+  else:
+    profiler = SamplingProfiler(interval=args.interval)
+    unit, scale = 'samples', 1
+
+  started_at = time.perf_counter()
+  profiler.start()
+  try:
+    latencies = play(organism, game_factory, args.turns)
+  finally:
+    profiler.stop()
+  elapsed = time.perf_counter() - started_at
+
+  print('{} turns in {:.3f}s ({} profiling); slowest turn {:.4f}s, mean {:.4f}s'.format(
+    len(latencies), elapsed, args.mode, max(latencies), sum(latencies) / len(latencies)))
+  print()
+  print(format_report(profiler.collapsed, unit=unit, top=args.top))
+
+  if args.collapsed:
+    with open(args.collapsed, 'w') as f:
+      write_collapsed(profiler.collapsed, f, scale=scale)
+    print()
+    print('Collapsed stacks written to {}'.format(args.collapsed))
+
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,203 @@
+
+import struct
+import zlib
+
+import numpy  # pylint: disable=E0401
+
+
+FILE_MAGIC = b'IPLTRJ01'
+CHUNK_MAGIC = b'CHNK'
+
+# Header: magic, number of sensors, number of actuators, compressed flag.
+_FILE_HEADER = struct.Struct('<8sIIB7x')
+# Chunk header: magic, number of rows, then the stored byte length of each column.
+_CHUNK_HEADER = struct.Struct('<4sI6Q')
+
+# Column name and dtype, in the order they're stored. The vector columns are
+# bit-packed, one row per turn.
+COLUMNS = (
+  ('turn', numpy.uint32),
+  ('sensors', numpy.uint8),
+  ('actuators', numpy.uint8),
+  ('expected_utility', numpy.float32),
+  ('node_count', numpy.uint32),
+  ('latency', numpy.float32),
+)
+
+# Columns are padded to this many bytes, so that every uncompressed column
+# starts at an offset that numpy can map in place.
+_ALIGN = 8
+
+
+
+class TrajectoryRecorder:
+  """Writes one row per turn to a chunked, columnar binary file.
+
+  Rows are held in memory until a chunk's worth have accumulated, and then the chunk is
+  written out column by column, with the sensor and actuator vectors bit-packed. With
+  compression, each column is also zlib-compressed. Without it, the file can be
+  memory-mapped by TrajectoryReader, and analysed without reading it into memory.
+  """
+
+  def __init__(self, path, n_sensors, n_actuators, chunk_size=4096, compress=True):
+    """
+    Arguments:
+      path {str} -- Where to write the file. Anything already there is overwritten.
+      n_sensors {int} -- Number of elements in a sensor vector.
+      n_actuators {int} -- Number of elements in an actuator vector.
+      chunk_size {int} -- How many turns to hold in memory before writing them out.
+      compress {bool} -- Compress each column.
+    """
+    self.path = path
+    self.n_sensors = n_sensors
+    self.n_actuators = n_actuators
+    self.chunk_size = chunk_size
+    self.compress = compress
+
+    self.num_recorded = 0
+    self.__rows = []
+
+    self.__file = open(path, 'wb')
+    self.__file.write(_FILE_HEADER.pack(FILE_MAGIC, n_sensors, n_actuators, 1 if compress else 0))
+
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+
+  def record(self, sensors, actuators, expected_utility=0, node_count=0, latency=0):
+    """Record a turn.
+    Arguments:
+      sensors {BitVector} -- What the organism sensed.
+      actuators {BitVector} -- What it decided to do about it.
+      expected_utility {float} -- How good it thought that would be.
+      node_count {int} -- How many outcomes the planner expanded.
+      latency {float} -- How many seconds the decision took.
+    """
+    self.__rows.append((self.num_recorded, sensors, actuators, expected_utility, node_count, latency))
+    self.num_recorded += 1
+    if len(self.__rows) >= self.chunk_size:
+      self.flush()
+
+
+  def flush(self):
+    """Write out whatever turns are being held in memory.
+    """
+    if not self.__rows:
+      return
+    rows = self.__rows
+    self.__rows = []
+
+    columns = [
+      numpy.array([r[0] for r in rows], dtype=numpy.uint32),
+      numpy.packbits(numpy.array([list(r[1]) for r in rows], dtype=numpy.uint8).reshape(len(rows), self.n_sensors), axis=1),
+      numpy.packbits(numpy.array([list(r[2]) for r in rows], dtype=numpy.uint8).reshape(len(rows), self.n_actuators), axis=1),
+      numpy.array([r[3] for r in rows], dtype=numpy.float32),
+      numpy.array([r[4] for r in rows], dtype=numpy.uint32),
+      numpy.array([r[5] for r in rows], dtype=numpy.float32),
+    ]
+
+    blobs = []
+    for column in columns:
+      blob = column.tobytes()
+      if self.compress:
+        blob = zlib.compress(blob, 1)
+      blobs.append(blob + b'\0' * (-len(blob) % _ALIGN))
+
+    self.__file.write(_CHUNK_HEADER.pack(CHUNK_MAGIC, len(rows), *[len(b) for b in blobs]))
+    for blob in blobs:
+      self.__file.write(blob)
+
+
+  def close(self):
+    if self.__file is None:
+      return
+    self.flush()
+    self.__file.close()
+    self.__file = None
+
+
+
+class TrajectoryReader:
+  """Reads files written by TrajectoryRecorder.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    with open(path, 'rb') as f:
+      magic, self.n_sensors, self.n_actuators, compressed = _FILE_HEADER.unpack(f.read(_FILE_HEADER.size))
+      if magic != FILE_MAGIC:
+        raise ValueError('path', 'Not a trajectory file: {}'.format(path))
+      self.compressed = bool(compressed)
+
+      # For every chunk, its row count and the file offset and stored length of each column.
+      self.chunks = []
+      offset = _FILE_HEADER.size
+      while True:
+        header = f.read(_CHUNK_HEADER.size)
+        if len(header) < _CHUNK_HEADER.size:
+          break
+        magic, nrows, *lengths = _CHUNK_HEADER.unpack(header)
+        if magic != CHUNK_MAGIC:
+          raise ValueError('path', 'Corrupt trajectory file: {}'.format(path))
+        offset += _CHUNK_HEADER.size
+        column_offsets = []
+        for length in lengths:
+          column_offsets.append((offset, length))
+          offset += length
+        self.chunks.append((nrows, column_offsets))
+        f.seek(offset)
+
+
+  def __len__(self):
+    return sum(nrows for nrows, _ in self.chunks)
+
+
+  def iter_chunks(self, unpack=True):
+    """Walk the file one chunk at a time. Uncompressed files are memory-mapped rather than read.
+    Arguments:
+      unpack {bool} -- Unpack the sensor and actuator columns into one byte per element.
+    Yields:
+      {dict} -- Column name to numpy array, for one chunk's worth of turns.
+    """
+    with open(self.path, 'rb') as f:
+      for nrows, column_offsets in self.chunks:
+        chunk = {}
+        for (name, dtype), (offset, length) in zip(COLUMNS, column_offsets):
+          chunk[name] = self.__read_column(f, name, dtype, nrows, offset, length)
+        if unpack:
+          chunk['sensors'] = numpy.unpackbits(chunk['sensors'], axis=1, count=self.n_sensors)
+          chunk['actuators'] = numpy.unpackbits(chunk['actuators'], axis=1, count=self.n_actuators)
+        yield chunk
+
+
+  def read(self, unpack=True):
+    """Read the whole file.
+    Returns:
+      {dict} -- Column name to numpy array, one row per turn.
+    """
+    chunks = list(self.iter_chunks(unpack=unpack))
+    if not chunks:
+      return {name: numpy.zeros(0, dtype=dtype) for name, dtype in COLUMNS}
+    return {name: numpy.concatenate([c[name] for c in chunks]) for name, _ in COLUMNS}
+
+
+  def __read_column(self, f, name, dtype, nrows, offset, length):
+    shape = (nrows,)
+    if name == 'sensors':
+      shape = (nrows, (self.n_sensors + 7) // 8)
+    elif name == 'actuators':
+      shape = (nrows, (self.n_actuators + 7) // 8)
+
+    if not self.compressed:
+      if nrows == 0:
+        return numpy.zeros(shape, dtype=dtype)
+      return numpy.memmap(self.path, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+    f.seek(offset)
+    blob = zlib.decompressobj().decompress(f.read(length))
+    return numpy.frombuffer(blob, dtype=dtype).reshape(shape)
+
@@ -0,0 +1,169 @@
+
+import math
+import random
+
+import numpy  # pylint: disable=E0401
+
+
+class QuantileSketch:
+  """A KLL streaming quantile sketch.
+
+  Keeps a few hundred values no matter how many are pushed, and answers quantile
+  queries with a rank error of roughly 1.7/k. Values live in a stack of compactors;
+  the one at level h holds values that each stand for 2**h of the originals. When a
+  compactor fills up, it's sorted and every other value (starting from a random one
+  of the first two) is promoted to the level above, and the rest are thrown away.
+  Lower levels get exponentially smaller capacities, which is where the space
+  savings come from.
+
+  Sketches can be merged, so workers can each keep their own and combine them at
+  the end.
+  """
+
+  def __init__(self, k=200, seed=None):
+    """
+    Arguments:
+      k {int} -- Capacity of the top compactor. Bigger is more accurate.
+      seed {int} -- Seeds the choice of which values get promoted.
+    """
+    if k < 8:
+      raise ValueError('k', 'Must be at least 8.')
+    self.k = k
+    self.rng = random.Random(seed)
+
+    self.n = 0
+    self.min = math.inf
+    self.max = -math.inf
+    self.compactors = [[]]
+    self.__size = 0
+    self.__max_size = 0
+    self.__update_capacities()
+
+
+  def __len__(self):
+    return self.n
+
+
+  def capacity(self, level):
+    depth = len(self.compactors) - level - 1
+    return max(2, int(math.ceil(self.k * (2 / 3) ** depth)))
+
+
+  def update(self, x):
+    """Add a value.
+    """
+    x = float(x)
+    self.n += 1
+    if x < self.min:
+      self.min = x
+    if x > self.max:
+      self.max = x
+    self.compactors[0].append(x)
+    self.__size += 1
+    if self.__size >= self.__max_size:
+      self.__compress()
+
+
+  def update_many(self, values):
+    """Add a batch of values.
+    """
+    values = numpy.asarray(values, dtype=float).ravel()
+    if not len(values):
+      return
+    self.n += len(values)
+    self.min = min(self.min, float(values.min()))
+    self.max = max(self.max, float(values.max()))
+    self.compactors[0].extend(values.tolist())
+    self.__size += len(values)
+    if self.__size >= self.__max_size:
+      self.__compress()
+
+
+  def merge(self, other):
+    """Fold another sketch into this one, as if its values had been pushed here.
+    Arguments:
+      other {QuantileSketch} -- Another sketch. Its k needn't match.
+    """
+    while len(self.compactors) < len(other.compactors):
+      self.compactors.append([])
+    for level, items in enumerate(other.compactors):
+      self.compactors[level].extend(items)
+    self.n += other.n
+    self.min = min(self.min, other.min)
+    self.max = max(self.max, other.max)
+    self.__size = sum(len(c) for c in self.compactors)
+    self.__update_capacities()
+    self.__compress()
+
+
+  def __update_capacities(self):
+    self.__max_size = sum(self.capacity(h) for h in range(len(self.compactors)))
+
+
+  def __compress(self):
+    while self.__size >= self.__max_size:
+      for level, items in enumerate(self.compactors):
+        if len(items) < self.capacity(level):
+          continue
+        if level + 1 == len(self.compactors):
+          self.compactors.append([])
+          self.__update_capacities()
+
+        num_items = len(items)
+        items.sort()
+        # An odd value out stays behind, so that what we promote pairs up exactly.
+        leftover = [items.pop()] if len(items) % 2 else []
+        promoted = items[self.rng.randint(0, 1)::2]
+        self.compactors[level + 1].extend(promoted)
+        self.compactors[level] = leftover
+        self.__size += len(leftover) + len(promoted) - num_items
+        # Only do as much compaction as we have to.
+        if self.__size < self.__max_size:
+          break
+
+
+  def __weighted(self):
+    values = []
+    weights = []
+    for level, items in enumerate(self.compactors):
+      values.extend(items)
+      weights.extend([1 << level] * len(items))
+    values = numpy.array(values)
+    weights = numpy.array(weights, dtype=numpy.int64)
+    order = numpy.argsort(values, kind='stable')
+    return values[order], numpy.cumsum(weights[order])
+
+
+  def quantile(self, q):
+    """Estimate quantiles.
+    Arguments:
+      q {float or list} -- Quantiles, from 0 to 1.
+    Returns:
+      {float or ndarray} -- The estimated values. NaN if nothing's been pushed.
+    """
+    qs = numpy.asarray(q, dtype=float)
+    if not self.n:
+      return numpy.full(qs.shape, numpy.nan) if qs.ndim else math.nan
+    values, cumulative = self.__weighted()
+    # The smallest value whose weighted rank reaches q of the total.
+    positions = numpy.searchsorted(cumulative, numpy.clip(qs, 0, 1) * cumulative[-1], side='left')
+    result = values[numpy.minimum(positions, len(values) - 1)]
+    result = numpy.where(qs <= 0, self.min, numpy.where(qs >= 1, self.max, result))
+    return result if qs.ndim else float(result)
+
+
+  def rank(self, x):
+    """Estimate what fraction of the values pushed were at most x.
+    """
+    if not self.n:
+      return math.nan
+    values, cumulative = self.__weighted()
+    i = numpy.searchsorted(values, x, side='right')
+    return float(cumulative[i - 1] / cumulative[-1]) if i else 0.0
+
+
+  def __repr__(self):
+    if not self.n:
+      return 'QuantileSketch(n=0)'
+    p50, p95, p99 = self.quantile([.5, .95, .99])
+    return 'p50={:.4g} p95={:.4g} p99={:.4g} (n={})'.format(p50, p95, p99, self.n)
@@ -3,6 +3,8 @@
 
 import math
 
+import numpy  # pylint: disable=E0401
+
 class RunningStats:
 
   def __init__(self):
@@ -14,6 +16,10 @@ class RunningStats:
 
   def clear(self):
     self.n = 0
+    self.old_m = 0
+    self.new_m = 0
+    self.old_s = 0
+    self.new_s = 0
 
   def push(self, x):
     self.n += 1
@@ -41,3 +47,216 @@ class RunningStats:
   def __repr__(self):
     retval = '{:.2f}±{:.2f}(n={})'.format( self.mean(), self.standard_deviation(), self.n)
     return retval
+
+
+
+class RunningStatsBank:
+  """Welford accumulators for many metrics at once, kept in numpy arrays.
+
+  Metrics are either named or just numbered. Samples can be pushed for every metric at
+  once, a whole batch at a time, and banks that accumulated different samples (say, in
+  different worker processes) can be merged. Each metric also keeps a uniform
+  reservoir sample of its values, for percentiles.
+  """
+
+  def __init__(self, metrics, reservoir_size=1024, seed=None):
+    """
+    Arguments:
+      metrics {int or list(str)} -- How many metrics, or their names.
+      reservoir_size {int} -- How many samples per metric to keep for percentiles.
+      seed {int} -- Seeds the reservoir sampling.
+    """
+    if isinstance(metrics, int):
+      self.names = None
+      size = metrics
+    else:
+      self.names = list(metrics)
+      size = len(self.names)
+    self.__index = {name: i for i, name in enumerate(self.names or [])}
+
+    self.reservoir_size = reservoir_size
+    self.rng = numpy.random.default_rng(seed)
+
+    self.n = numpy.zeros(size, dtype=numpy.int64)
+    self.m = numpy.zeros(size)
+    self.s = numpy.zeros(size)
+    self.min = numpy.full(size, numpy.inf)
+    self.max = numpy.full(size, -numpy.inf)
+    self.reservoir = numpy.zeros((size, reservoir_size))
+
+
+  def __len__(self):
+    return len(self.n)
+
+
+  def index(self, metric):
+    """The position of a metric, given its name or position.
+    """
+    if isinstance(metric, str):
+      if metric not in self.__index:
+        raise ValueError('metric', 'No metric named {}.'.format(metric))
+      return self.__index[metric]
+    return metric
+
+
+  def clear(self):
+    self.n[:] = 0
+    self.m[:] = 0
+    self.s[:] = 0
+    self.min[:] = numpy.inf
+    self.max[:] = -numpy.inf
+
+
+  def push(self, values, metric=None):
+    """Add samples.
+    Arguments:
+      values {array} -- Without a metric, either one value per metric, or a 2-D array
+          with one row of values per metric per sample. With a metric, any number of
+          samples of just that metric.
+      metric {str or int} -- Which metric the values are for.
+    """
+    values = numpy.asarray(values, dtype=float)
+    if metric is not None:
+      self.__push(numpy.array([self.index(metric)]), values.reshape(-1, 1))
+      return
+    if values.ndim == 1:
+      values = values.reshape(1, -1)
+    if values.shape[1] != len(self):
+      raise ValueError('values', 'Expected {} values per sample, got {}.'.format(len(self), values.shape[1]))
+    self.__push(numpy.arange(len(self)), values)
+
+
+  def __push(self, idx, values):
+    k = len(values)
+    if not k:
+      return
+    n_prev = self.n[idx]
+    self.__sample(idx, n_prev, values)
+
+    # Welford for the batch on its own, then Chan to fold it into what we had.
+    batch_m = values.mean(axis=0)
+    batch_s = ((values - batch_m) ** 2).sum(axis=0)
+    self.m[idx], self.s[idx], self.n[idx] = _chan(
+      self.m[idx], self.s[idx], n_prev, batch_m, batch_s, k)
+    self.min[idx] = numpy.minimum(self.min[idx], values.min(axis=0))
+    self.max[idx] = numpy.maximum(self.max[idx], values.max(axis=0))
+
+
+  def __sample(self, idx, n_prev, values):
+    # Algorithm R, a batch at a time: the t'th value seen goes into a random slot of
+    # the reservoir with probability reservoir_size/(t+1).
+    t = n_prev[None, :] + numpy.arange(len(values))[:, None]
+    slots = numpy.where(
+      t < self.reservoir_size, t,
+      (self.rng.random(t.shape) * (t + 1)).astype(numpy.int64))
+    keep = slots < self.reservoir_size
+    rows = numpy.broadcast_to(idx[None, :], t.shape)
+    self.reservoir[rows[keep], slots[keep]] = values[keep]
+
+
+  def merge(self, other):
+    """Fold another bank's samples into this one, as if they'd all been pushed here.
+    Arguments:
+      other {RunningStatsBank} -- A bank with the same metrics.
+    """
+    if len(other) != len(self) or other.names != self.names:
+      raise ValueError('other', 'Banks must have the same metrics.')
+    if other.reservoir_size != self.reservoir_size:
+      raise ValueError('other', 'Banks must have the same reservoir size.')
+
+    for i in range(len(self)):
+      self.reservoir[i] = self.__merge_reservoir(
+        self.reservoir[i], self.n[i], other.reservoir[i], other.n[i])
+
+    self.m, self.s, self.n = _chan(self.m, self.s, self.n, other.m, other.s, other.n)
+    self.min = numpy.minimum(self.min, other.min)
+    self.max = numpy.maximum(self.max, other.max)
+
+
+  def __merge_reservoir(self, mine, n_mine, theirs, n_theirs):
+    r = self.reservoir_size
+    filled_mine = min(n_mine, r)
+    filled_theirs = min(n_theirs, r)
+    if n_mine + n_theirs <= r:
+      merged = mine.copy()
+      merged[filled_mine:filled_mine + filled_theirs] = theirs[:filled_theirs]
+      return merged
+
+    # Each reservoir is a uniform sample of its own stream, so drawing from each in
+    # proportion to how many values it stands for gives a uniform sample of both.
+    from_mine = self.rng.hypergeometric(n_mine, n_theirs, r) if n_mine and n_theirs else (r if n_mine else 0)
+    merged = numpy.concatenate([
+      self.rng.choice(mine[:filled_mine], from_mine, replace=False),
+      self.rng.choice(theirs[:filled_theirs], r - from_mine, replace=False),
+    ])
+    self.rng.shuffle(merged)
+    return merged
+
+
+  def count(self, metric=None):
+    return self.n if metric is None else self.n[self.index(metric)]
+
+
+  def mean(self, metric=None):
+    m = numpy.where(self.n > 0, self.m, 0.0)
+    return m if metric is None else m[self.index(metric)]
+
+
+  def variance(self, metric=None):
+    v = numpy.where(self.n > 1, self.s / numpy.maximum(self.n - 1, 1), 0.0)
+    return v if metric is None else v[self.index(metric)]
+
+
+  def standard_deviation(self, metric=None):
+    return numpy.sqrt(self.variance(metric))
+
+
+  def percentile(self, q, metric=None):
+    """Estimate percentiles from the reservoir samples.
+    Arguments:
+      q {float or array} -- Percentiles, from 0 to 100.
+      metric {str or int} -- Which metric. All of them if not given.
+    Returns:
+      {ndarray} -- Indexed by metric (if no metric was given) and then by q. NaN for
+          metrics with no samples.
+    """
+    idx = range(len(self)) if metric is None else [self.index(metric)]
+    retval = []
+    for i in idx:
+      filled = min(self.n[i], self.reservoir_size)
+      if filled:
+        retval.append(numpy.percentile(self.reservoir[i, :filled], q))
+      else:
+        retval.append(numpy.full(numpy.shape(q), numpy.nan))
+    retval = numpy.array(retval)
+    return retval if metric is None else retval[0]
+
+
+  def stats(self, metric):
+    """A RunningStats holding one metric's moments, for printing and the like.
+    """
+    i = self.index(metric)
+    rs = RunningStats()
+    rs.n = int(self.n[i])
+    rs.old_m = rs.new_m = float(self.m[i])
+    rs.old_s = rs.new_s = float(self.s[i])
+    return rs
+
+
+  def __repr__(self):
+    labels = self.names if self.names is not None else range(len(self))
+    return 'RunningStatsBank({})'.format(', '.join(
+      '{}={}'.format(label, self.stats(i)) for i, label in enumerate(labels)))
+
+
+
+def _chan(m_a, s_a, n_a, m_b, s_b, n_b):
+  """Chan et al.'s formula for combining the count, mean and sum of squared deviations
+  of two sets of samples.
+  """
+  n = n_a + n_b
+  safe_n = numpy.maximum(n, 1)
+  delta = m_b - m_a
+  m = m_a + delta * n_b / safe_n
+  s = s_a + s_b + delta ** 2 * n_a * n_b / safe_n
+  return m, s, n
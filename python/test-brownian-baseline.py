@@ -1,6 +1,7 @@
 import ipl 
 import pickle
-import numpy # pylint: disable=E0401
+from ipl.utils.running_stats import RunningStats
+from ipl.utils.quantile_sketch import QuantileSketch
 
 organism = ipl.Organism()
 organism.randomtest = True
@@ -16,7 +17,8 @@ if not organism.randomtest:
     print('No experience repository file found. Starting from scratch.')
 
 
-aturns = []
+turn_stats = RunningStats()
+turn_quantiles = QuantileSketch()
 
 for irun in range(1000):
   organism.reset_state()
@@ -34,8 +36,12 @@ for irun in range(1000):
   numturns = game.turn
   print('Run {} completed in {} turns.'.format(irun+1, numturns))
 
-  aturns.append(numturns)
+  turn_stats.push(numturns)
+  turn_quantiles.update(numturns)
 
 print()
 print('RESULTS')
-print('# turns completion: {:.2f} +- {:.2f}'.format(numpy.mean(aturns), numpy.std(aturns)))
+print('# turns completion: {:.2f} +- {:.2f}'.format(turn_stats.mean(), turn_stats.standard_deviation()))
+print('# turns completion: {}'.format(turn_quantiles))
+print('choose_action latency (s): {}'.format(organism.latency_sketch))
+print('choose_action tree size: {}'.format(organism.node_count_sketch))
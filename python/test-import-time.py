@@ -0,0 +1,35 @@
+import statistics
+import subprocess
+import sys
+
+# How long a fresh interpreter takes to get each of these done. Every run is its own
+# process, so nothing is cached between them.
+SNIPPETS = [
+  ('python itself', 'pass'),
+  ('import ipl', 'import ipl'),
+  ('one game', 'from ipl.games import ElMazeGame; ElMazeGame(3, 2)'),
+  ('the experience repo', 'from ipl.nnplanner import ExperienceRepo; ExperienceRepo()'),
+  ('an organism', 'import ipl; ipl.Organism()'),
+  ('everything', 'from ipl import *; from ipl.games import *; from ipl.nnplanner import *'),
+]
+NUM_RUNS = 15
+
+
+def time_snippet(code):
+  # Timed from inside the child, so process startup noise doesn't swamp small differences.
+  program = (
+    'import time, sys\n'
+    't = time.perf_counter()\n'
+    '{}\n'
+    'print(time.perf_counter() - t, "numpy" in sys.modules)\n'
+  ).format(code)
+  out = subprocess.run([sys.executable, '-c', program], check=True, capture_output=True, text=True).stdout
+  elapsed, numpy_loaded = out.split()
+  return float(elapsed), numpy_loaded == 'True'
+
+
+print('{:<24} {:>10} {:>10}  {}'.format('', 'median ms', 'min ms', 'loads numpy'))
+for label, code in SNIPPETS:
+  results = [time_snippet(code) for _ in range(NUM_RUNS)]
+  times = [t * 1000 for t, _ in results]
+  print('{:<24} {:>10.2f} {:>10.2f}  {}'.format(label, statistics.median(times), min(times), results[0][1]))